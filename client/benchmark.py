@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from generated import messenger_pb2
+from generated import messenger_pb2_grpc
+import grpc
+
+
+BENCH_PREFIX = "bench:"
+
+
+class LatencyRecorder:
+    """Задержки одной операции в секундах"""
+
+    def __init__(self):
+        self.samples = []
+        self.errors = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self, elapsed):
+        samples = sorted(self.samples)
+        result = {
+            "count": len(samples),
+            "errors": self.errors,
+            "throughput_per_s": round(len(samples) / elapsed, 2) if elapsed > 0 else 0,
+        }
+        if samples:
+            result.update({
+                "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+                "p50_ms": round(percentile(samples, 50) * 1000, 3),
+                "p95_ms": round(percentile(samples, 95) * 1000, 3),
+                "p99_ms": round(percentile(samples, 99) * 1000, 3),
+                "max_ms": round(samples[-1] * 1000, 3),
+            })
+        return result
+
+
+def percentile(sorted_samples, p):
+    index = max(0, min(len(sorted_samples) - 1, int(round(p / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+class Benchmark:
+    """Нагрузочный прогон: много пользователей со стримами и унарными вызовами"""
+
+    def __init__(self, args):
+        self.args = args
+        self.run_id = args.run_id or uuid.uuid4().hex[:8]
+        self.channels = []
+        self.stubs = []
+        self.chats = []
+        self.members = {}  # {chat_id: [nickname]}
+        self.rpc = {}  # {rpc_name: LatencyRecorder}
+        self.delivery = {}  # {ChatMessageType name: LatencyRecorder}
+        self.sent = {}  # {ChatMessageType name: число отправленных через стрим}
+        self.expected = {}  # {ChatMessageType name: ожидаемое число доставок}
+        self.connected = set()
+        self.stopping = False
+
+    def recorder(self, registry, name):
+        if name not in registry:
+            registry[name] = LatencyRecorder()
+        return registry[name]
+
+    async def call(self, name, method, request):
+        """Унарный вызов с замером задержки"""
+        recorder = self.recorder(self.rpc, name)
+        started = time.perf_counter()
+        try:
+            response = await method(request)
+        except grpc.aio.AioRpcError:
+            recorder.errors += 1
+            return None
+        recorder.add(time.perf_counter() - started)
+        return response
+
+    def stub_for(self, index):
+        return self.stubs[index % len(self.stubs)]
+
+    def nickname(self, index):
+        return f"bench-{self.run_id}-user{index}"
+
+    async def setup(self):
+        for _ in range(self.args.channels):
+            channel = grpc.aio.insecure_channel(self.args.server)
+            self.channels.append(channel)
+            self.stubs.append(messenger_pb2_grpc.MessengerStub(channel))
+
+        # Каждый чат создаёт первый из его участников, остальные вступают
+        for chat_index in range(self.args.chats):
+            owner = chat_index % self.args.users
+            response = await self.call("CreateChat", self.stub_for(owner).CreateChat, messenger_pb2.CreateChatRequest(
+                name=f"bench-{self.run_id}-chat{chat_index}",
+                nickname=self.nickname(owner),
+            ))
+            if response is None:
+                raise RuntimeError(f"не удалось создать чат {chat_index}")
+            self.chats.append(response.chat_id)
+            self.members[response.chat_id] = [self.nickname(owner)]
+
+        joins = []
+        for user_index in range(self.args.users):
+            for chat_id in self.user_chats(user_index):
+                if self.nickname(user_index) in self.members[chat_id]:
+                    continue
+                self.members[chat_id].append(self.nickname(user_index))
+                joins.append(self.call("JoinChat", self.stub_for(user_index).JoinChat, messenger_pb2.JoinChatRequest(
+                    chat_id=chat_id,
+                    nickname=self.nickname(user_index),
+                )))
+        await asyncio.gather(*joins)
+
+    def user_chats(self, user_index):
+        count = min(self.args.chats_per_user, len(self.chats))
+        return [self.chats[(user_index + offset) % len(self.chats)] for offset in range(count)]
+
+    async def run(self):
+        await self.setup()
+
+        users = [BenchUser(self, index) for index in range(self.args.users)]
+        tasks = [asyncio.create_task(user.run()) for user in users]
+
+        # Ждём, пока стримы зарегистрируются, чтобы не считать потерями сообщения до подключения
+        deadline = time.perf_counter() + 10
+        while len(self.connected) < len(users) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        for user in users:
+            user.start.set()
+        await asyncio.sleep(self.args.duration)
+        self.stopping = True
+        elapsed = time.perf_counter() - started
+
+        # Даём доставиться сообщениям, отправленным в последний момент
+        await asyncio.sleep(self.args.drain)
+        for user in users:
+            user.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for channel in self.channels:
+            await channel.close()
+
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        delivery = {}
+        for name, recorder in self.delivery.items():
+            summary = recorder.summary(elapsed)
+            summary["sent"] = self.sent.get(name, 0)
+            summary["expected"] = self.expected.get(name, 0)
+            delivery[name] = summary
+        for name, count in self.sent.items():
+            if name not in delivery:
+                delivery[name] = {"count": 0, "sent": count, "expected": self.expected.get(name, 0)}
+
+        return {
+            "run_id": self.run_id,
+            "server": self.args.server,
+            "config": {
+                "users": self.args.users,
+                "chats": self.args.chats,
+                "chats_per_user": self.args.chats_per_user,
+                "rate_per_user": self.args.rate,
+                "unary_ratio": self.args.unary_ratio,
+                "poll_interval_s": self.args.poll_interval,
+                "message_size": self.args.message_size,
+                "channels": self.args.channels,
+                "duration_s": self.args.duration,
+            },
+            "connected_users": len(self.connected),
+            "elapsed_s": round(elapsed, 3),
+            "rpc": {name: recorder.summary(elapsed) for name, recorder in sorted(self.rpc.items())},
+            "delivery": delivery,
+        }
+
+
+class BenchUser:
+    """Один симулированный пользователь"""
+
+    def __init__(self, bench, index):
+        self.bench = bench
+        self.args = bench.args
+        self.index = index
+        self.nickname = bench.nickname(index)
+        self.stub = bench.stub_for(index)
+        self.chats = bench.user_chats(index)
+        self.outbound = asyncio.Queue()
+        self.start = asyncio.Event()
+        self.call = None
+        self.padding = "x" * max(0, self.args.message_size)
+
+    def stop(self):
+        self.outbound.put_nowait(None)
+        if self.call is not None:
+            self.call.cancel()
+
+    async def outbound_iterator(self):
+        while True:
+            message = await self.outbound.get()
+            if message is None:
+                return
+            yield message
+
+    async def run(self):
+        self.outbound.put_nowait(messenger_pb2.ChatMessage(
+            content="heartbeat",
+            nickname=self.nickname,
+            type=messenger_pb2.USER_CONNECTED,
+        ))
+        self.call = self.stub.ChatStream(self.outbound_iterator())
+
+        receiver = asyncio.create_task(self.receive())
+        # Регистрация стрима на сервере происходит по первому кадру, подтверждения нет
+        await asyncio.sleep(0.2)
+        self.bench.connected.add(self.nickname)
+
+        await self.start.wait()
+        workers = [asyncio.create_task(self.send_loop())]
+        if self.args.poll_interval > 0:
+            workers.append(asyncio.create_task(self.poll_loop()))
+
+        await asyncio.gather(*workers, return_exceptions=True)
+        await asyncio.gather(receiver, return_exceptions=True)
+
+    async def send_loop(self):
+        if self.args.rate <= 0 or not self.chats:
+            return
+        while not self.bench.stopping:
+            await asyncio.sleep(random.expovariate(self.args.rate))
+            if self.bench.stopping:
+                return
+
+            chat_id = random.choice(self.chats)
+            content = f"{BENCH_PREFIX}{time.perf_counter_ns()}:{self.padding}"
+
+            if random.random() < self.args.unary_ratio:
+                await self.bench.call("SendMessage", self.stub.SendMessage, messenger_pb2.SendMessageRequest(
+                    message=content,
+                    chat_id=chat_id,
+                    nickname=self.nickname,
+                ))
+                continue
+
+            name = messenger_pb2.ChatMessageType.Name(messenger_pb2.MESSAGE)
+            self.bench.sent[name] = self.bench.sent.get(name, 0) + 1
+            self.bench.expected[name] = self.bench.expected.get(name, 0) + len(self.bench.members[chat_id]) - 1
+            self.outbound.put_nowait(messenger_pb2.ChatMessage(
+                content=content,
+                nickname=self.nickname,
+                chat_id=chat_id,
+                type=messenger_pb2.MESSAGE,
+            ))
+
+    async def poll_loop(self):
+        # Разносим опросы пользователей по времени, чтобы не было синхронных всплесков
+        await asyncio.sleep(random.uniform(0, self.args.poll_interval))
+        while not self.bench.stopping:
+            await self.bench.call("GetUserChats", self.stub.GetUserChats, messenger_pb2.GetUserChatsRequest(
+                nickname=self.nickname,
+            ))
+            if self.chats:
+                await self.bench.call("GetMessages", self.stub.GetMessages, messenger_pb2.GetMessagesRequest(
+                    chat_id=random.choice(self.chats),
+                    limit=self.args.page_size,
+                ))
+            await asyncio.sleep(self.args.poll_interval)
+
+    async def receive(self):
+        try:
+            async for message in self.call:
+                if not message.content.startswith(BENCH_PREFIX):
+                    continue
+                sent_ns = int(message.content[len(BENCH_PREFIX):].split(":", 1)[0])
+                name = messenger_pb2.ChatMessageType.Name(message.type)
+                self.bench.recorder(self.bench.delivery, name).add((time.perf_counter_ns() - sent_ns) / 1e9)
+        except (asyncio.CancelledError, grpc.aio.AioRpcError):
+            pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест сервиса Messenger')
+    parser.add_argument('--server', default='localhost:8080', help='Адрес сервера (по умолчанию: localhost:8080)')
+    parser.add_argument('--users', type=int, default=100, help='Число симулированных пользователей')
+    parser.add_argument('--chats', type=int, default=10, help='Число чатов')
+    parser.add_argument('--chats-per-user', type=int, default=1, help='В скольких чатах состоит каждый пользователь')
+    parser.add_argument('--rate', type=float, default=1.0, help='Сообщений в секунду на пользователя')
+    parser.add_argument('--unary-ratio', type=float, default=0.1, help='Доля сообщений, отправляемых через SendMessage, а не через стрим')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='Период GetUserChats/GetMessages на пользователя, 0 - не опрашивать')
+    parser.add_argument('--page-size', type=int, default=50, help='limit для GetMessages')
+    parser.add_argument('--message-size', type=int, default=32, help='Размер полезной нагрузки сообщения в байтах')
+    parser.add_argument('--channels', type=int, default=8, help='Число gRPC-каналов, между которыми делятся пользователи')
+    parser.add_argument('--duration', type=float, default=30.0, help='Длительность нагрузки в секундах')
+    parser.add_argument('--drain', type=float, default=2.0, help='Сколько секунд ждать доставки после окончания нагрузки')
+    parser.add_argument('--run-id', default=None, help='Префикс ников и чатов (по умолчанию случайный)')
+    parser.add_argument('--output', default=None, help='Файл для JSON-отчёта (по умолчанию stdout)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(Benchmark(args).run())
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"✅ Отчёт сохранён в {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,742 @@
+import asyncio
+import random
+from collections import deque, namedtuple
+from message_cache import MessageCache
+from message_store import DEFAULT_HISTORY_LIMIT, MessageStore, StoredMessage
+from metrics import ClientMetrics
+from outbound_queue import DEFAULT_OUTBOUND_QUEUE_SIZE, DROPPED_OLDEST, MERGE, REJECTED, OutboundQueue
+from tracing import NOOP_SPAN, SPAN_KIND_CONSUMER, SPAN_KIND_PRODUCER, AioTracingInterceptor, SpanContext, Tracer
+from transport import TransportOptions
+from generated import messenger_pb2
+from generated import messenger_pb2_grpc
+import grpc
+
+
+# Heartbeat уходит, только если стрим простаивал столько секунд в обе стороны
+HEARTBEAT_INTERVAL = 30
+HISTORY_PAGE_SIZE = 50
+# Сообщения в один чат, набранные за это окно, уходят одним кадром MESSAGE_BATCH
+SEND_COALESCE_WINDOW = 0.02
+SEND_BATCH_SIZE = 100
+# Переподключение стрима: экспоненциальная задержка со случайным разбросом
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+# Нет кадра для отправки: истёк интервал heartbeat или соединение закрыто
+NO_FRAME = object()
+# Очередь полученных кадров между чтением стрима и их обработкой
+EVENT_QUEUE_SIZE = 1000
+EVENT_BURST_SIZE = 200
+# Кадры с сообщениями: при переполнении очереди они не теряются, а догружаются по seq
+HISTORY_FRAME_TYPES = (messenger_pb2.MESSAGE, messenger_pb2.MESSAGE_BATCH, messenger_pb2.SET_TTL_TO_CHAT)
+
+# Виды событий сессии
+FRAME = "frame"  # Кадр стрима; messages - сообщения из него, добавленные в историю
+LOADED = "loaded"  # Сообщения чата, загруженные с сервера или из кэша
+OVERFLOW = "overflow"  # Очередь отправки полна; error - DROPPED_OLDEST или REJECTED
+ERROR = "error"  # Ошибка фоновой работы сессии; error - текст
+DISCONNECTED = "disconnected"  # Стрим разорван, идёт переподключение; error - код gRPC
+
+ChatEvent = namedtuple("ChatEvent", ["kind", "chat_id", "frame", "messages", "error"], defaults=(None, (), None))
+
+
+class ChatConnection:
+    """Общие gRPC-каналы для сессий ChatClient
+
+    Стримы всех сессий мультиплексируются в HTTP/2-соединениях каналов:
+    сессия закрепляется за каналом по кругу при создании. Метрики
+    и трассировщик тоже общие, метрики очередей - сумма по сессиям.
+    """
+
+    def __init__(self, server_address, channels=1, metrics=None, tracer=None, transport=None):
+        self.server_address = server_address
+        self.size = channels
+        self.metrics = metrics or ClientMetrics()
+        self.tracer = tracer or Tracer()
+        self.transport = transport or TransportOptions()
+        self.channels = []
+        self.stubs = []
+        self.sessions = set()  # Открытые сессии, закрытая сессия убирает себя сама
+        self.next_stub = 0
+        self.metrics.outbound_depth.set_function(lambda: sum(session.outbound_depth() for session in self.sessions))
+        self.metrics.event_queue_depth.set_function(lambda: sum(session.event_depth() for session in self.sessions))
+
+    async def connect(self):
+        # Каналы с одинаковыми параметрами gRPC сводит в одно TCP-соединение,
+        # локальный пул подканалов даёт каждому каналу пула своё
+        options = self.transport.channel_options()
+        if self.size > 1:
+            options.append(("grpc.use_local_subchannel_pool", 1))
+        for _ in range(self.size):
+            channel = grpc.aio.insecure_channel(self.server_address, options=options, interceptors=[
+                self.metrics.aio_interceptor(),
+                AioTracingInterceptor(self.tracer),
+            ])
+            self.channels.append(channel)
+            self.stubs.append(messenger_pb2_grpc.MessengerStub(channel))
+
+    def stub(self):
+        stub = self.stubs[self.next_stub % len(self.stubs)]
+        self.next_stub += 1
+        return stub
+
+    def session(self, nickname, **options):
+        """Новая сессия пользователя на одном из каналов; опции - как у ChatClient"""
+        session = ChatClient(self, nickname, **options)
+        self.sessions.add(session)
+        return session
+
+    async def close(self):
+        await asyncio.gather(*(session.close() for session in list(self.sessions)), return_exceptions=True)
+        self.sessions.clear()
+        for channel in self.channels:
+            await channel.close()
+        self.channels.clear()
+        self.stubs.clear()
+
+
+class ChatClient:
+    """Сессия одного пользователя: унарные вызовы, ChatStream и история чатов без UI
+
+    События стрима приходят пачками: слушатели add_listener вызываются
+    один раз на пачку со списком ChatEvent, events() отдаёт их по одному.
+    Ошибки унарных вызовов (grpc.RpcError) получает вызывающий код.
+    history_limit=None отключает историю в памяти, что экономит память ботам.
+    """
+
+    def __init__(self, connection, nickname, cache_dir=None, history_limit=DEFAULT_HISTORY_LIMIT,
+                 outbound_queue_size=DEFAULT_OUTBOUND_QUEUE_SIZE, outbound_policy=MERGE, event_queue_size=EVENT_QUEUE_SIZE):
+        self.connection = connection
+        self.nickname = nickname
+        self.stub = connection.stub()
+        self.stream_compression = connection.transport.call_compression("ChatStream")
+        self.metrics = connection.metrics
+        self.tracer = connection.tracer
+        self.cache_dir = cache_dir
+        self.cache = None
+        self.history = MessageStore(history_limit) if history_limit else None
+        self.history_has_more = {}
+        self.user_chats = {}
+        self.chat_names = {}
+        self.chat_seqs = {}  # Последний полученный seq по чатам {chat_id: seq}
+        self.outbound = None
+        self.outbound_queue_size = outbound_queue_size
+        self.outbound_policy = outbound_policy
+        self.outbound_pending = deque()
+        self.last_activity = 0  # loop.time() последнего кадра стрима в любую сторону
+        self.frame_spans = {}  # Спаны кадров в очереди отправки {span_id: Span}
+        self.streaming = False
+        self.stream_call = None
+        self.stream_task = None
+        self.event_queue_size = event_queue_size
+        self.events_queue = None  # Полученные кадры (ChatMessage, Span) для event_consumer
+        self.event_task = None
+        self.resync_from = {}  # Чаты с отброшенными кадрами {chat_id: seq, после которого догрузить}
+        self.listeners = []
+        self.frame_handlers = {
+            messenger_pb2.MESSAGE: self.on_message,
+            messenger_pb2.MESSAGE_BATCH: self.on_message_batch,
+            messenger_pb2.SET_TTL_TO_CHAT: self.on_set_ttl,
+            messenger_pb2.SEND_FAILED: self.on_send_failed,
+        }
+
+    async def start(self):
+        """Открыть кэш и ChatStream"""
+        if self.cache_dir and self.cache is None:
+            self.cache = MessageCache(self.nickname, self.connection.server_address, self.cache_dir)
+
+        # Сессия, открытая заново после close, снова учитывается в метриках соединения
+        self.connection.sessions.add(self)
+        self.outbound = OutboundQueue(self.outbound_queue_size, self.outbound_policy, on_drop=self.drop_frame)
+        self.outbound_pending = deque()
+        self.events_queue = asyncio.Queue(self.event_queue_size)
+        self.streaming = True
+        self.event_task = asyncio.create_task(self.event_consumer())
+        self.stream_task = asyncio.create_task(self.stream_loop())
+
+    async def close(self):
+        await self.stop()
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+        # Соединение не должно держать закрытую сессию и её очереди
+        self.connection.sessions.discard(self)
+
+    def add_listener(self, listener):
+        """listener(events) вызывается с каждой пачкой событий сессии"""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    async def events(self, maxsize=EVENT_QUEUE_SIZE):
+        """События сессии по одному; если их не успевают забирать, старейшие вытесняются"""
+        queue = asyncio.Queue(maxsize)
+
+        def listener(events):
+            for event in events:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+        self.add_listener(listener)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.remove_listener(listener)
+
+    def publish(self, events):
+        for listener in list(self.listeners):
+            listener(events)
+
+    def publish_error(self, text, chat_id=""):
+        self.publish([ChatEvent(ERROR, chat_id, error=text)])
+
+    def add_history_message(self, msg, kind="received"):
+        if self.history is not None:
+            history = self.history.chat(msg.chat_id)
+            # Своё сообщение, отправленное через стрим, возвращается в повторе истории уже с ID и seq
+            confirmed = (msg.id and msg.nickname == self.nickname and msg.id not in history.ids
+                         and history.confirm_sent(msg.content, msg.id, msg.seq))
+            if not confirmed:
+                # Одно и то же сообщение может прийти из кэша, догрузки и повтора истории в стриме
+                history.append(StoredMessage(msg.content, msg.nickname, kind, msg.id, msg.seq))
+        if msg.seq > self.chat_seqs.get(msg.chat_id, 0):
+            self.chat_seqs[msg.chat_id] = msg.seq
+
+    async def get_user_chats(self):
+        request = messenger_pb2.GetUserChatsRequest(nickname=self.nickname)
+        response = await self.stub.GetUserChats(request)
+
+        self.user_chats = {chat.chat_id: chat for chat in response.chats}
+
+        for chat in response.chats:
+            self.chat_names[chat.chat_id] = chat.name or chat.chat_id
+
+        return response.chats
+
+    async def create_chat(self, name):
+        request = messenger_pb2.CreateChatRequest(name=name, nickname=self.nickname)
+        response = await self.stub.CreateChat(request)
+
+        chat_id = response.chat_id
+        self.chat_names[chat_id] = name
+
+        await self.enqueue(messenger_pb2.ChatMessage(
+            content=f"Создан чат: {name}",
+            nickname=self.nickname,
+            chat_id=chat_id,
+            type=messenger_pb2.CHAT_CREATED
+        ))
+        return chat_id
+
+    async def join_chat(self, chat_id):
+        request = messenger_pb2.JoinChatRequest(chat_id=chat_id, nickname=self.nickname)
+        response = await self.stub.JoinChat(request)
+        if not response.success:
+            return False
+
+        await self.enqueue(messenger_pb2.ChatMessage(
+            content=f"Пользователь {self.nickname} присоединился к чату",
+            nickname=self.nickname,
+            chat_id=chat_id,
+            type=messenger_pb2.USER_JOINED
+        ))
+        await self.get_user_chats()
+        return True
+
+    async def leave_chat(self, chat_id):
+        request = messenger_pb2.LeaveChatRequest(chat_id=chat_id, nickname=self.nickname)
+        response = await self.stub.LeaveChat(request)
+        if not response.success:
+            return False
+
+        await self.enqueue(messenger_pb2.ChatMessage(
+            content=f"Пользователь {self.nickname} покинул чат",
+            nickname=self.nickname,
+            chat_id=chat_id,
+            type=messenger_pb2.USER_LEFT
+        ))
+
+        if self.cache:
+            self.cache.drop_chat(chat_id)
+        if self.history is not None:
+            self.history.drop(chat_id)
+        self.chat_seqs.pop(chat_id, None)
+        self.user_chats.pop(chat_id, None)
+        return True
+
+    async def enter_chat(self, chat_id):
+        """Войти в чат: загрузка истории, затем USER_GOT_IN с последним загруженным seq"""
+        # Сначала история из кэша или GetMessages: по seq из неё сервер повторит
+        # только то, что пришло после загрузки, а не ту же страницу ещё раз
+        try:
+            await self.load_history(chat_id)
+        finally:
+            await self.enqueue(messenger_pb2.ChatMessage(
+                content=f"Пользователь {self.nickname} вошел в чат",
+                nickname=self.nickname,
+                chat_id=chat_id,
+                type=messenger_pb2.USER_GOT_IN,
+                seq=self.chat_seqs.get(chat_id, 0)
+            ))
+
+    async def send_message(self, chat_id, text):
+        """Поставить сообщение в очередь отправки, результат - как у enqueue"""
+        chat_message = messenger_pb2.ChatMessage(
+            content=text,
+            nickname=self.nickname,
+            chat_id=chat_id,
+            type=messenger_pb2.MESSAGE
+        )
+        result = await self.enqueue(chat_message)
+        if result not in (None, REJECTED):
+            self.add_history_message(chat_message, kind="sent")
+        return result
+
+    async def set_ttl(self, chat_id, minutes):
+        return await self.enqueue(messenger_pb2.ChatMessage(
+            content=f"TTL установлен на {minutes} минут",
+            nickname=self.nickname,
+            chat_id=chat_id,
+            type=messenger_pb2.SET_TTL_TO_CHAT,
+            ttl=minutes
+        ))
+
+    async def load_history(self, chat_id):
+        """Последняя страница истории: из кэша сразу, с сервера - только разница"""
+        if self.history is not None:
+            self.history.reset(chat_id)
+
+        synced_seq = self.cache.synced_seq(chat_id) if self.cache else None
+        if synced_seq is not None:
+            cached = self.cache.latest(chat_id, HISTORY_PAGE_SIZE, synced_seq)
+            for msg in cached:
+                self.add_history_message(msg)
+
+            self.history_has_more[chat_id] = bool(cached) and cached[0].seq > 1
+            self.publish([ChatEvent(LOADED, chat_id, messages=cached)])
+            await self.fetch_missed_messages(chat_id, synced_seq)
+            return
+
+        # Загружаем только последнюю страницу, более ранние - по load_older_messages
+        request = messenger_pb2.GetMessagesRequest(chat_id=chat_id, limit=HISTORY_PAGE_SIZE)
+        response = await self.stub.GetMessages(request)
+
+        for msg in response.messages:
+            self.add_history_message(msg)
+
+        self.history_has_more[chat_id] = response.has_more
+
+        if self.cache:
+            last_seq = response.messages[-1].seq if response.messages else 0
+            self.cache.store(response.messages, synced_seq=last_seq, chat_id=chat_id)
+        self.publish([ChatEvent(LOADED, chat_id, messages=response.messages)])
+
+    async def fetch_missed_messages(self, chat_id, cursor, synced=True):
+        loaded = []
+        while True:
+            request = messenger_pb2.GetMessagesSinceRequest(chat_id=chat_id, cursor=cursor)
+            response = await self.stub.GetMessagesSince(request)
+
+            for msg in response.messages:
+                self.add_history_message(msg)
+            loaded.extend(response.messages)
+
+            if self.cache:
+                synced_seq = response.next_cursor if synced else None
+                self.cache.store(response.messages, synced_seq=synced_seq, chat_id=chat_id)
+            cursor = response.next_cursor
+            if not response.has_more:
+                break
+
+        if loaded:
+            self.publish([ChatEvent(LOADED, chat_id, messages=loaded)])
+
+    async def load_older_messages(self, chat_id):
+        """Страница сообщений раньше самого раннего в истории; возвращает число добавленных"""
+        if self.history is None:
+            return 0
+        history = self.history.chat(chat_id)
+        before = history.oldest_seq()
+        # Буфер чата заполнен: более ранние сообщения в него уже не поместятся
+        if not self.history_has_more.get(chat_id) or not before or history.is_full():
+            return 0
+
+        messages = self.cache.older(chat_id, before, HISTORY_PAGE_SIZE) if self.cache else []
+        has_more = bool(messages) and messages[0].seq > 1
+
+        if not messages:
+            request = messenger_pb2.GetMessagesRequest(
+                chat_id=chat_id,
+                limit=HISTORY_PAGE_SIZE,
+                before=before
+            )
+            response = await self.stub.GetMessages(request)
+
+            messages = response.messages
+            has_more = response.has_more
+            if self.cache:
+                self.cache.store(messages)
+
+        self.history_has_more[chat_id] = has_more
+        return history.prepend([
+            StoredMessage(msg.content, msg.nickname, "received", msg.id, msg.seq)
+            for msg in messages
+        ])
+
+    async def enqueue(self, chat_message):
+        """Поставить кадр в очередь отправки
+
+        Возвращает результат OutboundQueue (QUEUED, MERGED, DROPPED_OLDEST,
+        REJECTED) или None, если стрим не запущен. Переполнение дополнительно
+        приходит слушателям событием OVERFLOW.
+        """
+        if self.outbound is None:
+            return None
+        self.trace_frame(chat_message)
+        return self.report_enqueue(chat_message, await self.outbound.put(chat_message))
+
+    def enqueue_nowait(self, chat_message):
+        """enqueue без ожидания места в очереди, в том числе с политикой block"""
+        if self.outbound is None:
+            return None
+        self.trace_frame(chat_message)
+        return self.report_enqueue(chat_message, self.outbound.offer(chat_message))
+
+    def report_enqueue(self, chat_message, result):
+        self.metrics.outbound_enqueued.inc(result=result)
+        if result == REJECTED:
+            self.drop_frame(chat_message)
+        if result in (REJECTED, DROPPED_OLDEST):
+            self.publish([ChatEvent(OVERFLOW, chat_message.chat_id, frame=chat_message, error=result)])
+        return result
+
+    def drop_frame(self, chat_message):
+        """Кадр вытеснен из очереди или заменён более новым: его спан закрывается с sent=False"""
+        span = self.frame_spans.pop(chat_message.span_id, None)
+        if span is not None:
+            span.set_attribute("sent", False)
+            span.end()
+
+    def trace_frame(self, chat_message):
+        """Спан от постановки кадра в очередь до отправки, сервер продолжает трассу по trace_id/span_id кадра"""
+        span = self.tracer.start_span(
+            f"send {messenger_pb2.ChatMessageType.Name(chat_message.type)}",
+            kind=SPAN_KIND_PRODUCER,
+            attributes={"chat_id": chat_message.chat_id, "nickname": self.nickname},
+        )
+        if span.context is None:
+            return
+        chat_message.trace_id, chat_message.span_id = span.context
+        self.frame_spans[span.context.span_id] = span
+
+    def end_frame_spans(self, message):
+        for item in message.batch or (message,):
+            span = self.frame_spans.pop(item.span_id, None)
+            if span is not None:
+                span.set_attribute("sent", True)
+                span.end()
+
+    def receive_span(self, message):
+        """Спан обработки полученного кадра, закрывает трассу отправителя"""
+        parent = SpanContext(message.trace_id, message.span_id)
+        if not parent.valid:
+            return NOOP_SPAN
+        return self.tracer.start_span(
+            f"receive {messenger_pb2.ChatMessageType.Name(message.type)}",
+            parent=parent,
+            kind=SPAN_KIND_CONSUMER,
+            attributes={"chat_id": message.chat_id, "sender": message.nickname, "messages": len(message.batch) or 1},
+        )
+
+    def outbound_depth(self):
+        if self.outbound is None:
+            return 0
+        return self.outbound.qsize() + len(self.outbound_pending)
+
+    def event_depth(self):
+        return self.events_queue.qsize() if self.events_queue else 0
+
+    async def stream_loop(self):
+        """Держит ChatStream открытым: после обрыва переподключается с джиттером"""
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while self.streaming:
+            closed = asyncio.Event()
+            started = loop.time()
+            self.stream_call = self.stub.ChatStream(
+                self.outbound_iterator(self.connect_frame(), closed), compression=self.stream_compression
+            )
+            received = await self.stream_receiver()
+            closed.set()
+            self.stream_call.cancel()
+            if not self.streaming:
+                return
+
+            if received or loop.time() - started > RECONNECT_MAX_DELAY:
+                attempt = 0
+            if attempt == 0:
+                code = await self.stream_call.code()
+                self.publish([ChatEvent(DISCONNECTED, "", error=code.name)])
+
+            # Случайная задержка разносит переподключения клиентов после рестарта сервера
+            delay = random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def connect_frame(self):
+        # resume - последний полученный seq по чатам, сервер повторит только пропущенное
+        return messenger_pb2.ChatMessage(
+            content=f"Пользователь {self.nickname} подключился",
+            nickname=self.nickname,
+            chat_id="",
+            type=messenger_pb2.USER_CONNECTED,
+            resume=self.chat_seqs
+        )
+
+    async def outbound_iterator(self, connect_frame, closed):
+        # Ждём очередь, а не опрашиваем её: сообщение уходит сразу после enqueue,
+        # а простаивающий клиент просыпается только ради heartbeat
+        self.metrics.observe_frame("out", connect_frame)
+        self.last_activity = asyncio.get_running_loop().time()
+        yield connect_frame
+        while True:
+            if self.outbound_pending:
+                message = self.outbound_pending.popleft()
+            else:
+                message = await self.next_outbound(closed)
+                if message is NO_FRAME:
+                    if closed.is_set():
+                        return
+                    # Пока по стриму идут кадры, соединение и так живо
+                    if asyncio.get_running_loop().time() - self.last_activity < HEARTBEAT_INTERVAL:
+                        continue
+                    message = messenger_pb2.ChatMessage(
+                        content="heartbeat",
+                        nickname=self.nickname,
+                        chat_id="",
+                        type=messenger_pb2.USER_CONNECTED
+                    )
+
+            if message is None:
+                return
+            if message.type == messenger_pb2.MESSAGE:
+                message = await self.coalesce_messages(message, self.outbound_pending)
+
+            # Соединение уже закрыто - кадр уйдёт первым в следующем
+            if closed.is_set():
+                self.outbound_pending.appendleft(message)
+                return
+            self.metrics.observe_frame("out", message)
+            self.end_frame_spans(message)
+            self.last_activity = asyncio.get_running_loop().time()
+            yield message
+
+    async def next_outbound(self, closed):
+        """Следующий кадр очереди; NO_FRAME, если стрим простоял HEARTBEAT_INTERVAL или соединение закрыто"""
+        idle = asyncio.get_running_loop().time() - self.last_activity
+        get = asyncio.ensure_future(self.outbound.get())
+        closing = asyncio.ensure_future(closed.wait())
+        done, _ = await asyncio.wait(
+            {get, closing}, timeout=max(0, HEARTBEAT_INTERVAL - idle), return_when=asyncio.FIRST_COMPLETED
+        )
+        closing.cancel()
+        if get in done:
+            return get.result()
+        get.cancel()
+        return NO_FRAME
+
+    async def coalesce_messages(self, first, pending):
+        """Собрать в один кадр сообщения в тот же чат, пришедшие в очередь за SEND_COALESCE_WINDOW"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SEND_COALESCE_WINDOW
+        batch = [first]
+        while len(batch) < SEND_BATCH_SIZE:
+            try:
+                message = self.outbound.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(self.outbound.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            # Чужой кадр отправляется следом за пачкой, порядок не меняется
+            if message is None or message.type != messenger_pb2.MESSAGE or message.chat_id != first.chat_id:
+                pending.append(message)
+                break
+            batch.append(message)
+
+        if len(batch) == 1:
+            return first
+        # Пачка продолжает трассу первого сообщения, спаны остальных закрываются вместе с ней
+        return messenger_pb2.ChatMessage(
+            nickname=self.nickname,
+            chat_id=first.chat_id,
+            type=messenger_pb2.MESSAGE_BATCH,
+            batch=batch,
+            trace_id=first.trace_id,
+            span_id=first.span_id
+        )
+
+    async def stream_receiver(self):
+        """Чтение стрима до его закрытия; True, если пришёл хотя бы один кадр
+
+        Кадры только ставятся в очередь событий, их обрабатывает event_consumer:
+        медленный обработчик не задерживает чтение стрима.
+        """
+        loop = asyncio.get_running_loop()
+        received = False
+        try:
+            async for message in self.stream_call:
+                received = True
+                self.last_activity = loop.time()
+                self.metrics.observe_frame("in", message)
+                self.dispatch(message)
+        except asyncio.CancelledError:
+            raise
+        except grpc.aio.AioRpcError:
+            # Обрыв стрима обрабатывает stream_loop
+            pass
+        except Exception as e:
+            self.publish_error(f"Ошибка стриминга: {e}")
+        return received
+
+    def dispatch(self, message):
+        """Кадр в очередь событий без ожидания; сообщения из отброшенных кадров догружаются по seq"""
+        span = self.receive_span(message)
+        try:
+            self.events_queue.put_nowait((message, span))
+            return
+        except asyncio.QueueFull:
+            pass
+
+        span.set_attribute("dropped", True)
+        span.end()
+        self.metrics.events_dropped.inc(type=messenger_pb2.ChatMessageType.Name(message.type))
+        if message.type not in HISTORY_FRAME_TYPES:
+            return
+        first = message.batch[0] if message.batch else message
+        if first.seq:
+            cursor = first.seq - 1
+            self.resync_from[message.chat_id] = min(self.resync_from.get(message.chat_id, cursor), cursor)
+
+    async def event_consumer(self):
+        """Обрабатывает полученные кадры пачками: слушатели получают всплеск целиком"""
+        while True:
+            burst = [await self.events_queue.get()]
+            while len(burst) < EVENT_BURST_SIZE:
+                try:
+                    burst.append(self.events_queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            self.publish(self.apply_events(burst))
+            if self.resync_from:
+                await self.resync_chats()
+            # Даём циклу событий дочитать стрим до следующей пачки
+            await asyncio.sleep(0)
+
+    def apply_events(self, burst):
+        events = []
+        stored = []
+        for message, span in burst:
+            handler = self.frame_handlers.get(message.type)
+            try:
+                with span:
+                    messages = handler(message) if handler is not None else ()
+            except Exception as e:
+                events.append(ChatEvent(ERROR, message.chat_id, frame=message, error=f"Ошибка обработки кадра {messenger_pb2.ChatMessageType.Name(message.type)}: {e}"))
+                continue
+            stored.extend(messages)
+            events.append(ChatEvent(FRAME, message.chat_id, frame=message, messages=messages))
+
+        # Сообщения всплеска пишутся в кэш одной транзакцией
+        if self.cache and stored:
+            self.cache.store(stored)
+        return events
+
+    async def resync_chats(self):
+        """Догрузка сообщений, кадры которых не поместились в очередь событий"""
+        pending, self.resync_from = self.resync_from, {}
+        for chat_id, cursor in pending.items():
+            try:
+                # Как и живые кадры, догрузка не двигает synced_seq кэша
+                await self.fetch_missed_messages(chat_id, cursor, synced=False)
+            except grpc.RpcError as e:
+                self.publish_error(f"Ошибка догрузки сообщений чата {chat_id}: {e}", chat_id)
+
+    def on_message(self, message):
+        self.metrics.observe_delivery(message.created_at)
+        self.add_history_message(message)
+        return (message,)
+
+    def on_message_batch(self, message):
+        # Повтор истории приходит без отправителя, его задержка - не задержка доставки
+        live = bool(message.nickname)
+        for item in message.batch:
+            if live:
+                self.metrics.observe_delivery(item.created_at)
+            self.add_history_message(item)
+        return message.batch
+
+    def on_set_ttl(self, message):
+        if not message.content:
+            return ()
+        self.add_history_message(message)
+        return (message,)
+
+    def on_send_failed(self, message):
+        # Отклонённые сервером сообщения уже показаны как отправленные, убираем их из истории
+        if self.history is not None:
+            history = self.history.chat(message.chat_id)
+            for item in message.batch:
+                history.discard_sent(item.content)
+        return ()
+
+    async def stop(self):
+        # Дальше stream_loop не переподключается
+        self.streaming = False
+        if self.outbound is not None:
+            for chat_id in self.user_chats.keys():
+                # Не ждём места в очереди: при выходе стрим может уже не работать
+                self.enqueue_nowait(messenger_pb2.ChatMessage(
+                    content=f"Пользователь {self.nickname} покинул чат",
+                    nickname=self.nickname,
+                    chat_id=chat_id,
+                    type=messenger_pb2.USER_LEFT
+                ))
+
+            # None закрывает поток запросов после того, как очередь будет отправлена
+            self.outbound.close()
+
+        if self.stream_task:
+            try:
+                await asyncio.wait_for(self.stream_task, timeout=1)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self.stream_task = None
+
+        if self.event_task:
+            self.event_task.cancel()
+            try:
+                await self.event_task
+            except asyncio.CancelledError:
+                pass
+            self.event_task = None
+        self.events_queue = None
+
+        self.outbound = None
+
+        # Кадры, так и не ушедшие на сервер, закрываются с sent=False
+        for span in self.frame_spans.values():
+            span.set_attribute("sent", False)
+            span.end()
+        self.frame_spans.clear()
+
+        if self.stream_call:
+            self.stream_call.cancel()
+            self.stream_call = None
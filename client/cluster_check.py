@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from benchmark import LatencyRecorder
+from chat_client import ChatConnection, FRAME
+from generated import messenger_pb2
+
+
+class Receiver:
+    """Время получения сообщений проверки одной сессией"""
+
+    def __init__(self, session, prefix):
+        self.prefix = prefix
+        self.received = {}  # {content: perf_counter()}
+        session.add_listener(self.on_events)
+
+    def on_events(self, events):
+        now = time.perf_counter()
+        for event in events:
+            if event.kind != FRAME:
+                continue
+            frame = event.frame
+            items = frame.batch if frame.type == messenger_pb2.MESSAGE_BATCH else [frame]
+            for item in items:
+                if item.type == messenger_pb2.MESSAGE and item.content.startswith(self.prefix):
+                    self.received.setdefault(item.content, now)
+
+
+class ClusterCheck:
+    """Доставка между двумя экземплярами сервера на одном Redis
+
+    alice подключена к первому серверу, bob и второе устройство alice - ко второму.
+    Сообщения alice должны дойти до bob и до её второго устройства, сообщения bob - до alice.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.run_id = args.run_id or uuid.uuid4().hex[:8]
+        self.connections = [ChatConnection(address) for address in args.servers]
+
+    async def run(self):
+        for connection in self.connections:
+            await connection.connect()
+
+        first, second = self.connections
+        alice = first.session(f"check:{self.run_id}:alice", history_limit=None)
+        bob = second.session(f"check:{self.run_id}:bob", history_limit=None)
+        alice_second = second.session(alice.nickname, history_limit=None)
+        sessions = [alice, bob, alice_second]
+        try:
+            for session in sessions:
+                await session.start()
+
+            # Чат создаётся на первом сервере, bob вступает через второй:
+            # членство должно разойтись по обоим экземплярам
+            chat_id = await alice.create_chat(f"check:{self.run_id}")
+            await bob.join_chat(chat_id)
+            await asyncio.sleep(self.args.settle)
+
+            return {
+                "servers": self.args.servers,
+                "config": {
+                    "messages": self.args.messages,
+                    "interval_s": self.args.interval,
+                    "timeout_s": self.args.timeout,
+                },
+                "directions": {
+                    "first->second": await self.direction(alice, "a", {"bob": bob, "alice_second_device": alice_second}),
+                    "second->first": await self.direction(bob, "b", {"alice": alice}),
+                },
+            }
+        finally:
+            for session in sessions:
+                await session.close()
+            for connection in self.connections:
+                await connection.close()
+
+    async def direction(self, sender, tag, receivers):
+        prefix = f"{self.run_id}:{tag}:"
+        listeners = {name: Receiver(session, prefix) for name, session in receivers.items()}
+        chat_id = next(iter(sender.chat_names))
+
+        sent = {}
+        started = time.perf_counter()
+        for i in range(self.args.messages):
+            content = f"{prefix}{i}"
+            sent[content] = time.perf_counter()
+            await sender.send_message(chat_id, content)
+            if self.args.interval:
+                await asyncio.sleep(self.args.interval)
+
+        deadline = time.perf_counter() + self.args.timeout
+        while time.perf_counter() < deadline and any(len(listener.received) < len(sent) for listener in listeners.values()):
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        result = {}
+        for name, listener in listeners.items():
+            recorder = LatencyRecorder()
+            for content, received_at in listener.received.items():
+                recorder.add(received_at - sent[content])
+            summary = recorder.summary(elapsed)
+            summary["missing"] = len(sent) - len(listener.received)
+            result[name] = summary
+        return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Проверка доставки и задержек между двумя экземплярами сервера на одном Redis')
+    parser.add_argument('--servers', default='localhost:8080,localhost:8081', help='Два адреса через запятую (по умолчанию: localhost:8080,localhost:8081)')
+    parser.add_argument('--messages', type=int, default=200, help='Сообщений в каждую сторону')
+    parser.add_argument('--interval', type=float, default=0.01, help='Пауза между сообщениями в секундах')
+    parser.add_argument('--settle', type=float, default=0.5, help='Сколько секунд ждать подписок после вступления в чат')
+    parser.add_argument('--timeout', type=float, default=5.0, help='Сколько секунд ждать доставки после отправки')
+    parser.add_argument('--run-id', default=None, help='Суффикс ников и чата (по умолчанию случайный)')
+    parser.add_argument('--output', default=None, help='Файл для JSON-отчёта (по умолчанию stdout)')
+    args = parser.parse_args()
+    args.servers = [server.strip() for server in args.servers.split(",") if server.strip()]
+    if len(args.servers) != 2:
+        parser.error("нужно ровно два адреса серверов")
+    return args
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(ClusterCheck(args).run())
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"✅ Отчёт сохранён в {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    missing = sum(receiver["missing"] for direction in report["directions"].values() for receiver in direction.values())
+    if missing:
+        print(f"❌ Не доставлено сообщений: {missing}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
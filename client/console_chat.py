@@ -1,45 +1,127 @@
 #!/usr/bin/env python3
 
+import asyncio
 import sys
 import threading
-import time
-import os
 from datetime import datetime
+from chat_client import DISCONNECTED, ERROR, FRAME, OVERFLOW, ChatConnection
+from message_cache import DEFAULT_CACHE_DIR
+from message_store import DEFAULT_HISTORY_LIMIT
+from metrics import DEFAULT_METRICS_FILE
+from outbound_queue import DEFAULT_OUTBOUND_QUEUE_SIZE, MERGE, POLICIES, REJECTED
+from terminal_renderer import TerminalRenderer
+from tracing import Tracer
+from transport import TransportOptions, add_transport_arguments
 from generated import messenger_pb2
-from generated import messenger_pb2_grpc
 import grpc
 
 
+VISIBLE_MESSAGES = 20
+
+
+class AsyncStdinReader:
+    """Чтение строк из stdin без блокировки event loop"""
+
+    def __init__(self):
+        self.loop = None
+        self.lines = asyncio.Queue()
+        self.fd = None
+        self.thread = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            fd = sys.stdin.fileno()
+            self.loop.add_reader(fd, self._on_readable)
+            self.fd = fd
+        except (NotImplementedError, ValueError, OSError):
+            # Windows и нестандартные stdin: читаем в отдельном потоке
+            self.thread = threading.Thread(target=self._read_blocking, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+
+    def _on_readable(self):
+        line = sys.stdin.readline()
+        if not line:
+            self.stop()
+            self.lines.put_nowait(None)
+            return
+        self.lines.put_nowait(line.rstrip("\n"))
+
+    def _read_blocking(self):
+        for line in sys.stdin:
+            self.loop.call_soon_threadsafe(self.lines.put_nowait, line.rstrip("\n"))
+        self.loop.call_soon_threadsafe(self.lines.put_nowait, None)
+
+    async def readline(self, prompt=""):
+        if prompt:
+            print(prompt, end="", flush=True)
+        line = await self.lines.get()
+        if line is None:
+            raise EOFError
+        return line
+
+
 class StreamingConsoleChat:
-    def __init__(self, server_address='localhost:8080'):
+    def __init__(self, server_address='localhost:8080', cache_dir=DEFAULT_CACHE_DIR, history_limit=DEFAULT_HISTORY_LIMIT, metrics_file=None, trace_file=None,
+                 outbound_queue_size=DEFAULT_OUTBOUND_QUEUE_SIZE, outbound_policy=MERGE, transport=None):
         self.server_address = server_address
-        self.channel = None
-        self.stub = None
+        self.cache_dir = cache_dir
+        self.history_limit = history_limit
+        self.outbound_queue_size = outbound_queue_size
+        self.outbound_policy = outbound_policy
+        self.connection = ChatConnection(
+            server_address,
+            tracer=Tracer(trace_file, service_name="grpc-chat-console"),
+            transport=transport,
+        )
+        self.metrics = self.connection.metrics
+        self.tracer = self.connection.tracer
+        self.client = None  # Сессия ChatClient, создаётся после ввода имени
         self.nickname = None
-        self.room_messages = {}
+        self.scroll_offset = 0
         self.running = False
         self.current_chat_id = None
-        self.user_chats = {}
-        self.chat_names = {}
         self.notifications = []
         self.user_colors = {}
         self.available_colors = [31, 32, 33, 34, 35, 36, 91, 92, 93, 94, 95, 96]
-        self.stream_thread = None
-        self.stream_stub = None
+        # Метрики пишутся при выходе, только если файл задан явно
+        self.metrics_file = metrics_file or DEFAULT_METRICS_FILE
+        self.metrics_file_on_exit = metrics_file is not None
+        # Уведомления о служебных кадрах стрима по их типу
+        self.frame_notices = {
+            messenger_pb2.USER_JOINED: lambda m: f"👋 {m.nickname} присоединился к чату {m.chat_id}",
+            messenger_pb2.USER_LEFT: lambda m: f"👋 {m.nickname} покинул чат {m.chat_id}",
+            messenger_pb2.CHAT_CREATED: lambda m: f"🆕 {m.content}",
+            messenger_pb2.USER_GOT_IN: lambda m: f"🚪 {m.nickname} вошел в чат {m.chat_id}",
+            messenger_pb2.SET_TTL_TO_CHAT: self.ttl_notice,
+            messenger_pb2.SEND_FAILED: lambda m: f"❌ Сервер не сохранил сообщений: {len(m.batch)} ({m.content})",
+        }
+        self.stdin = AsyncStdinReader()
+        self.renderer = TerminalRenderer(
+            ("header", "notifications", "messages", "prompt"),
+            self.compose_screen,
+            schedule=self.schedule_redraw,
+            on_frame=self.metrics.observe_render,
+        )
         
-    def connect(self):
+    async def connect(self):
         try:
-            self.channel = grpc.insecure_channel(self.server_address)
-            self.stub = messenger_pb2_grpc.MessengerStub(self.channel)
+            await self.connection.connect()
             print(f"✅ Подключен к серверу {self.server_address}")
             return True
         except Exception as e:
             print(f"❌ Ошибка подключения: {e}")
             return False
     
-    def disconnect(self):
-        if self.channel:
-            self.channel.close()
+    async def disconnect(self):
+        # Вместе с каналами закрываются стрим и кэш сессии
+        if self.connection.channels:
+            await self.connection.close()
             print("🔌 Отключен от сервера")
     
     def get_user_color(self, nickname):
@@ -50,42 +132,47 @@ class StreamingConsoleChat:
             self.user_colors[nickname] = self.available_colors[color_index]
         return self.user_colors[nickname]
     
-    def send_message(self, message, chat_id=None):
+    async def send_message(self, message, chat_id=None):
         if chat_id is None:
             chat_id = self.current_chat_id
             
         if not chat_id:
             self.add_notification_to_list("❌ Выберите чат для отправки сообщения")
             return
-            
-        try:
-            chat_message = messenger_pb2.ChatMessage(
-                content=message,
-                nickname=self.nickname,
-                chat_id=chat_id,
-                type=messenger_pb2.MESSAGE
-            )
-            
-            if hasattr(self, 'message_queue'):
-                self.message_queue.append(chat_message)
-                
-            self.add_room_message(chat_id, message, self.nickname, is_sent=True)
-            
-        except Exception as e:
-            self.add_notification_to_list(f"❌ Ошибка отправки сообщения: {e}")
-    
-    def add_room_message(self, chat_id, content, nickname, is_sent=False):
-        if chat_id not in self.room_messages:
-            self.room_messages[chat_id] = []
         
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.room_messages[chat_id].append({
-            'content': content,
-            'nickname': nickname,
-            'timestamp': timestamp,
-            'is_sent': is_sent
-        })
-        print(f"[DEBUG] Добавлено сообщение в чат {chat_id}: {content} от {nickname}")
+        # Переполнение очереди приходит событием OVERFLOW
+        if await self.client.send_message(chat_id, message) not in (None, REJECTED):
+            self.scroll_offset = 0
+    
+    def on_events(self, events):
+        """Пачка событий сессии: уведомления и одна перерисовка"""
+        for event in events:
+            if event.kind == FRAME:
+                notice = self.frame_notices.get(event.frame.type)
+                if notice is not None:
+                    self.add_notification_to_list(notice(event.frame))
+                self.get_user_color(event.frame.nickname)
+            elif event.kind == OVERFLOW:
+                if event.error == REJECTED:
+                    frame_type = messenger_pb2.ChatMessageType.Name(event.frame.type)
+                    self.add_notification_to_list(f"❌ Очередь отправки переполнена ({self.outbound_queue_size}), кадр {frame_type} не отправлен")
+                else:
+                    self.add_notification_to_list("⚠️ Очередь отправки переполнена, самый старый кадр отброшен")
+            elif event.kind == ERROR:
+                self.add_notification_to_list(f"❌ {event.error}")
+            elif event.kind == DISCONNECTED:
+                self.add_notification_to_list(f"🔌 Стрим разорван ({event.error}), переподключаемся")
+        self.refresh_display()
+    
+    def ttl_notice(self, message):
+        # Свой кадр SET_TTL_TO_CHAT сервер присылает как подтверждение, что политика действует
+        if message.nickname == self.client.nickname and message.HasField('ttl'):
+            if message.ttl:
+                return f"✅ TTL {message.ttl} минут действует для чата {self.chat_name(message.chat_id)}"
+            return f"✅ Сообщения чата {self.chat_name(message.chat_id)} снова хранятся бессрочно"
+        if message.HasField('ttl'):
+            return f"⏱️ {message.nickname} установил TTL на {message.ttl} минут для чата {message.chat_id}"
+        return f"⏱️ {message.nickname} установил TTL для чата {message.chat_id}"
     
     def add_notification_to_list(self, message):
         timestamp = datetime.now().strftime("%H:%M:%S")
@@ -93,173 +180,91 @@ class StreamingConsoleChat:
         if len(self.notifications) > 20:
             self.notifications = self.notifications[-20:]
     
-    def get_user_chats(self):
+    def chat_name(self, chat_id):
+        return self.client.chat_names.get(chat_id, chat_id)
+    
+    async def get_user_chats(self):
         try:
-            request = messenger_pb2.GetUserChatsRequest(nickname=self.nickname)
-            response = self.stub.GetUserChats(request)
-            
-            self.user_chats = {chat.chat_id: chat for chat in response.chats}
-            
-            for chat_id in self.user_chats.keys():
-                if chat_id not in self.chat_names:
-                    self.chat_names[chat_id] = f"Chat {chat_id}"
-            
-            return response.chats
+            return await self.client.get_user_chats()
         except grpc.RpcError as e:
             self.add_notification_to_list(f"❌ Ошибка получения чатов: {e}")
             return []
     
-    def create_chat(self, name):
+    async def create_chat(self, name):
         try:
-            request = messenger_pb2.CreateChatRequest(name=name, nickname=self.nickname)
-            response = self.stub.CreateChat(request)
-            
-            chat_id = response.chat_id
-            self.chat_names[chat_id] = name
-            
-            if hasattr(self, 'message_queue'):
-                chat_message = messenger_pb2.ChatMessage(
-                    content=f"Создан чат: {name}",
-                    nickname=self.nickname,
-                    chat_id=chat_id,
-                    type=messenger_pb2.CHAT_CREATED
-                )
-                self.message_queue.append(chat_message)
-            
-            self.add_notification_to_list(f"✅ Создан чат: {name} (ID: {chat_id})")
-            return chat_id
-            
+            chat_id = await self.client.create_chat(name)
         except grpc.RpcError as e:
             self.add_notification_to_list(f"❌ Ошибка создания чата: {e}")
             return None
+        
+        self.add_notification_to_list(f"✅ Создан чат: {name} (ID: {chat_id})")
+        return chat_id
     
-    def join_chat(self, chat_id):
+    async def join_chat(self, chat_id):
         try:
-            request = messenger_pb2.JoinChatRequest(chat_id=chat_id, nickname=self.nickname)
-            response = self.stub.JoinChat(request)
-            
-            if response.success:
-                if hasattr(self, 'message_queue'):
-                    self.add_notification_to_list(f"Sending user joined message to stream: {self.nickname} {chat_id}")
-                    chat_message = messenger_pb2.ChatMessage(
-                        content=f"Пользователь {self.nickname} присоединился к чату",
-                        nickname=self.nickname,
-                        chat_id=chat_id,
-                        type=messenger_pb2.USER_JOINED
-                    )
-                    self.message_queue.append(chat_message)
-                else:
-                    self.add_notification_to_list(f"❌ Не удалось отправить уведомление о присоединении к чату")
-                
-                self.add_notification_to_list(f"✅ Присоединились к чату {self.chat_names.get(chat_id, chat_id)}")
-                self.get_user_chats()
-                return True
-            else:
-                self.add_notification_to_list(f"❌ Не удалось присоединиться к чату")
-                return False
-                
+            joined = await self.client.join_chat(chat_id)
         except grpc.RpcError as e:
             self.add_notification_to_list(f"❌ Ошибка присоединения к чату: {e}")
             return False
+        
+        if joined:
+            self.add_notification_to_list(f"✅ Присоединились к чату {self.chat_name(chat_id)}")
+        else:
+            self.add_notification_to_list(f"❌ Не удалось присоединиться к чату")
+        return joined
     
-    def leave_chat(self, chat_id):
+    async def leave_chat(self, chat_id):
         try:
-            request = messenger_pb2.LeaveChatRequest(chat_id=chat_id, nickname=self.nickname)
-            response = self.stub.LeaveChat(request)
-            
-            if response.success:
-                if hasattr(self, 'message_queue'):
-                    chat_message = messenger_pb2.ChatMessage(
-                        content=f"Пользователь {self.nickname} покинул чат",
-                        nickname=self.nickname,
-                        chat_id=chat_id,
-                        type=messenger_pb2.USER_LEFT
-                    )
-                    self.message_queue.append(chat_message)
-                
-                self.add_notification_to_list(f"✅ Покинули чат {self.chat_names.get(chat_id, chat_id)}")
-                return True
-            else:
-                self.add_notification_to_list(f"❌ Не удалось покинуть чат")
-                return False
-                
+            left = await self.client.leave_chat(chat_id)
         except grpc.RpcError as e:
             self.add_notification_to_list(f"❌ Ошибка выхода из чата: {e}")
             return False
+        
+        if left:
+            self.add_notification_to_list(f"✅ Покинули чат {self.chat_name(chat_id)}")
+        else:
+            self.add_notification_to_list(f"❌ Не удалось покинуть чат")
+        return left
     
-    def switch_chat(self, chat_id):
+    async def switch_chat(self, chat_id):
         """Переключиться на чат"""
-        if chat_id not in self.user_chats:
+        if chat_id not in self.client.user_chats:
             self.add_notification_to_list("❌ Вы не состоите в этом чате")
             return False
         
-        if hasattr(self, 'message_queue'):
-            chat_message = messenger_pb2.ChatMessage(
-                content=f"Пользователь {self.nickname} вошел в чат",
-                nickname=self.nickname,
-                chat_id=chat_id,
-                type=messenger_pb2.USER_GOT_IN
-            )
-            self.message_queue.append(chat_message)
-        
         self.current_chat_id = chat_id
-        chat_name = self.chat_names.get(chat_id, chat_id)
-        self.add_notification_to_list(f"✅ Переключились в чат: {chat_name} ({chat_id})")
+        self.scroll_offset = 0
+        self.add_notification_to_list(f"✅ Переключились в чат: {self.chat_name(chat_id)} ({chat_id})")
         
-        self.get_chat_messages(chat_id)
+        try:
+            await self.client.enter_chat(chat_id)
+        except grpc.RpcError as e:
+            self.add_notification_to_list(f"❌ Ошибка получения сообщений: {e}")
         return True
     
-    def get_chat_messages(self, chat_id):
+    async def get_chat_messages(self, chat_id):
         try:
-            request = messenger_pb2.GetMessagesRequest(chat_id=chat_id)
-            response = self.stub.GetMessages(request)
-            
-            self.room_messages[chat_id] = []
-            
-            for msg in response.messages:
-                self.add_room_message(chat_id, msg.content, msg.nickname)
-                self.get_user_color(msg.nickname)
-                
+            await self.client.load_history(chat_id)
         except grpc.RpcError as e:
             self.add_notification_to_list(f"❌ Ошибка получения сообщений: {e}")
     
-    def start_streaming(self):
+    async def scroll_back(self):
+        chat_id = self.current_chat_id
+        history = self.client.history
+        loaded = history.count(chat_id)
+        
+        if self.scroll_offset + 2 * VISIBLE_MESSAGES > loaded:
+            try:
+                await self.client.load_older_messages(chat_id)
+            except grpc.RpcError as e:
+                self.add_notification_to_list(f"❌ Ошибка получения сообщений: {e}")
+            loaded = history.count(chat_id)
+        
+        self.scroll_offset = max(0, min(self.scroll_offset + VISIBLE_MESSAGES, loaded - VISIBLE_MESSAGES))
+    
+    async def start_streaming(self):
         try:
-            self.message_queue = []
-            self.heartbeat_running = True
-            
-            connect_message = messenger_pb2.ChatMessage(
-                content=f"Пользователь {self.nickname} подключился",
-                nickname=self.nickname,
-                chat_id="",
-                type=messenger_pb2.USER_CONNECTED
-            )
-            self.message_queue.append(connect_message)
-            
-            def message_iterator():
-                last_heartbeat = time.time()
-                while self.heartbeat_running:
-                    if self.message_queue:
-                        yield self.message_queue.pop(0)
-                    else:
-                        current_time = time.time()
-                        if current_time - last_heartbeat > 30:
-                            heartbeat_message = messenger_pb2.ChatMessage(
-                                content="heartbeat",
-                                nickname=self.nickname,
-                                chat_id="",
-                                type=messenger_pb2.USER_CONNECTED
-                            )
-                            yield heartbeat_message
-                            last_heartbeat = current_time
-                        else:
-                            time.sleep(0.1)
-            
-            self.stream_stub = self.stub.ChatStream(message_iterator())
-            
-            self.stream_thread = threading.Thread(target=self.stream_receiver, daemon=True)
-            self.stream_thread.start()
-            
+            await self.client.start()
             self.add_notification_to_list("🔄 Стриминг запущен")
             return True
             
@@ -268,118 +273,73 @@ class StreamingConsoleChat:
             self.add_notification_to_list(f"❌ Ошибка запуска стриминга: {e}")
             return False
     
-    def stream_receiver(self):
-        try:
-            for message in self.stream_stub:
-                if message.type == messenger_pb2.MESSAGE:
-                    print(f"\n[DEBUG] Получено сообщение: {message.content} от {message.nickname} в чат {message.chat_id}")
-                    self.add_room_message(message.chat_id, message.content, message.nickname)
-                    self.refresh_display()
-                elif message.type == messenger_pb2.USER_JOINED:
-                    self.add_notification_to_list(f"👋 {message.nickname} присоединился к чату {message.chat_id}")
-                    self.refresh_display()
-                elif message.type == messenger_pb2.USER_LEFT:
-                    self.add_notification_to_list(f"👋 {message.nickname} покинул чат {message.chat_id}")
-                    self.refresh_display()
-                elif message.type == messenger_pb2.CHAT_CREATED:
-                    self.add_notification_to_list(f"🆕 {message.content}")
-                    self.refresh_display()
-                elif message.type == messenger_pb2.USER_GOT_IN:
-                    self.add_notification_to_list(f"🚪 {message.nickname} вошел в чат {message.chat_id}")
-                    self.refresh_display()
-                elif message.type == messenger_pb2.SET_TTL_TO_CHAT:
-                    ttl_text = ""
-                    if message.HasField('ttl'):
-                        ttl_minutes = message.ttl
-                        ttl_text = f"⏱️ {message.nickname} установил TTL на {ttl_minutes} минут для чата {message.chat_id}"
-                    else:
-                        ttl_text = f"⏱️ {message.nickname} установил TTL для чата {message.chat_id}"
-                    self.add_notification_to_list(ttl_text)
-                    if message.content:
-                        self.add_room_message(message.chat_id, message.content, message.nickname)
-                    self.refresh_display()
-                
-                self.get_user_color(message.nickname)
-                
-        except Exception as e:
-            self.add_notification_to_list(f"❌ Ошибка стриминга: {e}")
-    
-    def stop_streaming(self):
-        self.heartbeat_running = False
-        
-        if hasattr(self, 'message_queue') and self.message_queue is not None:
-            for chat_id in self.user_chats.keys():
-                leave_message = messenger_pb2.ChatMessage(
-                    content=f"Пользователь {self.nickname} покинул чат",
-                    nickname=self.nickname,
-                    chat_id=chat_id,
-                    type=messenger_pb2.USER_LEFT
-                )
-                self.message_queue.append(leave_message)
-            
-            time.sleep(0.5)
-        
-        if self.stream_stub:
-            try:
-                self.stream_stub.cancel()
-            except:
-                pass
-            self.stream_stub = None
-        
-        if self.stream_thread:
-            self.stream_thread.join(timeout=1)
-            self.stream_thread = None
-    
-    def display_messages(self):
-        self.clear_screen()
-        
-        print("=" * 80)
-        print(f"🎯 СТРИМИНГОВЫЙ ЧАТ - {self.nickname}")
-        print("=" * 80)
+    def compose_screen(self):
+        """Содержимое областей экрана для рендерера"""
+        header = [
+            "=" * 80,
+            f"🎯 СТРИМИНГОВЫЙ ЧАТ - {self.nickname}",
+            "=" * 80,
+        ]
         
+        notifications = []
         if self.notifications:
-            print("🔔 УВЕДОМЛЕНИЯ:")
+            notifications.append("🔔 УВЕДОМЛЕНИЯ:")
             for notification in self.notifications[-5:]:
-                print(f"  {notification}")
-            print()
+                notifications.append(f"  {notification}")
+            notifications.append("")
         
+        messages = []
         if self.current_chat_id is None:
-            print("🏠 ГЛАВНОЕ МЕНЮ")
-            print("=" * 40)
-            print("Доступные действия:")
-            print("  /create <название> - создать чат")
-            print("  /join <chat_id> - присоединиться к чату")
-            print("  /chats - список ваших чатов")
-            print("  /help - помощь")
-            print("  /exit - выход")
-            print()
+            messages.extend([
+                "🏠 ГЛАВНОЕ МЕНЮ",
+                "=" * 40,
+                "Доступные действия:",
+                "  /create <название> - создать чат",
+                "  /join <chat_id> - присоединиться к чату",
+                "  /chats - список ваших чатов",
+                "  /help - помощь",
+                "  /exit - выход",
+                "",
+            ])
         else:
-            chat_name = self.chat_names.get(self.current_chat_id, self.current_chat_id)
-            print(f"💬 ЧАТ: {chat_name} ({self.current_chat_id})")
-            print("=" * 40)
+            chat_name = self.chat_name(self.current_chat_id)
+            messages.append(f"💬 ЧАТ: {chat_name} ({self.current_chat_id})")
+            messages.append("=" * 40)
             
-            if self.current_chat_id in self.room_messages:
-                for msg in self.room_messages[self.current_chat_id][-20:]:  # Последние 20 сообщений
-                    color = self.get_user_color(msg['nickname'])
-                    if msg['is_sent']:
-                        print(f"  \033[{color}m[{msg['timestamp']}] {msg['nickname']}: {msg['content']}\033[0m")
-                    else:
-                        print(f"  \033[{color}m[{msg['timestamp']}] {msg['nickname']}: {msg['content']}\033[0m")
-            print()
+            if self.current_chat_id in self.client.history:
+                chat_messages = self.client.history.chat(self.current_chat_id)
+                if self.scroll_offset:
+                    messages.append(f"  ⬆️ История прокручена назад на {self.scroll_offset} сообщений (/latest - к последним)")
+                for msg in chat_messages.window(self.scroll_offset, VISIBLE_MESSAGES):
+                    color = self.get_user_color(msg.nickname)
+                    messages.append(f"  \033[{color}m[{msg.timestamp}] {msg.nickname}: {msg.content}\033[0m")
+            messages.append("")
         
-        print("-" * 80)
+        return {
+            "header": header,
+            "notifications": notifications,
+            "messages": messages,
+            "prompt": ["-" * 80, self.prompt_text()],
+        }
+    
+    def prompt_text(self):
         if self.current_chat_id:
-            print(f"💬 Введите сообщение или команду (чат: {self.chat_names.get(self.current_chat_id, self.current_chat_id)}): ", end="", flush=True)
-        else:
-            print("💬 Введите команду: ", end="", flush=True)
+            return f"💬 Введите сообщение или команду (чат: {self.chat_name(self.current_chat_id)}): "
+        return "💬 Введите команду: "
+    
+    def display_messages(self):
+        self.renderer.render()
     
     def clear_screen(self):
-        os.system('clear' if os.name == 'posix' else 'cls')
+        self.renderer.invalidate()
     
     def refresh_display(self):
-        if self.current_chat_id:
-            print(f"[DEBUG] Обновляем отображение для чата {self.current_chat_id}")
-            self.display_messages()
+        # События стрима только помечают экран грязным, кадры сливаются рендерером
+        self.renderer.request()
+    
+    @staticmethod
+    def schedule_redraw(delay, callback):
+        asyncio.get_running_loop().call_later(delay, callback)
     
     def show_help(self):
         print("\n📖 СПРАВКА ПО КОМАНДАМ:")
@@ -391,14 +351,18 @@ class StreamingConsoleChat:
         print("  /home              - вернуться в главное меню")
         print("  /notifications     - очистить все уведомления")
         print("  /colors            - показать цвета пользователей")
+        print("  /stats             - метрики клиента")
+        print("  /stats save [файл] - сохранить метрики в формате Prometheus")
         print("  /help              - показать эту справку")
         print("  /exit              - выйти из программы")
         print()
         print("💬 В ЧАТЕ:")
         print("  /leave             - покинуть текущий чат")
         print("  /history           - показать историю сообщений")
+        print("  /more              - загрузить более ранние сообщения")
+        print("  /latest            - вернуться к последним сообщениям")
         print("  /current           - информация о текущем чате")
-        print("  /ttl <минуты>      - установить TTL для чата (в минутах)")
+        print("  /ttl <минуты>      - установить TTL для чата (в минутах, 0 - бессрочно)")
         print()
         print("🔄 СТРИМИНГ:")
         print("  Все действия автоматически отправляются через стрим")
@@ -411,13 +375,25 @@ class StreamingConsoleChat:
         print(f"👤 Пользователь: {self.nickname}")
         print(f"🌐 Сервер: {self.server_address}")
         print(f"💬 Текущий чат: {self.current_chat_id or 'Главное меню'}")
-        print(f"📝 Всего чатов: {len(self.user_chats)}")
+        print(f"📝 Всего чатов: {len(self.client.user_chats)}")
         print(f"🔔 Уведомлений: {len(self.notifications)}")
         print(f"🎨 Пользователей с цветами: {len(self.user_colors)}")
-        print(f"🔄 Стриминг: {'Активен' if self.stream_stub else 'Неактивен'}")
+        print(f"🔄 Стриминг: {'Активен' if self.client.stream_call else 'Неактивен'}")
         print("=" * 30)
     
-    def process_command(self, user_input):
+    def show_stats(self):
+        print()
+        for line in self.metrics.report_lines():
+            print(line)
+    
+    def save_stats(self, path):
+        try:
+            self.metrics.write(path)
+            print(f"\n✅ Метрики сохранены в {path}")
+        except OSError as e:
+            print(f"\n❌ Не удалось сохранить метрики: {e}")
+    
+    async def process_command(self, user_input):
         parts = user_input.strip().split()
         if not parts:
             return
@@ -433,17 +409,23 @@ class StreamingConsoleChat:
         elif command == "/status":
             self.show_status()
             return
+        elif command == "/stats":
+            if len(parts) > 1 and parts[1] == "save":
+                self.save_stats(parts[2] if len(parts) > 2 else self.metrics_file)
+            else:
+                self.show_stats()
+            return
         elif command == "/home":
             self.current_chat_id = None
             self.add_notification_to_list("🏠 Перешли в главное меню")
             return
         elif command == "/chats":
-            chats = self.get_user_chats()
+            chats = await self.get_user_chats()
             if chats:
                 print("\n📋 ВАШИ ЧАТЫ:")
                 print("=" * 40)
                 for chat in chats:
-                    chat_name = self.chat_names.get(chat.chat_id, chat.chat_id)
+                    chat_name = self.chat_name(chat.chat_id)
                     new_messages = chat.new_messages
                     status = f" ({new_messages} новых)" if new_messages > 0 else ""
                     print(f"  • {chat_name} (ID: {chat.chat_id}){status}")
@@ -456,42 +438,52 @@ class StreamingConsoleChat:
                 print("❌ Укажите название чата: /create <название>")
                 return
             chat_name = " ".join(parts[1:])
-            chat_id = self.create_chat(chat_name)
+            chat_id = await self.create_chat(chat_name)
             if chat_id:
-                self.get_user_chats()
+                await self.get_user_chats()
         elif command == "/join":
             if len(parts) < 2:
                 print("❌ Укажите ID чата: /join <chat_id>")
                 return
             chat_id = parts[1]
-            if self.join_chat(chat_id):
-                self.switch_chat(chat_id)
+            if await self.join_chat(chat_id):
+                await self.switch_chat(chat_id)
         elif command == "/leave":
             if not self.current_chat_id:
                 print("❌ Вы не в чате")
                 return
-            if self.leave_chat(self.current_chat_id):
+            if await self.leave_chat(self.current_chat_id):
                 self.current_chat_id = None
                 self.add_notification_to_list("🏠 Вернулись в главное меню")
         elif command == "/history":
             if not self.current_chat_id:
                 print("❌ Вы не в чате")
                 return
-            self.get_chat_messages(self.current_chat_id)
-            print(f"\n📜 История сообщений чата {self.chat_names.get(self.current_chat_id, self.current_chat_id)} обновлена")
+            await self.get_chat_messages(self.current_chat_id)
+            self.scroll_offset = 0
+            print(f"\n📜 История сообщений чата {self.chat_name(self.current_chat_id)} обновлена")
             return
+        elif command == "/more":
+            if not self.current_chat_id:
+                print("❌ Вы не в чате")
+                return
+            await self.scroll_back()
+        elif command == "/latest":
+            self.scroll_offset = 0
         elif command == "/current":
             if not self.current_chat_id:
                 print("❌ Вы не в чате")
                 return
-            chat_name = self.chat_names.get(self.current_chat_id, self.current_chat_id)
-            chat_stats = self.user_chats.get(self.current_chat_id)
+            chat_name = self.chat_name(self.current_chat_id)
+            chat_stats = self.client.user_chats.get(self.current_chat_id)
             new_messages = chat_stats.new_messages if chat_stats else 0
             print(f"\n💬 ТЕКУЩИЙ ЧАТ:")
             print(f"  Название: {chat_name}")
             print(f"  ID: {self.current_chat_id}")
+            if chat_stats and chat_stats.created_by:
+                print(f"  Создал: {chat_stats.created_by} {chat_stats.created_at}")
             print(f"  Новых сообщений: {new_messages}")
-            print(f"  Всего сообщений: {len(self.room_messages.get(self.current_chat_id, []))}")
+            print(f"  Всего сообщений: {self.client.history.count(self.current_chat_id)}")
             return
         elif command == "/notifications":
             self.notifications = []
@@ -521,46 +513,57 @@ class StreamingConsoleChat:
                     return
                 
                 # Отправляем сообщение с типом SET_TTL_TO_CHAT
-                if hasattr(self, 'message_queue') and self.message_queue is not None:
-                    ttl_message = messenger_pb2.ChatMessage(
-                        content=f"TTL установлен на {minutes} минут",
-                        nickname=self.nickname,
-                        chat_id=self.current_chat_id,
-                        type=messenger_pb2.SET_TTL_TO_CHAT,
-                        ttl=minutes
-                    )
-                    self.message_queue.append(ttl_message)
-                    self.add_notification_to_list(f"⏱️ TTL установлен на {minutes} минут для чата")
-                else:
+                result = await self.client.set_ttl(self.current_chat_id, minutes)
+                if result is None:
                     print("❌ Стриминг не активен")
+                elif result != REJECTED:
+                    self.add_notification_to_list(f"⏳ TTL {minutes} минут отправлен, ждём подтверждения сервера")
             except ValueError:
                 print("❌ Количество минут должно быть числом")
             return
         else:
             if self.current_chat_id:
-                self.send_message(user_input)
+                await self.send_message(user_input)
             else:
                 print("❌ Выберите чат для отправки сообщения")
     
-    def run(self):
+    async def run(self):
+        self.stdin.start()
+        
         print("🎯 СТРИМИНГОВЫЙ ЧАТ")
         print("=" * 50)
         
-        self.nickname = input("Введите ваше имя: ").strip()
+        try:
+            self.nickname = (await self.stdin.readline("Введите ваше имя: ")).strip()
+        except EOFError:
+            self.nickname = None
         if not self.nickname:
             print("❌ Имя не может быть пустым")
+            self.stdin.stop()
             return
         
-        if not self.connect():
+        if not await self.connect():
             print("❌ Не удалось подключиться к серверу")
+            self.stdin.stop()
             return
         
+        self.client = self.connection.session(
+            self.nickname,
+            cache_dir=self.cache_dir,
+            history_limit=self.history_limit,
+            outbound_queue_size=self.outbound_queue_size,
+            outbound_policy=self.outbound_policy,
+        )
+        self.client.add_listener(self.on_events)
+        self.tracer.resource["enduser.id"] = self.nickname
         self.get_user_color(self.nickname)
                 
-        if not self.start_streaming():
+        if not await self.start_streaming():
+            await self.disconnect()
+            self.stdin.stop()
             return
         
-        self.get_user_chats()
+        await self.get_user_chats()
         
         self.add_notification_to_list(f"👋 Добро пожаловать, {self.nickname}!")
         self.add_notification_to_list("🔄 Стриминг активен - сообщения приходят в реальном времени")
@@ -568,25 +571,36 @@ class StreamingConsoleChat:
         self.running = True
         
         try:
+            no_update_commands = ["/help", "/status", "/stats", "/rooms", "/history", "/current", "/notifications", "/home", "/colors"]
+            
+            self.display_messages()
             while self.running:
-                no_update_commands = ["/help", "/status", "/rooms", "/history", "/current", "/notifications", "/home", "/colors"]
-                
-                self.display_messages()
-                user_input = input()
+                try:
+                    user_input = await self.stdin.readline()
+                except EOFError:
+                    print("\n👋 Выход из чата...")
+                    break
                 
+                # После ввода и вывода команды содержимое экрана рендереру неизвестно
+                self.clear_screen()
                 if not user_input.strip():
+                    self.display_messages()
                     continue
                 
-                self.process_command(user_input)
+                await self.process_command(user_input)
                 
                 if self.running and not any(user_input.strip().startswith(cmd) for cmd in no_update_commands):
                     self.display_messages()
+                elif self.running and not self.renderer.valid:
+                    # Вывод команды остаётся на экране до следующего ввода
+                    print(f"\n{self.prompt_text()}", end="", flush=True)
                     
-        except KeyboardInterrupt:
-            print("\n👋 Выход из чата...")
         finally:
-            self.stop_streaming()
-            self.disconnect()
+            await self.disconnect()
+            self.stdin.stop()
+            self.tracer.close()
+            if self.metrics_file_on_exit:
+                self.save_stats(self.metrics_file)
 
 
 if __name__ == "__main__":
@@ -594,8 +608,31 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='Стриминговый консольный чат')
     parser.add_argument('--server', default='localhost:8080', help='Адрес сервера (по умолчанию: localhost:8080)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'Каталог локального кэша сообщений (по умолчанию: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--no-cache', action='store_true', help='Не использовать локальный кэш сообщений')
+    parser.add_argument('--history-limit', type=int, default=DEFAULT_HISTORY_LIMIT, help=f'Сколько сообщений каждого чата держать в памяти (по умолчанию: {DEFAULT_HISTORY_LIMIT})')
+    parser.add_argument('--metrics-file', default=None, help='Файл для метрик в формате Prometheus, записывается при выходе и по /stats save')
+    parser.add_argument('--trace-file', default=None, help='Файл для спанов в формате OTLP-JSON (по умолчанию трассировка выключена)')
+    parser.add_argument('--outbound-queue-size', type=int, default=DEFAULT_OUTBOUND_QUEUE_SIZE, help=f'Сколько кадров может ждать отправки (по умолчанию: {DEFAULT_OUTBOUND_QUEUE_SIZE})')
+    parser.add_argument('--outbound-policy', choices=POLICIES, default=MERGE, help=f'Что делать при полной очереди отправки: block - ждать, drop-oldest - вытеснять старейший кадр, merge - объединять повторные служебные кадры и отклонять новые (по умолчанию: {MERGE})')
+    add_transport_arguments(parser)
     
     args = parser.parse_args()
+    # Консоль показывает историю из памяти, без неё экран чата и /current не работают
+    if args.history_limit < 1:
+        parser.error("--history-limit должен быть не меньше 1")
     
-    chat = StreamingConsoleChat(args.server)
-    chat.run()
+    chat = StreamingConsoleChat(
+        args.server,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        history_limit=args.history_limit,
+        metrics_file=args.metrics_file,
+        trace_file=args.trace_file,
+        outbound_queue_size=args.outbound_queue_size,
+        outbound_policy=args.outbound_policy,
+        transport=TransportOptions.from_args(args),
+    )
+    try:
+        asyncio.run(chat.run())
+    except KeyboardInterrupt:
+        print("\n👋 Выход из чата...")
@@ -0,0 +1,109 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "grpc-chat")
+
+CachedMessage = namedtuple("CachedMessage", ["id", "chat_id", "seq", "nickname", "content", "created_at"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    nickname TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (chat_id, id)
+);
+CREATE INDEX IF NOT EXISTS messages_chat_seq ON messages (chat_id, seq);
+CREATE TABLE IF NOT EXISTS chat_sync (
+    chat_id TEXT PRIMARY KEY,
+    synced_seq INTEGER NOT NULL
+);
+"""
+
+
+class MessageCache:
+    """Локальный кэш сообщений пользователя в SQLite
+
+    synced_seq - seq, до которого история чата в кэше непрерывна. Его двигают
+    только ответы GetMessages/GetMessagesSince; сообщения из стрима сохраняются,
+    но не сдвигают его, поэтому догрузка после рестарта не оставляет дыр.
+    """
+
+    def __init__(self, nickname, server_address, cache_dir=DEFAULT_CACHE_DIR):
+        directory = os.path.join(cache_dir, self._safe_name(server_address))
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{self._safe_name(nickname)}.sqlite3")
+
+        # Кэш используется из нескольких потоков простого клиента
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    @staticmethod
+    def _safe_name(value):
+        return re.sub(r"[^\w.@-]", "_", value)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def store(self, messages, synced_seq=None, chat_id=None):
+        """Сохранить сообщения (Message или ChatMessage) и, если указано, сдвинуть synced_seq чата"""
+        rows = [
+            (msg.chat_id, msg.id, msg.seq, msg.nickname, msg.content, msg.created_at)
+            for msg in messages
+            if msg.id and msg.seq
+        ]
+        with self.lock, self.db:
+            if rows:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO messages (chat_id, id, seq, nickname, content, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            if synced_seq is not None:
+                self.db.execute(
+                    "INSERT INTO chat_sync (chat_id, synced_seq) VALUES (?, ?) "
+                    "ON CONFLICT (chat_id) DO UPDATE SET synced_seq = MAX(synced_seq, excluded.synced_seq)",
+                    (chat_id, synced_seq),
+                )
+
+    def synced_seq(self, chat_id):
+        """Seq, после которого нужно догружать историю чата с сервера (None - чата нет в кэше)"""
+        with self.lock:
+            row = self.db.execute("SELECT synced_seq FROM chat_sync WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0] if row else None
+
+    def latest(self, chat_id, limit, upto):
+        """Последние limit сообщений чата с seq не больше upto в порядке seq"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, chat_id, seq, nickname, content, created_at FROM messages "
+                "WHERE chat_id = ? AND seq <= ? ORDER BY seq DESC LIMIT ?",
+                (chat_id, upto, limit),
+            ).fetchall()
+        return [CachedMessage(*row) for row in reversed(rows)]
+
+    def older(self, chat_id, before, limit):
+        """До limit сообщений чата с seq меньше before в порядке seq"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, chat_id, seq, nickname, content, created_at FROM messages "
+                "WHERE chat_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (chat_id, before, limit),
+            ).fetchall()
+        return [CachedMessage(*row) for row in reversed(rows)]
+
+    def drop_chat(self, chat_id):
+        """Удалить чат из кэша"""
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self.db.execute("DELETE FROM chat_sync WHERE chat_id = ?", (chat_id,))
@@ -0,0 +1,169 @@
+from collections import deque
+from datetime import datetime
+from itertools import islice
+
+
+DEFAULT_HISTORY_LIMIT = 1000
+
+
+class StoredMessage:
+    """Сообщение чата в памяти клиента"""
+
+    __slots__ = ("id", "seq", "nickname", "content", "timestamp", "kind")
+
+    def __init__(self, content, nickname, kind="received", id="", seq=0, timestamp=None):
+        self.id = id
+        self.seq = seq
+        self.nickname = nickname
+        self.content = content
+        self.timestamp = timestamp or datetime.now().strftime("%H:%M:%S")
+        self.kind = kind
+
+    @property
+    def is_sent(self):
+        return self.kind == "sent"
+
+
+class ChatHistory:
+    """Кольцевой буфер последних сообщений одного чата
+
+    Добавление и вытеснение старейшего сообщения - O(1). ID хранимых
+    сообщений держатся в отдельном множестве, чтобы повторно пришедшие
+    сообщения (кэш, догрузка, повтор истории в стриме) не дублировались.
+    Отправленные через стрим сообщения ждут ID в unconfirmed, пока
+    сервер не вернёт их в повторе истории.
+    """
+
+    __slots__ = ("messages", "ids", "unconfirmed")
+
+    def __init__(self, limit):
+        self.messages = deque(maxlen=limit)
+        self.ids = set()
+        self.unconfirmed = deque()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    @property
+    def limit(self):
+        return self.messages.maxlen
+
+    def append(self, message):
+        """Добавить новое сообщение в конец; False, если оно уже есть"""
+        if message.id:
+            if message.id in self.ids:
+                return False
+            self.ids.add(message.id)
+
+        if len(self.messages) == self.messages.maxlen:
+            evicted = self.messages[0]
+            if evicted.id:
+                self.ids.discard(evicted.id)
+            elif self.unconfirmed and self.unconfirmed[0] is evicted:
+                self.unconfirmed.popleft()
+
+        if message.is_sent and not message.id:
+            self.unconfirmed.append(message)
+        self.messages.append(message)
+        return True
+
+    def prepend(self, messages):
+        """Добавить более ранние сообщения в начало, пока есть место; возвращает число добавленных"""
+        added = 0
+        for message in reversed(messages):
+            if len(self.messages) == self.messages.maxlen:
+                break
+            if message.id:
+                if message.id in self.ids:
+                    continue
+                self.ids.add(message.id)
+            self.messages.appendleft(message)
+            added += 1
+        return added
+
+    def confirm(self, message, id, seq=0):
+        """Присвоить отправленному сообщению ID и seq, выданные сервером"""
+        message.id = id
+        message.seq = seq
+        self.ids.add(id)
+
+    def confirm_sent(self, content, id, seq=0):
+        """Найти старейшее отправленное сообщение без ID с тем же текстом и подтвердить его
+
+        Сообщения уходят в порядке отправки, поэтому первое совпадение по тексту
+        и есть вернувшееся. False, если ждущего подтверждения сообщения нет.
+        """
+        for message in self.unconfirmed:
+            if message.content == content:
+                self.unconfirmed.remove(message)
+                self.confirm(message, id, seq)
+                return True
+        return False
+
+    def discard_sent(self, content):
+        """Убрать старейшее отправленное сообщение без ID с тем же текстом: сервер его не сохранил"""
+        for message in self.unconfirmed:
+            if message.content == content:
+                self.unconfirmed.remove(message)
+                self.messages.remove(message)
+                return True
+        return False
+
+    def is_full(self):
+        return len(self.messages) == self.messages.maxlen
+
+    def oldest_seq(self):
+        """Seq самого раннего сообщения, известного серверу (0, если таких нет)"""
+        for message in self.messages:
+            if message.seq:
+                return message.seq
+        return 0
+
+    def window(self, offset, count):
+        """count сообщений, заканчивающихся за offset сообщений до конца истории"""
+        end = len(self.messages) - offset
+        return list(islice(self.messages, max(0, end - count), max(0, end)))
+
+    def clear(self):
+        self.messages.clear()
+        self.ids.clear()
+        self.unconfirmed.clear()
+
+
+class MessageStore:
+    """История сообщений по чатам с ограничением на размер каждого чата"""
+
+    def __init__(self, history_limit=DEFAULT_HISTORY_LIMIT):
+        self.history_limit = history_limit
+        self.chats = {}
+
+    def __contains__(self, chat_id):
+        return chat_id in self.chats
+
+    def chat(self, chat_id):
+        """История чата (создаётся при первом обращении)"""
+        history = self.chats.get(chat_id)
+        if history is None:
+            history = self.chats[chat_id] = ChatHistory(self.history_limit)
+        return history
+
+    def get(self, chat_id):
+        return self.chats.get(chat_id, ())
+
+    def append(self, chat_id, message):
+        return self.chat(chat_id).append(message)
+
+    def reset(self, chat_id):
+        """Очистить историю чата перед повторной загрузкой"""
+        history = self.chat(chat_id)
+        history.clear()
+        return history
+
+    def drop(self, chat_id):
+        self.chats.pop(chat_id, None)
+
+    def count(self, chat_id):
+        return len(self.chats.get(chat_id, ()))
@@ -0,0 +1,441 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from generated import messenger_pb2
+import grpc
+
+
+DEFAULT_METRICS_FILE = "chat_client.prom"
+
+# Границы корзин гистограмм в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+# created_at передаётся с точностью до секунды, мельче корзины не имеют смысла
+LAG_BUCKETS = (1, 2, 5, 10, 30, 60, 300, 900)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """Семейство метрик: одно имя, значения по наборам меток"""
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(суффикс имени, значения меток, доп. метки, значение)]"""
+        with self.lock:
+            return [("", key, (), value) for key, value in sorted(self.values.items())]
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labelnames, key, extra)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def items(self):
+        with self.lock:
+            return sorted(self.values.items())
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function):
+        """Значение без меток вычисляется при каждом чтении"""
+        self.function = function
+
+    def get(self, **labels):
+        if self.function is not None:
+            return self.function()
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        if self.function is not None:
+            return [("", (), (), self.function())]
+        return super().samples()
+
+
+class HistogramData:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = HistogramData(len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data.counts[index] += 1
+                    break
+            data.sum += value
+            data.count += 1
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def count(self, **labels):
+        with self.lock:
+            data = self.values.get(self.key(labels))
+            return data.count if data else 0
+
+    def keys(self):
+        with self.lock:
+            return sorted(self.values)
+
+    def quantile(self, q, **labels):
+        """Оценка квантиля по корзинам, как histogram_quantile в Prometheus"""
+        with self.lock:
+            data = self.values.get(self.key(labels))
+            if data is None or data.count == 0:
+                return None
+            counts = list(data.counts)
+            total = data.count
+
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if cumulative + count >= rank and count:
+                if bound == math.inf:
+                    # Выше последней границы оценить нельзя
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            if bound != math.inf:
+                lower = bound
+        return lower
+
+    def mean(self, **labels):
+        with self.lock:
+            data = self.values.get(self.key(labels))
+            if data is None or data.count == 0:
+                return None
+            return data.sum / data.count
+
+    def samples(self):
+        result = []
+        with self.lock:
+            for key, data in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, data.counts):
+                    cumulative += count
+                    result.append(("_bucket", key, (("le", format_value(bound)),), cumulative))
+                result.append(("_sum", key, (), data.sum))
+                result.append(("_count", key, (), data.count))
+        return result
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Набор метрик процесса с выгрузкой в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"метрика {metric.name} уже зарегистрирована с другим типом или метками")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def exposition(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Записать метрики в файл атомарно: textfile-коллектор не увидит файл наполовину"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.exposition())
+        os.replace(tmp_path, path)
+
+
+def method_name(method):
+    """'/generated.Messenger/SendMessage' -> 'SendMessage'"""
+    if isinstance(method, bytes):
+        method = method.decode()
+    return method.rsplit("/", 1)[-1]
+
+
+def parse_created_at(created_at):
+    if not created_at:
+        return None
+    try:
+        created = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if created.tzinfo is None:
+        return None
+    return created.timestamp()
+
+
+class MetricsInterceptor(grpc.UnaryUnaryClientInterceptor):
+    """Замер унарных вызовов синхронного канала"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        started = time.perf_counter()
+        outcome = continuation(client_call_details, request)
+        self.metrics.observe_rpc(client_call_details.method, outcome.code(), time.perf_counter() - started)
+        return outcome
+
+
+class AioMetricsInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    """Замер унарных вызовов asyncio-канала"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        started = time.perf_counter()
+        call = await continuation(client_call_details, request)
+        try:
+            await call
+        except grpc.RpcError:
+            # Ошибку получит вызывающий код, когда дождётся call
+            pass
+        self.metrics.observe_rpc(client_call_details.method, await call.code(), time.perf_counter() - started)
+        return call
+
+
+class ClientMetrics:
+    """Метрики консольных клиентов: RPC, кадры стрима, очередь отправки, отрисовка, задержка доставки"""
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        self.rpc_duration = self.registry.histogram(
+            "chat_client_rpc_duration_seconds",
+            "Длительность унарных вызовов Messenger",
+            ("method",),
+        )
+        self.rpc_requests = self.registry.counter(
+            "chat_client_rpc_requests_total",
+            "Унарные вызовы Messenger по коду ответа",
+            ("method", "code"),
+        )
+        self.stream_frames = self.registry.counter(
+            "chat_client_stream_frames_total",
+            "Кадры ChatStream по направлению и типу",
+            ("direction", "type"),
+        )
+        self.outbound_depth = self.registry.gauge(
+            "chat_client_outbound_queue_depth",
+            "Сообщения, ожидающие отправки",
+        )
+        self.outbound_enqueued = self.registry.counter(
+            "chat_client_outbound_enqueued_total",
+            "Кадры, поставленные в очередь отправки, по результату (queued, merged, dropped_oldest, rejected)",
+            ("result",),
+        )
+        self.event_queue_depth = self.registry.gauge(
+            "chat_client_event_queue_depth",
+            "Полученные кадры, ожидающие обработки",
+        )
+        self.events_dropped = self.registry.counter(
+            "chat_client_events_dropped_total",
+            "Кадры, не поместившиеся в очередь событий",
+            ("type",),
+        )
+        self.render_duration = self.registry.histogram(
+            "chat_client_render_duration_seconds",
+            "Время построения и вывода кадра экрана",
+            ("mode",),
+            buckets=RENDER_BUCKETS,
+        )
+        self.render_bytes = self.registry.counter(
+            "chat_client_render_bytes_total",
+            "Байты, записанные в терминал при отрисовке",
+            ("mode",),
+        )
+        self.delivery_lag = self.registry.histogram(
+            "chat_client_delivery_lag_seconds",
+            "Задержка от created_at сообщения до его получения клиентом",
+            buckets=LAG_BUCKETS,
+        )
+
+    def interceptor(self):
+        return MetricsInterceptor(self)
+
+    def aio_interceptor(self):
+        return AioMetricsInterceptor(self)
+
+    def observe_rpc(self, method, code, seconds):
+        name = method_name(method)
+        self.rpc_duration.observe(seconds, method=name)
+        self.rpc_requests.inc(method=name, code=code.name if code is not None else "UNKNOWN")
+
+    def observe_frame(self, direction, message):
+        self.stream_frames.inc(direction=direction, type=messenger_pb2.ChatMessageType.Name(message.type))
+
+    def observe_render(self, seconds, full, written):
+        mode = "full" if full else "diff"
+        self.render_duration.observe(seconds, mode=mode)
+        self.render_bytes.inc(written, mode=mode)
+
+    def observe_delivery(self, created_at, now=None):
+        created = parse_created_at(created_at)
+        if created is None:
+            return
+        now = time.time() if now is None else now
+        self.delivery_lag.observe(max(0.0, now - created))
+
+    def write(self, path):
+        self.registry.write(path)
+
+    def report_lines(self):
+        """Сводка для команды /stats"""
+        lines = ["📈 МЕТРИКИ КЛИЕНТА:"]
+
+        lines.append("⏱️ RPC (мс):")
+        methods = [key[0] for key in self.rpc_duration.keys()]
+        if methods:
+            lines.append(f"   {'метод':<18}{'вызовов':>9}{'ошибок':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+            errors = {}
+            for (method, code), count in self.rpc_requests.items():
+                if code != "OK":
+                    errors[method] = errors.get(method, 0) + count
+            for method in methods:
+                quantiles = (self.rpc_duration.quantile(q, method=method) for q in (0.5, 0.95, 0.99))
+                lines.append(
+                    f"   {method:<18}{self.rpc_duration.count(method=method):>9}{errors.get(method, 0):>8}"
+                    + "".join(f"{q * 1000:>9.1f}" for q in quantiles)
+                )
+        else:
+            lines.append("   вызовов не было")
+
+        frames = self.stream_frames.items()
+        if frames:
+            for direction, title in (("out", "📤 Кадров отправлено"), ("in", "📥 Кадров получено")):
+                counts = [f"{frame_type} {count}" for (d, frame_type), count in frames if d == direction]
+                lines.append(f"{title}: {', '.join(counts) if counts else '0'}")
+
+        overflow = ", ".join(
+            f"{title} {format_value(self.outbound_enqueued.get(result=result))}"
+            for result, title in (("merged", "объединено"), ("dropped_oldest", "вытеснено"), ("rejected", "отклонено"))
+            if self.outbound_enqueued.get(result=result)
+        )
+        lines.append(f"📦 Очередь отправки: {format_value(self.outbound_depth.get())}" + (f", {overflow}" if overflow else ""))
+        dropped = sum(count for _, count in self.events_dropped.items())
+        if frames:
+            lines.append(f"📥 Очередь событий: {format_value(self.event_queue_depth.get())}, отброшено кадров: {format_value(dropped)}")
+
+        for mode, title in (("diff", "построчных"), ("full", "полных")):
+            count = self.render_duration.count(mode=mode)
+            if count:
+                lines.append(
+                    f"🖥️ Кадров {title}: {count}, p50 {self.render_duration.quantile(0.5, mode=mode) * 1000:.2f} мс,"
+                    f" p95 {self.render_duration.quantile(0.95, mode=mode) * 1000:.2f} мс,"
+                    f" {format_value(self.render_bytes.get(mode=mode))} байт"
+                )
+
+        count = self.delivery_lag.count()
+        if count:
+            lines.append(
+                f"📬 Задержка доставки: {count} сообщений, p50 {self.delivery_lag.quantile(0.5):.1f} с,"
+                f" p95 {self.delivery_lag.quantile(0.95):.1f} с"
+            )
+        else:
+            lines.append("📬 Задержка доставки: сообщений не получено")
+        return lines
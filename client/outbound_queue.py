@@ -0,0 +1,105 @@
+import asyncio
+from collections import deque
+from generated import messenger_pb2
+
+
+DEFAULT_OUTBOUND_QUEUE_SIZE = 1000
+
+# Политики переполнения очереди отправки
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+MERGE = "merge"
+POLICIES = (BLOCK, DROP_OLDEST, MERGE)
+
+# Результат постановки кадра в очередь
+QUEUED = "queued"
+MERGED = "merged"  # Заменил ещё не отправленный такой же служебный кадр
+DROPPED_OLDEST = "dropped_oldest"  # Поставлен, старейший кадр очереди отброшен
+REJECTED = "rejected"  # Очередь полна, кадр не поставлен
+
+# Служебные кадры, из которых важен только последний: повторный вход в чат
+# несёт более свежий seq, повторный heartbeat ничего не добавляет
+MERGEABLE_TYPES = (messenger_pb2.USER_GOT_IN, messenger_pb2.USER_CONNECTED)
+
+
+class OutboundQueue:
+    """Ограниченная очередь кадров ChatStream с политикой переполнения
+
+    block - put() ждёт, пока отправка освободит место;
+    drop-oldest - новый кадр вытесняет старейший, его получает on_drop;
+    merge - служебный кадр того же типа и чата заменяет стоящий в очереди,
+    а при полной очереди без такого кадра новый кадр отклоняется.
+    None закрывает поток запросов и ставится в очередь вне лимита.
+    """
+
+    def __init__(self, maxsize=DEFAULT_OUTBOUND_QUEUE_SIZE, policy=MERGE, on_drop=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown outbound queue policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+        self.frames = deque()
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    def qsize(self):
+        return len(self.frames)
+
+    def full(self):
+        return len(self.frames) >= self.maxsize
+
+    def offer(self, frame):
+        """Поставить кадр без ожидания, вернуть QUEUED, MERGED, DROPPED_OLDEST или REJECTED"""
+        if self.policy == MERGE and frame.type in MERGEABLE_TYPES:
+            for index, queued in enumerate(self.frames):
+                if queued is not None and queued.type == frame.type and queued.chat_id == frame.chat_id:
+                    self.frames[index] = frame
+                    if self.on_drop:
+                        self.on_drop(queued)
+                    return MERGED
+
+        result = QUEUED
+        if self.full():
+            if self.policy != DROP_OLDEST:
+                return REJECTED
+            dropped = self.frames.popleft()
+            if self.on_drop:
+                self.on_drop(dropped)
+            result = DROPPED_OLDEST
+
+        self.push(frame)
+        return result
+
+    async def put(self, frame):
+        """Как offer, но с политикой block дождаться места в очереди"""
+        if self.policy == BLOCK:
+            while self.full():
+                self.writable.clear()
+                await self.writable.wait()
+        return self.offer(frame)
+
+    def close(self):
+        self.push(None)
+
+    def push(self, frame):
+        self.frames.append(frame)
+        if self.full():
+            self.writable.clear()
+        self.readable.set()
+
+    def get_nowait(self):
+        if not self.frames:
+            raise asyncio.QueueEmpty
+        frame = self.frames.popleft()
+        if not self.frames:
+            self.readable.clear()
+        if not self.full():
+            self.writable.set()
+        return frame
+
+    async def get(self):
+        # Кадр забирается только после пробуждения, отмена ожидания его не теряет
+        while not self.frames:
+            await self.readable.wait()
+        return self.get_nowait()
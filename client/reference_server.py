@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from generated import messenger_pb2
+from generated import messenger_pb2_grpc
+from tracing import NOOP_SPAN, SPAN_KIND_SERVER, SpanContext, Tracer
+from transport import COMPRESSIONS
+import grpc
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+SINCE_PAGE_SIZE = 100
+MAX_BATCH_SIZE = 500
+
+
+class StoredChatMessage:
+    __slots__ = ("id", "seq", "chat_id", "nickname", "content", "created_at", "expires_at")
+
+    def __init__(self, seq, chat_id, nickname, content):
+        self.id = str(uuid.uuid4())
+        self.seq = seq
+        self.chat_id = chat_id
+        self.nickname = nickname
+        self.content = content
+        self.created_at = datetime.now(timezone.utc).astimezone().isoformat(timespec="seconds")
+        self.expires_at = None
+
+    def expired(self, now):
+        return self.expires_at is not None and self.expires_at <= now
+
+    def to_proto(self):
+        return messenger_pb2.Message(
+            id=self.id,
+            content=self.content,
+            chat_id=self.chat_id,
+            nickname=self.nickname,
+            created_at=self.created_at,
+            seq=self.seq,
+        )
+
+    def to_frame(self, message_type=messenger_pb2.MESSAGE):
+        return messenger_pb2.ChatMessage(
+            id=self.id,
+            content=self.content,
+            nickname=self.nickname,
+            chat_id=self.chat_id,
+            created_at=self.created_at,
+            type=message_type,
+            seq=self.seq,
+        )
+
+
+class Chat:
+    """Чат: участники с непрочитанными и сообщения в порядке seq"""
+
+    def __init__(self, chat_id, created_by=""):
+        self.chat_id = chat_id
+        self.name = chat_id  # Как у Go-сервера: ID чата - его название
+        self.created_by = created_by
+        self.created_at = datetime.now(timezone.utc).astimezone().isoformat(timespec="seconds")
+        self.ttl = 0  # Время жизни сообщений в минутах, 0 - бессрочно
+        self.unread = {}  # {nickname: new_messages}
+        self.messages = []
+        self.seqs = []
+        self.last_seq = 0
+
+    def add_message(self, nickname, content):
+        return self.add_messages(nickname, [content])[0]
+
+    def add_messages(self, nickname, contents):
+        messages = []
+        for content in contents:
+            self.last_seq += 1
+            messages.append(StoredChatMessage(self.last_seq, self.chat_id, nickname, content))
+        if self.ttl:
+            # Политика чата действует и на сообщения, отправленные после её установки
+            expires_at = time.monotonic() + self.ttl * 60
+            for message in messages:
+                message.expires_at = expires_at
+        self.messages.extend(messages)
+        self.seqs.extend(message.seq for message in messages)
+        for member in self.unread:
+            if member != nickname:
+                self.unread[member] += len(messages)
+        return messages
+
+    def purge_expired(self):
+        now = time.monotonic()
+        if not any(message.expired(now) for message in self.messages):
+            return
+        self.messages = [message for message in self.messages if not message.expired(now)]
+        self.seqs = [message.seq for message in self.messages]
+
+    def page(self, limit, before=0, after=0):
+        """Страница как у Repository.GetMessages: после after по возрастанию, иначе последняя до before"""
+        self.purge_expired()
+        lo = bisect_right(self.seqs, after) if after else 0
+        hi = bisect_left(self.seqs, before) if before else len(self.seqs)
+        if after:
+            page = self.messages[lo:min(hi, lo + limit)]
+            return page, hi - lo > limit
+        page = self.messages[max(lo, hi - limit):hi]
+        return page, hi - lo > limit
+
+
+class ReferenceMessenger(messenger_pb2_grpc.MessengerServicer):
+    """Эталонная реализация сервиса Messenger в памяти процесса
+
+    Повторяет поведение Go-сервера, включая рассылку в ChatStream и
+    SET_TTL_TO_CHAT, но хранит всё в индексах в памяти: чат -> участники,
+    пользователь -> чаты, чат -> сообщения по seq.
+    """
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer or Tracer()
+        self.chats = {}  # {chat_id: Chat}
+        self.user_chats = {}  # {nickname: set(chat_id)}
+        self.streams = {}  # {nickname: set(asyncio.Queue исходящих кадров)}, по сессии на устройство
+
+    async def require_chat(self, chat_id, context):
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            await context.abort(grpc.StatusCode.NOT_FOUND, "chat not found")
+        return chat
+
+    def add_member(self, chat, nickname):
+        chat.unread[nickname] = 0
+        self.user_chats.setdefault(nickname, set()).add(chat.chat_id)
+
+    def remove_member(self, chat_id, nickname):
+        chat = self.chats.get(chat_id)
+        if chat is not None:
+            chat.unread.pop(nickname, None)
+        self.user_chats.get(nickname, set()).discard(chat_id)
+
+    def set_read(self, chat_id, nickname):
+        chat = self.chats.get(chat_id)
+        if chat is not None and nickname in chat.unread:
+            chat.unread[nickname] = 0
+
+    def set_ttl(self, chat_id, ttl_minutes):
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            return
+        chat.ttl = ttl_minutes
+        expires_at = time.monotonic() + ttl_minutes * 60 if ttl_minutes else None
+        for message in chat.messages:
+            message.expires_at = expires_at
+
+    async def SendMessage(self, request, context):
+        chat = await self.require_chat(request.chat_id, context)
+        message = chat.add_message(request.nickname, request.message)
+        return messenger_pb2.SendMessageResponse(message_id=message.id)
+
+    async def SendMessages(self, request, context):
+        if len(request.messages) > MAX_BATCH_SIZE:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "too many messages in batch")
+        chat = await self.require_chat(request.chat_id, context)
+        messages = chat.add_messages(request.nickname, request.messages)
+        # Участники со стримом получают пачку одним кадром, как при отправке через стрим
+        self.broadcast(request.chat_id, self.batch_frame(request.nickname, request.chat_id, messages), None)
+        return messenger_pb2.SendMessagesResponse(
+            message_ids=[message.id for message in messages],
+            seqs=[message.seq for message in messages],
+        )
+
+    async def GetMessages(self, request, context):
+        chat = await self.require_chat(request.chat_id, context)
+        limit = min(request.limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        page, has_more = chat.page(limit, request.before, request.after)
+        return messenger_pb2.GetMessagesResponse(
+            messages=[message.to_proto() for message in page],
+            has_more=has_more,
+        )
+
+    async def GetMessagesSince(self, request, context):
+        chat = await self.require_chat(request.chat_id, context)
+        page, has_more = chat.page(SINCE_PAGE_SIZE, after=request.cursor)
+        return messenger_pb2.GetMessagesSinceResponse(
+            messages=[message.to_proto() for message in page],
+            next_cursor=page[-1].seq if page else request.cursor,
+            has_more=has_more,
+        )
+
+    async def GetUserChats(self, request, context):
+        chats = []
+        for chat_id in self.user_chats.get(request.nickname, ()):
+            chat = self.chats[chat_id]
+            chats.append(messenger_pb2.ChatStats(
+                chat_id=chat_id,
+                new_messages=chat.unread[request.nickname],
+                name=chat.name,
+                created_by=chat.created_by,
+                created_at=chat.created_at,
+            ))
+        return messenger_pb2.GetUserChatsResponse(chats=chats)
+
+    async def CreateChat(self, request, context):
+        if request.name in self.chats:
+            await context.abort(grpc.StatusCode.ALREADY_EXISTS, "chat already exists")
+        chat = self.chats[request.name] = Chat(request.name, request.nickname)
+        self.add_member(chat, request.nickname)
+        return messenger_pb2.CreateChatResponse(chat_id=chat.chat_id)
+
+    async def LeaveChat(self, request, context):
+        self.remove_member(request.chat_id, request.nickname)
+        return messenger_pb2.LeaveChatResponse(success=True)
+
+    async def JoinChat(self, request, context):
+        chat = await self.require_chat(request.chat_id, context)
+        self.add_member(chat, request.nickname)
+        return messenger_pb2.JoinChatResponse(success=True)
+
+    async def SetMessagesRead(self, request, context):
+        self.set_read(request.chat_id, request.nickname)
+        return messenger_pb2.SetMessagesReadResponse(success=True)
+
+    def broadcast(self, chat_id, frame, origin):
+        """Кадр всем сессиям участников чата, кроме origin: другие устройства отправителя его тоже получают"""
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            return
+        with self.tracer.start_child("Broadcast", attributes={"chat_id": chat_id}) as span:
+            # Получатели продолжают трассу от спана рассылки
+            if span.context is not None:
+                frame.trace_id, frame.span_id = span.context
+            for nickname in chat.unread:
+                for queue in self.streams.get(nickname, ()):
+                    if queue is not origin:
+                        queue.put_nowait(frame)
+
+    async def ChatStream(self, request_iterator, context):
+        outbound = asyncio.Queue()
+        registered = set()
+
+        async def read_frames():
+            try:
+                async for request in request_iterator:
+                    with self.frame_span(request):
+                        self.handle_frame(request, outbound, registered)
+            finally:
+                outbound.put_nowait(None)
+
+        reader = asyncio.create_task(read_frames())
+        try:
+            while True:
+                frame = await outbound.get()
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            reader.cancel()
+            for nickname in registered:
+                sessions = self.streams.get(nickname, set())
+                sessions.discard(outbound)
+                if not sessions:
+                    self.streams.pop(nickname, None)
+
+    def frame_span(self, request):
+        """Спан обработки кадра, только если отправитель прислал контекст трассы"""
+        parent = SpanContext(request.trace_id, request.span_id)
+        if not parent.valid:
+            return NOOP_SPAN
+        return self.tracer.start_span("ChatStream.recv", parent=parent, kind=SPAN_KIND_SERVER, attributes={
+            "type": messenger_pb2.ChatMessageType.Name(request.type),
+            "chat_id": request.chat_id,
+            "nickname": request.nickname,
+            "batch": len(request.batch),
+        })
+
+    def handle_frame(self, request, outbound, registered):
+        # Пользователь регистрируется в сессии один раз, по первому кадру
+        if request.nickname not in registered:
+            self.streams.setdefault(request.nickname, set()).add(outbound)
+            registered.add(request.nickname)
+
+        if request.type == messenger_pb2.USER_CONNECTED:
+            # Переподключившийся клиент получает только пропущенное после своих seq
+            for chat_id, cursor in request.resume.items():
+                self.replay(outbound, chat_id, cursor)
+        elif request.type in (messenger_pb2.MESSAGE, messenger_pb2.SET_TTL_TO_CHAT):
+            chat = self.chats.get(request.chat_id)
+            if chat is None:
+                outbound.put_nowait(self.send_failed_frame(request, [request], "chat not found"))
+                return
+            message = chat.add_message(request.nickname, request.content)
+            if request.HasField("ttl"):
+                self.set_ttl(request.chat_id, request.ttl)
+                # Отправитель узнаёт, что политика вступила в силу
+                outbound.put_nowait(messenger_pb2.ChatMessage(
+                    id=message.id,
+                    content=message.content,
+                    nickname=message.nickname,
+                    chat_id=message.chat_id,
+                    created_at=message.created_at,
+                    type=messenger_pb2.SET_TTL_TO_CHAT,
+                    ttl=request.ttl,
+                    seq=message.seq,
+                ))
+            frame = message.to_frame(request.type)
+            if request.HasField("ttl"):
+                frame.ttl = request.ttl
+            self.broadcast(request.chat_id, frame, outbound)
+        elif request.type == messenger_pb2.MESSAGE_BATCH:
+            chat = self.chats.get(request.chat_id)
+            if not request.batch:
+                return
+            if chat is None or len(request.batch) > MAX_BATCH_SIZE:
+                reason = "chat not found" if chat is None else "too many messages in batch"
+                outbound.put_nowait(self.send_failed_frame(request, request.batch, reason))
+                return
+            messages = chat.add_messages(request.nickname, [item.content for item in request.batch])
+            self.broadcast(request.chat_id, self.batch_frame(request.nickname, request.chat_id, messages), outbound)
+        elif request.type == messenger_pb2.USER_JOINED:
+            self.set_read(request.chat_id, request.nickname)
+            self.broadcast(request.chat_id, self.event_frame(request), outbound)
+        elif request.type == messenger_pb2.USER_GOT_IN:
+            self.set_read(request.chat_id, request.nickname)
+            # Историю клиент загружает сам, повторяется только то, что после его seq
+            if request.seq > 0:
+                self.replay(outbound, request.chat_id, request.seq)
+        elif request.type == messenger_pb2.USER_LEFT:
+            # Членство меняет LeaveChat, сессия остаётся подключённой к остальным чатам
+            self.broadcast(request.chat_id, self.event_frame(request), outbound)
+
+    def replay(self, outbound, chat_id, cursor):
+        """Сообщения чата после cursor, по кадру MESSAGE_BATCH на страницу"""
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            return
+        while True:
+            page, has_more = chat.page(SINCE_PAGE_SIZE, after=cursor)
+            if page:
+                outbound.put_nowait(self.replay_frame(chat_id, page))
+                cursor = page[-1].seq
+            if not has_more:
+                return
+
+    @staticmethod
+    def send_failed_frame(request, items, reason):
+        """Отправителю: сообщения его кадра не сохранены, в batch - отклонённые"""
+        return messenger_pb2.ChatMessage(
+            content=reason,
+            nickname=request.nickname,
+            chat_id=request.chat_id,
+            type=messenger_pb2.SEND_FAILED,
+            batch=[messenger_pb2.ChatMessage(
+                content=item.content,
+                nickname=request.nickname,
+                chat_id=request.chat_id,
+                type=messenger_pb2.MESSAGE,
+            ) for item in items],
+        )
+
+    @staticmethod
+    def batch_frame(nickname, chat_id, messages):
+        return messenger_pb2.ChatMessage(
+            nickname=nickname,
+            chat_id=chat_id,
+            created_at=messages[0].created_at,
+            type=messenger_pb2.MESSAGE_BATCH,
+            seq=messages[-1].seq,
+            batch=[message.to_frame() for message in messages],
+        )
+
+    @staticmethod
+    def replay_frame(chat_id, messages):
+        return messenger_pb2.ChatMessage(
+            chat_id=chat_id,
+            type=messenger_pb2.MESSAGE_BATCH,
+            seq=messages[-1].seq,
+            batch=[message.to_frame() for message in messages],
+        )
+
+    @staticmethod
+    def event_frame(request):
+        return messenger_pb2.ChatMessage(
+            content=request.content,
+            nickname=request.nickname,
+            chat_id=request.chat_id,
+            created_at=datetime.now(timezone.utc).astimezone().isoformat(timespec="seconds"),
+            type=request.type,
+        )
+
+
+class ReferenceServer:
+    """Эталонный сервер, запускаемый внутри процесса на свободном порту"""
+
+    def __init__(self, host="127.0.0.1", port=0, trace_file=None, compression="none"):
+        self.host = host
+        self.port = port
+        self.servicer = ReferenceMessenger(Tracer(trace_file, service_name="grpc-chat-reference-server"))
+        # Сжатие на весь сервер, а не по методам, как у Go-сервера: grpc.aio
+        # не применяет context.set_compression к ответам унарных вызовов
+        self.compression = None if compression == "none" else COMPRESSIONS[compression]
+        self.server = None
+        self.address = None
+
+    async def start(self):
+        self.server = grpc.aio.server(compression=self.compression)
+        messenger_pb2_grpc.add_MessengerServicer_to_server(self.servicer, self.server)
+        port = self.server.add_insecure_port(f"{self.host}:{self.port}")
+        await self.server.start()
+        self.address = f"{self.host}:{port}"
+        return self.address
+
+    async def stop(self, grace=None):
+        if self.server is not None:
+            await self.server.stop(grace)
+            self.server = None
+        self.servicer.tracer.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+
+async def serve(host, port, trace_file=None, compression="none"):
+    server = ReferenceServer(host, port, trace_file, compression)
+    address = await server.start()
+    print(f"✅ Эталонный сервер слушает {address}")
+    try:
+        await server.server.wait_for_termination()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Эталонный сервер Messenger в памяти процесса')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес для прослушивания (по умолчанию: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Порт, 0 - любой свободный (по умолчанию: 8080)')
+    parser.add_argument('--trace-file', default=None, help='Файл для спанов ChatStream в формате OTLP-JSON')
+    parser.add_argument('--compression', choices=sorted(COMPRESSIONS), default='none', help='Сжатие всех ответов сервера (по умолчанию: none)')
+
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.trace_file, args.compression))
+    except KeyboardInterrupt:
+        print("\n👋 Сервер остановлен")
@@ -1,23 +1,44 @@
 #!/usr/bin/env python3
 
+import queue
 import sys
 import threading
 import time
-import os
+from collections import deque
 from datetime import datetime
+from message_cache import DEFAULT_CACHE_DIR, MessageCache
+from message_store import DEFAULT_HISTORY_LIMIT, MessageStore, StoredMessage
+from metrics import DEFAULT_METRICS_FILE, ClientMetrics
+from terminal_renderer import TerminalRenderer
+from transport import TransportOptions, add_transport_arguments
 from generated import messenger_pb2
 from generated import messenger_pb2_grpc
 import grpc
 
 
+HISTORY_PAGE_SIZE = 50
+VISIBLE_MESSAGES = 15
+# Сообщения, набранные за это окно, уходят одним вызовом SendMessages
+SEND_COALESCE_WINDOW = 0.02
+SEND_BATCH_SIZE = 100
+
+
 class SimpleConsoleChat:
-    def __init__(self, server_address='localhost:8080'):
+    def __init__(self, server_address='localhost:8080', cache_dir=DEFAULT_CACHE_DIR, history_limit=DEFAULT_HISTORY_LIMIT, metrics_file=None, transport=None):
         self.server_address = server_address
+        self.transport = transport or TransportOptions()  # Сжатие, keepalive и размеры сообщений канала
+        self.cache_dir = cache_dir
+        self.cache = None  # Локальный кэш сообщений, открывается после ввода никнейма
         self.channel = None
         self.stub = None
         self.nickname = None
-        self.messages = []  # Общие сообщения
-        self.room_messages = {}  # Сообщения по комнатам {chat_id: [messages]}
+        self.messages = deque(maxlen=100)  # Общие сообщения
+        self.room_messages = MessageStore(history_limit)  # Сообщения по комнатам, не больше history_limit на чат
+        self.chat_cursors = {}  # Курсор последнего полученного сообщения {chat_id: seq}
+        self.history_has_more = {}  # Есть ли на сервере более ранние сообщения {chat_id: bool}
+        self.scroll_offset = 0  # Сколько последних сообщений пропущено при прокрутке назад
+        self.outbox = queue.Queue()  # Неотправленные сообщения (chat_id, StoredMessage)
+        self.send_lock = threading.Lock()  # Опрос не видит свои сообщения, пока им не присвоены ID
         self.running = False
         self.last_message_time = time.time()
         self.current_chat_id = None  # Текущий чат ID
@@ -27,12 +48,22 @@ class SimpleConsoleChat:
         self.last_notification_check = time.time()  # Время последней проверки уведомлений
         self.user_colors = {}  # Цвета пользователей {nickname: color_code}
         self.available_colors = [31, 32, 33, 34, 35, 36, 91, 92, 93, 94, 95, 96]  # Доступные цвета ANSI
+        self.metrics = ClientMetrics()  # Задержки RPC, очередь отправки, отрисовка, задержка доставки
+        self.metrics.outbound_depth.set_function(self.outbox.qsize)
+        self.metrics_file = metrics_file or DEFAULT_METRICS_FILE
+        self.metrics_file_on_exit = metrics_file is not None  # При выходе пишем только явно заданный файл
+        self.renderer = TerminalRenderer(
+            ("header", "notifications", "messages", "chats", "prompt"),
+            self.compose_screen,
+            on_frame=self.metrics.observe_render,
+        )  # Экран перерисовывается построчно, фоновые обновления не чаще DEFAULT_MAX_FPS
         
     def connect(self):
         """Подключение к серверу"""
         try:
-            self.channel = grpc.insecure_channel(self.server_address)
-            self.stub = messenger_pb2_grpc.MessengerStub(self.channel)
+            self.channel = grpc.insecure_channel(self.server_address, options=self.transport.channel_options())
+            # Все унарные вызовы проходят через перехватчик с замером задержки
+            self.stub = messenger_pb2_grpc.MessengerStub(grpc.intercept_channel(self.channel, self.metrics.interceptor()))
             print(f"✅ Подключен к серверу {self.server_address}")
             return True
         except Exception as e:
@@ -54,21 +85,55 @@ class SimpleConsoleChat:
             self.add_notification("❌ Не выбран чат. Используйте /join <chat_id>")
             return None
             
-        try:
-            request = messenger_pb2.SendMessageRequest(
-                message=message,
-                chat_id=chat_id,
-                nickname=self.nickname
-            )
+        # Показываем сообщение сразу, а отправляет его поток отправки вместе с соседними
+        stored = self.add_room_message(message, "sent", chat_id, self.nickname)
+        self.scroll_offset = 0
+        self.outbox.put((chat_id, stored))
+        return stored
+    
+    def message_sender_thread(self):
+        """Поток отправки: копит сообщения SEND_COALESCE_WINDOW и отправляет их пачками"""
+        while self.running or not self.outbox.empty():
+            try:
+                batch = [self.outbox.get(timeout=0.5)]
+            except queue.Empty:
+                continue
             
-            response = self.stub.SendMessage(request)
-            # Добавляем сообщение в историю текущего чата
-            chat_name = self.chat_names.get(chat_id, chat_id)
-            self.add_room_message(f"📤 [{self.nickname}]: {message}", "sent", chat_id, self.nickname)
-            return response.message_id
-        except grpc.RpcError as e:
-            self.add_notification(f"❌ Ошибка отправки: {e}")
-            return None
+            deadline = time.monotonic() + SEND_COALESCE_WINDOW
+            while len(batch) < SEND_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.outbox.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            self.flush_messages(batch)
+    
+    def flush_messages(self, batch):
+        """Отправка пачки сообщений, по одному SendMessages на чат"""
+        by_chat = {}
+        for chat_id, message in batch:
+            by_chat.setdefault(chat_id, []).append(message)
+        
+        for chat_id, messages in by_chat.items():
+            with self.send_lock:
+                try:
+                    request = messenger_pb2.SendMessagesRequest(
+                        messages=[message.content for message in messages],
+                        chat_id=chat_id,
+                        nickname=self.nickname
+                    )
+                    response = self.stub.SendMessages(request, compression=self.transport.call_compression("SendMessages"))
+                except grpc.RpcError as e:
+                    self.add_notification(f"❌ Ошибка отправки: {e}")
+                    continue
+                
+                # По ID свои сообщения не задублируются при опросе
+                history = self.room_messages.chat(chat_id)
+                for message, message_id, seq in zip(messages, response.message_ids, response.seqs):
+                    history.confirm(message, message_id, seq)
     
     def get_user_chats(self):
         """Получение списка чатов пользователя с статистикой"""
@@ -83,6 +148,7 @@ class SimpleConsoleChat:
             for chat_stats in response.chats:
                 old_stats = self.user_chats.get(chat_stats.chat_id)
                 self.user_chats[chat_stats.chat_id] = chat_stats
+                self.chat_names[chat_stats.chat_id] = chat_stats.name or chat_stats.chat_id
                 
                 if chat_stats.new_messages > 0:
                     total_new_messages += chat_stats.new_messages
@@ -124,9 +190,14 @@ class SimpleConsoleChat:
             return []
     
     def get_chat_messages(self, chat_id):
-        """Получение сообщений конкретного чата"""
+        """Получение последней страницы сообщений конкретного чата"""
+        # Если чат уже есть в локальном кэше - сразу показываем его и догружаем только разницу
+        synced_seq = self.cache.synced_seq(chat_id) if self.cache else None
+        if synced_seq is not None:
+            return self.load_cached_messages(chat_id, synced_seq)
+        
         try:
-            request = messenger_pb2.GetMessagesRequest(chat_id=chat_id)
+            request = messenger_pb2.GetMessagesRequest(chat_id=chat_id, limit=HISTORY_PAGE_SIZE)
             response = self.stub.GetMessages(request)
             
             # Предварительно инициализируем цвета для всех пользователей в чате
@@ -134,15 +205,120 @@ class SimpleConsoleChat:
                 self.get_user_color(msg.nickname)
             
             # Очищаем старые сообщения чата и загружаем новые
-            self.room_messages[chat_id] = []
+            self.room_messages.reset(chat_id)
             for msg in response.messages:
-                self.add_room_message(f"📥 [{msg.nickname}]: {msg.content}", "received", chat_id, msg.nickname)
+                self.add_room_message(msg.content, "received", chat_id, msg.nickname, msg.id, msg.seq)
+            
+            # Дальше опрос запрашивает только сообщения новее курсора
+            self.chat_cursors[chat_id] = max((msg.seq for msg in response.messages), default=0)
+            self.history_has_more[chat_id] = response.has_more
+            
+            if self.cache:
+                self.cache.store(response.messages, synced_seq=self.chat_cursors[chat_id], chat_id=chat_id)
             
             return response.messages
         except grpc.RpcError as e:
             self.add_notification(f"❌ Ошибка получения сообщений чата: {e}")
             return []
     
+    def load_cached_messages(self, chat_id, synced_seq):
+        """Показ истории чата из локального кэша и догрузка пропущенных сообщений"""
+        cached = self.cache.latest(chat_id, HISTORY_PAGE_SIZE, synced_seq)
+        
+        self.room_messages.reset(chat_id)
+        for msg in cached:
+            self.get_user_color(msg.nickname)
+            self.add_room_message(msg.content, "received", chat_id, msg.nickname, msg.id, msg.seq)
+        
+        self.chat_cursors[chat_id] = synced_seq
+        self.history_has_more[chat_id] = bool(cached) and cached[0].seq > 1
+        
+        if chat_id == self.current_chat_id:
+            self.display_messages()
+        
+        return cached + self.sync_chat_messages(chat_id)
+    
+    def load_older_messages(self, chat_id):
+        """Загрузка предыдущей страницы истории чата (сначала из кэша, затем с сервера)"""
+        history = self.room_messages.chat(chat_id)
+        before = history.oldest_seq()
+        # Если буфер чата заполнен, более ранние сообщения в него уже не поместятся
+        if not self.history_has_more.get(chat_id) or not before or history.is_full():
+            return []
+        
+        messages = self.cache.older(chat_id, before, HISTORY_PAGE_SIZE) if self.cache else []
+        has_more = bool(messages) and messages[0].seq > 1
+        
+        if not messages:
+            try:
+                request = messenger_pb2.GetMessagesRequest(
+                    chat_id=chat_id,
+                    limit=HISTORY_PAGE_SIZE,
+                    before=before
+                )
+                response = self.stub.GetMessages(request)
+            except grpc.RpcError as e:
+                self.add_notification(f"❌ Ошибка получения сообщений чата: {e}")
+                return []
+            
+            messages = list(response.messages)
+            has_more = response.has_more
+            if self.cache:
+                self.cache.store(messages)
+        
+        for msg in messages:
+            self.get_user_color(msg.nickname)
+        
+        history.prepend([StoredMessage(msg.content, msg.nickname, "received", msg.id, msg.seq) for msg in messages])
+        self.history_has_more[chat_id] = has_more
+        return messages
+    
+    def scroll_back(self):
+        """Прокрутка истории текущего чата на экран назад с догрузкой с сервера"""
+        chat_id = self.current_chat_id
+        loaded = self.room_messages.count(chat_id)
+        
+        if self.scroll_offset + 2 * VISIBLE_MESSAGES > loaded:
+            self.load_older_messages(chat_id)
+            loaded = self.room_messages.count(chat_id)
+        
+        self.scroll_offset = max(0, min(self.scroll_offset + VISIBLE_MESSAGES, loaded - VISIBLE_MESSAGES))
+    
+    def sync_chat_messages(self, chat_id):
+        """Догрузка только новых сообщений чата (после курсора)"""
+        if chat_id not in self.chat_cursors:
+            return self.get_chat_messages(chat_id)
+        
+        new_messages = []
+        try:
+            # Пока идёт отправка, её сообщения уже на сервере, но ещё без ID в истории
+            with self.send_lock:
+                while True:
+                    request = messenger_pb2.GetMessagesSinceRequest(
+                        chat_id=chat_id,
+                        cursor=self.chat_cursors[chat_id]
+                    )
+                    response = self.stub.GetMessagesSince(request)
+                    
+                    if self.cache:
+                        self.cache.store(response.messages, synced_seq=response.next_cursor, chat_id=chat_id)
+                    
+                    for msg in response.messages:
+                        # Свои сообщения уже добавлены в историю при отправке и отсеиваются по ID
+                        self.get_user_color(msg.nickname)
+                        if self.add_room_message(msg.content, "received", chat_id, msg.nickname, msg.id, msg.seq):
+                            self.metrics.observe_delivery(msg.created_at)
+                            new_messages.append(msg)
+                    
+                    self.chat_cursors[chat_id] = response.next_cursor
+                    if not response.has_more:
+                        break
+            
+            return new_messages
+        except grpc.RpcError as e:
+            self.add_notification(f"❌ Ошибка получения сообщений чата: {e}")
+            return new_messages
+    
     def set_messages_read(self, chat_id):
         """Отметить сообщения чата как прочитанные"""
         try:
@@ -219,8 +395,10 @@ class SimpleConsoleChat:
                 # Удаляем из локального кэша
                 if chat_id in self.user_chats:
                     del self.user_chats[chat_id]
-                if chat_id in self.room_messages:
-                    del self.room_messages[chat_id]
+                self.room_messages.drop(chat_id)
+                self.chat_cursors.pop(chat_id, None)
+                if self.cache:
+                    self.cache.drop_chat(chat_id)
                 if chat_id in self.chat_names:
                     del self.chat_names[chat_id]
                 return True
@@ -235,42 +413,63 @@ class SimpleConsoleChat:
         """Добавление сообщения в общую историю"""
         timestamp = datetime.now().strftime("%H:%M:%S")
         formatted_message = f"[{timestamp}] {message}"
+        # deque сам вытесняет самые старые сообщения
         self.messages.append((formatted_message, msg_type))
-        
-        # Ограничиваем количество сообщений
-        if len(self.messages) > 100:
-            self.messages = self.messages[-50:]
     
-    def add_room_message(self, message, msg_type="info", chat_id=None, nickname=None):
-        """Добавление сообщения в конкретный чат"""
+    def add_room_message(self, content, msg_type="info", chat_id=None, nickname=None, message_id="", seq=0):
+        """Добавление сообщения в конкретный чат; None, если сообщение с таким ID уже есть"""
         if chat_id is None:
             chat_id = self.current_chat_id
             
-        if chat_id not in self.room_messages:
-            self.room_messages[chat_id] = []
-            
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        formatted_message = f"[{timestamp}] {message}"
-        # Сохраняем сообщение с информацией о пользователе и типе
-        self.room_messages[chat_id].append((formatted_message, msg_type, nickname))
-        
-        # Ограничиваем количество сообщений в чате
-        if len(self.room_messages[chat_id]) > 100:
-            self.room_messages[chat_id] = self.room_messages[chat_id][-50:]
+        # Сохраняем сообщение с информацией о пользователе и типе,
+        # буфер чата ограничен и сам вытесняет самые старые сообщения
+        message = StoredMessage(content, nickname, msg_type, message_id, seq)
+        if not self.room_messages.append(chat_id, message):
+            return None
             
         # Если это текущий чат, также добавляем в общие сообщения
         if chat_id == self.current_chat_id:
-            self.add_message(message, msg_type)
+            self.add_message(self.room_message_text(message), msg_type)
+        return message
+    
+    def room_message_text(self, message):
+        """Текст сообщения чата без времени"""
+        if message.kind == "sent":
+            return f"📤 [{message.nickname}]: {message.content}"
+        if message.kind == "received":
+            return f"📥 [{message.nickname}]: {message.content}"
+        return message.content
+    
+    def room_message_line(self, message):
+        """Строка сообщения чата с цветом автора"""
+        text = f"[{message.timestamp}] {self.room_message_text(message)}"
+        if message.kind == "received" and message.nickname:
+            # Цвет пользователя для полученных сообщений
+            user_color = self.get_user_color(message.nickname)
+            return f"\033[{user_color}m{text}\033[0m"
+        if message.kind == "sent" and message.nickname:
+            # Цвет пользователя для отправленных сообщений (немного тусклее)
+            user_color = self.get_user_color(message.nickname)
+            return f"\033[{user_color};2m{text}\033[0m"  # Тусклый цвет
+        if message.kind == "error":
+            return f"\033[91m{text}\033[0m"  # Красный для ошибок
+        return text  # Обычный цвет для информационных
+    
+    def print_room_message(self, message):
+        """Вывод сообщения чата с цветом автора"""
+        print(self.room_message_line(message))
     
     def switch_chat(self, chat_id):
         """Переключение на другой чат"""
-        # Отмечаем сообщения как прочитанные при переходе в чат
-        self.set_messages_read(chat_id)
+        self.current_chat_id = chat_id
+        self.scroll_offset = 0
         
-        # Загружаем сообщения чата с сервера
+        # Загружаем сообщения чата: из кэша сразу, с сервера - только недостающие
         self.get_chat_messages(chat_id)
         
-        self.current_chat_id = chat_id
+        # Отмечаем сообщения как прочитанные при переходе в чат
+        self.set_messages_read(chat_id)
+        
         chat_name = self.chat_names.get(chat_id, chat_id)
         self.add_notification(f"✅ Переключились в чат: {chat_name} ({chat_id})")
         
@@ -278,8 +477,8 @@ class SimpleConsoleChat:
         self.clear_chat_notifications(chat_id)
         
         # Показываем историю сообщений этого чата
-        if chat_id in self.room_messages and self.room_messages[chat_id]:
-            self.add_notification(f"📜 История чата '{chat_name}': {len(self.room_messages[chat_id])} сообщений")
+        if self.room_messages.count(chat_id):
+            self.add_notification(f"📜 История чата '{chat_name}': {self.room_messages.count(chat_id)} сообщений")
         
         return True
     
@@ -288,15 +487,14 @@ class SimpleConsoleChat:
         if chat_id is None:
             chat_id = self.current_chat_id
             
-        if chat_id not in self.room_messages:
-            return []
-        return self.room_messages[chat_id]
+        return self.room_messages.get(chat_id)
     
     def add_notification(self, notification):
         """Добавление уведомления (для немедленного отображения)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
         formatted_notification = f"🔔 [{timestamp}] {notification}"
         print(f"\n{formatted_notification}")
+        self.renderer.invalidate()
     
     def add_notification_to_list(self, notification):
         """Добавление уведомления в список для отображения в отдельной области"""
@@ -342,89 +540,87 @@ class SimpleConsoleChat:
             ]
     
     def clear_screen(self):
-        """Очистка экрана"""
-        os.system('clear' if os.name == 'posix' else 'cls')
+        """Очистка экрана: следующий кадр рисуется целиком"""
+        self.renderer.invalidate()
     
-    def display_messages(self):
-        """Отображение сообщений"""
-        self.clear_screen()
-        
+    def compose_screen(self):
+        """Содержимое областей экрана для рендерера"""
         # Заголовок
-        print("=" * 80)
+        header = ["=" * 80]
         if self.current_chat_id:
             chat_name = self.chat_names.get(self.current_chat_id, self.current_chat_id)
-            print(f"📨 КОНСОЛЬНЫЙ ЧАТ - Чат: \033[93m{chat_name}\033[0m ({self.current_chat_id})")
+            header.append(f"📨 КОНСОЛЬНЫЙ ЧАТ - Чат: \033[93m{chat_name}\033[0m ({self.current_chat_id})")
         else:
-            print("🏠 КОНСОЛЬНЫЙ ЧАТ - Главное меню")
-        print("=" * 80)
+            header.append("🏠 КОНСОЛЬНЫЙ ЧАТ - Главное меню")
+        header.append("=" * 80)
         
         # Область уведомлений
+        notifications = []
         if self.notifications:
-            print("\n🔔 УВЕДОМЛЕНИЯ:")
+            notifications.append("\n🔔 УВЕДОМЛЕНИЯ:")
             for notification in self.notifications[-5:]:  # Показываем последние 5 уведомлений
-                print(f"\033[96m{notification}\033[0m")  # Голубой цвет для уведомлений
-            print("-" * 80)
+                notifications.append(f"\033[96m{notification}\033[0m")  # Голубой цвет для уведомлений
+            notifications.append("-" * 80)
         
-        # Показываем сообщения текущего чата или главное меню
+        # Сообщения текущего чата или главное меню
+        messages = []
         if self.current_chat_id:
             chat_messages = self.get_chat_history(self.current_chat_id)
             
             if not chat_messages:
-                print("\n📭 В этом чате пока нет сообщений...")
+                messages.append("\n📭 В этом чате пока нет сообщений...")
             else:
-                # Показываем последние 15 сообщений текущего чата (меньше из-за области уведомлений)
-                recent_messages = chat_messages[-15:]
-                for message_data in recent_messages:
-                    if len(message_data) >= 3:
-                        message, msg_type, nickname = message_data
-                    else:
-                        message, msg_type = message_data
-                        nickname = None
-                    
-                    if msg_type == "received" and nickname:
-                        # Цвет пользователя для полученных сообщений
-                        user_color = self.get_user_color(nickname)
-                        print(f"\033[{user_color}m{message}\033[0m")
-                    elif msg_type == "sent" and nickname:
-                        # Цвет пользователя для отправленных сообщений (немного тусклее)
-                        user_color = self.get_user_color(nickname)
-                        print(f"\033[{user_color};2m{message}\033[0m")  # Тусклый цвет
-                    elif msg_type == "error":
-                        print(f"\033[91m{message}\033[0m")  # Красный для ошибок
-                    else:
-                        print(message)  # Обычный цвет для информационных
+                # Показываем 15 сообщений текущего чата (меньше из-за области уведомлений)
+                if self.scroll_offset:
+                    messages.append(f"⬆️ История прокручена назад на {self.scroll_offset} сообщений (/latest - к последним)")
+                for message in chat_messages.window(self.scroll_offset, VISIBLE_MESSAGES):
+                    messages.append(self.room_message_line(message))
         else:
-            # Главное меню
-            print("\n🏠 ДОБРО ПОЖАЛОВАТЬ В ГЛАВНОЕ МЕНЮ!")
-            print("\n📋 Доступные действия:")
-            print("• /create <название> - создать новый чат")
-            print("• /join <chat_id>    - перейти в существующий чат")
-            print("• /chats             - показать все ваши чаты")
-            print("• /help              - показать справку")
-            print("• /status            - показать статус подключения")
-            print("\n💡 Используйте команды выше для навигации")
-        
-        print("\n" + "=" * 80)
-        
-        # Показываем информацию о чатах
+            messages.extend([
+                "\n🏠 ДОБРО ПОЖАЛОВАТЬ В ГЛАВНОЕ МЕНЮ!",
+                "\n📋 Доступные действия:",
+                "• /create <название> - создать новый чат",
+                "• /join <chat_id>    - перейти в существующий чат",
+                "• /chats             - показать все ваши чаты",
+                "• /help              - показать справку",
+                "• /status            - показать статус подключения",
+                "\n💡 Используйте команды выше для навигации",
+            ])
+        
+        # Информация о чатах
+        chats = ["\n" + "=" * 80]
         if self.user_chats:
-            if self.current_chat_id:
-                print(f"🏠 Ваши чаты:")
-            else:
-                print(f"📋 ВАШИ ЧАТЫ:")
-            for chat_id, chat_stats in self.user_chats.items():
+            chats.append("🏠 Ваши чаты:" if self.current_chat_id else "📋 ВАШИ ЧАТЫ:")
+            for chat_id, chat_stats in list(self.user_chats.items()):
                 chat_name = self.chat_names.get(chat_id, chat_id)
                 new_msgs = chat_stats.new_messages
                 current = " ← текущий" if chat_id == self.current_chat_id else ""
                 new_indicator = f" ({new_msgs} новых)" if new_msgs > 0 else ""
-                print(f"   • {chat_name} ({chat_id}){new_indicator}{current}")
+                chats.append(f"   • {chat_name} ({chat_id}){new_indicator}{current}")
+        elif self.current_chat_id:
+            chats.append("🏠 У вас пока нет чатов. Используйте /create для создания чата")
         else:
-            if self.current_chat_id:
-                print("🏠 У вас пока нет чатов. Используйте /create для создания чата")
-            else:
-                print("📋 У вас пока нет чатов. Используйте /create для создания чата")
+            chats.append("📋 У вас пока нет чатов. Используйте /create для создания чата")
+        chats.append("=" * 80)
         
-        print("=" * 80)
+        return {
+            "header": header,
+            "notifications": notifications,
+            "messages": messages,
+            "chats": chats,
+            "prompt": ["", self.prompt_text()],
+        }
+    
+    def prompt_text(self):
+        """Приглашение для ввода с указанием чата"""
+        if self.current_chat_id:
+            chat_name = self.chat_names.get(self.current_chat_id, self.current_chat_id)
+            return f"{self.nickname}@{chat_name}: "
+        return f"{self.nickname}: "
+    
+    def display_messages(self):
+        """Отображение сообщений"""
+        self.renderer.render()
     
     def show_help(self):
         """Показать справку"""
@@ -437,6 +633,8 @@ class SimpleConsoleChat:
         print("/leave <chat_id>    - покинуть чат")
         print("/chats              - показать все ваши чаты")
         print("/history [chat_id]  - показать историю чата")
+        print("/more               - загрузить более ранние сообщения")
+        print("/latest             - вернуться к последним сообщениям")
         print("/current            - показать текущий чат")
         print("/colors             - показать цвета пользователей")
         print()
@@ -448,6 +646,8 @@ class SimpleConsoleChat:
         print("/clear              - очистить экран")
         print("/notifications      - очистить все уведомления")
         print("/status             - показать статус подключения")
+        print("/stats              - показать метрики клиента")
+        print("/stats save [файл]  - сохранить метрики в формате Prometheus")
         print("="*80)
         print("💬 Для отправки сообщения просто введите текст")
         print("   (сообщение отправится в текущий чат)")
@@ -470,13 +670,28 @@ class SimpleConsoleChat:
         print(f"📊 Сообщений по чатам:")
         for chat_id, chat_stats in self.user_chats.items():
             chat_name = self.chat_names.get(chat_id, chat_id)
-            count = len(self.room_messages.get(chat_id, []))
+            count = self.room_messages.count(chat_id)
             new_msgs = chat_stats.new_messages
             new_indicator = f" ({new_msgs} новых)" if new_msgs > 0 else ""
             print(f"   • {chat_name} ({chat_id}): {count} сообщений{new_indicator}")
         print(f"🔄 Статус: {'подключен' if self.channel else 'отключен'}")
         print("="*80)
     
+    def show_stats(self):
+        """Показать метрики клиента"""
+        print("\n" + "="*80)
+        for line in self.metrics.report_lines():
+            print(line)
+        print("="*80)
+    
+    def save_stats(self, path):
+        """Сохранить метрики в файл в формате Prometheus"""
+        try:
+            self.metrics.write(path)
+            print(f"\n✅ Метрики сохранены в {path}")
+        except OSError as e:
+            print(f"\n❌ Не удалось сохранить метрики: {e}")
+    
     def process_command(self, command):
         """Обработка команд"""
         command = command.strip()
@@ -543,7 +758,7 @@ class SimpleConsoleChat:
             else:
                 for chat_id, chat_stats in self.user_chats.items():
                     chat_name = self.chat_names.get(chat_id, chat_id)
-                    count = len(self.room_messages.get(chat_id, []))
+                    count = self.room_messages.count(chat_id)
                     new_msgs = chat_stats.new_messages
                     current = " ← текущий" if chat_id == self.current_chat_id else ""
                     new_indicator = f" ({new_msgs} новых)" if new_msgs > 0 else ""
@@ -569,23 +784,8 @@ class SimpleConsoleChat:
             if not history:
                 print("📭 Сообщений нет")
             else:
-                for message_data in history:
-                    if len(message_data) >= 3:
-                        message, msg_type, nickname = message_data
-                    else:
-                        message, msg_type = message_data
-                        nickname = None
-                    
-                    if msg_type == "received" and nickname:
-                        user_color = self.get_user_color(nickname)
-                        print(f"\033[{user_color}m{message}\033[0m")
-                    elif msg_type == "sent" and nickname:
-                        user_color = self.get_user_color(nickname)
-                        print(f"\033[{user_color};2m{message}\033[0m")  # Тусклый цвет
-                    elif msg_type == "error":
-                        print(f"\033[91m{message}\033[0m")
-                    else:
-                        print(message)
+                for message in history:
+                    self.print_room_message(message)
             print("="*70)
             return
             
@@ -593,12 +793,25 @@ class SimpleConsoleChat:
             if self.current_chat_id:
                 chat_name = self.chat_names.get(self.current_chat_id, self.current_chat_id)
                 print(f"\n📍 Текущий чат: \033[93m{chat_name}\033[0m ({self.current_chat_id})")
-                count = len(self.room_messages.get(self.current_chat_id, []))
+                count = self.room_messages.count(self.current_chat_id)
                 print(f"📊 Сообщений в чате: {count}")
             else:
                 print("\n📍 Текущий чат: не выбран")
             return
             
+        elif command == "/more":
+            if not self.current_chat_id:
+                self.add_notification("❌ Не выбран чат")
+                return
+            self.scroll_back()
+            self.display_messages()
+            return
+        
+        elif command == "/latest":
+            self.scroll_offset = 0
+            self.display_messages()
+            return
+            
         elif command == "/colors":
             print("\n🎨 ЦВЕТА ПОЛЬЗОВАТЕЛЕЙ:")
             print("="*50)
@@ -618,21 +831,22 @@ class SimpleConsoleChat:
             return
         elif command == "/home":
             self.current_chat_id = None
+            self.scroll_offset = 0
             self.add_notification("🏠 Возвращаемся в главное меню")
             self.display_messages()
             return
         elif command == "/refresh":
             # Обновляем список чатов и их статистику
             self.get_user_chats()
-            # Если есть текущий чат, обновляем его сообщения
+            # Если есть текущий чат, догружаем его новые сообщения
             if self.current_chat_id:
-                self.get_chat_messages(self.current_chat_id)
+                self.sync_chat_messages(self.current_chat_id)
             self.display_messages()
             return
         elif command == "/clear":
             # Очищаем только текущий чат
             if self.current_chat_id and self.current_chat_id in self.room_messages:
-                self.room_messages[self.current_chat_id].clear()
+                self.room_messages.reset(self.current_chat_id)
             self.display_messages()
             return
         elif command == "/notifications":
@@ -642,6 +856,13 @@ class SimpleConsoleChat:
         elif command == "/status":
             self.show_status()
             return
+        elif command == "/stats" or command.startswith("/stats "):
+            parts = command.split()
+            if len(parts) > 1 and parts[1] == "save":
+                self.save_stats(parts[2] if len(parts) > 2 else self.metrics_file)
+            else:
+                self.show_stats()
+            return
         else:
             # Обычное сообщение - отправляем в текущий чат
             self.send_message(command, self.current_chat_id)
@@ -652,9 +873,11 @@ class SimpleConsoleChat:
             try:
                 # Обновляем статистику чатов
                 self.get_user_chats()
-                # Обновляем сообщения текущего чата
+                # Догружаем только новые сообщения текущего чата
                 if self.current_chat_id:
-                    self.get_chat_messages(self.current_chat_id)
+                    self.sync_chat_messages(self.current_chat_id)
+                # Новые сообщения и счётчики появляются на экране без ввода команды
+                self.renderer.request()
                 time.sleep(1)  # Проверяем новые сообщения каждые 3 секунды
             except Exception as e:
                 self.add_notification(f"❌ Ошибка в потоке опроса: {e}")
@@ -664,10 +887,18 @@ class SimpleConsoleChat:
         """Основной цикл приложения"""
         self.running = True
         
+        # Открываем локальный кэш сообщений пользователя
+        if self.cache_dir:
+            self.cache = MessageCache(self.nickname, self.server_address, self.cache_dir)
+        
         # Запускаем поток для получения сообщений
         polling_thread = threading.Thread(target=self.message_polling_thread, daemon=True)
         polling_thread.start()
         
+        # Поток отправки сообщений
+        sender_thread = threading.Thread(target=self.message_sender_thread, daemon=True)
+        sender_thread.start()
+        
         # Загружаем чаты пользователя при старте
         self.get_user_chats()
         
@@ -684,18 +915,19 @@ class SimpleConsoleChat:
         # Основной цикл
         while self.running:
             try:
-                # Показываем приглашение для ввода с указанием чата
-                if self.current_chat_id:
-                    chat_name = self.chat_names.get(self.current_chat_id, self.current_chat_id)
-                    user_input = input(f"\n{self.nickname}@{chat_name}: ")
+                # Приглашение уже на экране, если его не перекрыл вывод команды
+                if self.renderer.valid:
+                    user_input = input()
                 else:
-                    user_input = input(f"\n{self.nickname}: ")
+                    user_input = input(f"\n{self.prompt_text()}")
                 
+                # После ввода содержимое экрана рендереру неизвестно
+                self.clear_screen()
                 self.process_command(user_input)
                 
                 # Обновляем отображение только для определенных команд
-                # Команды /help, /status, /chats, /history, /current, /notifications, /home, /colors не обновляют экран автоматически
-                no_update_commands = ["/help", "/status", "/chats", "/history", "/current", "/notifications", "/home", "/colors"]
+                # Команды /help, /status, /stats, /chats, /history, /current, /notifications, /home, /colors, /more, /latest не обновляют экран автоматически
+                no_update_commands = ["/help", "/status", "/stats", "/chats", "/history", "/current", "/notifications", "/home", "/colors", "/more", "/latest"]
                 if self.running and not any(user_input.strip().startswith(cmd) for cmd in no_update_commands):
                     self.display_messages()
                 
@@ -708,17 +940,27 @@ class SimpleConsoleChat:
             except Exception as e:
                 self.add_notification(f"❌ Ошибка: {e}")
         
-        # Завершение
+        # Завершение: дожидаемся отправки набранных сообщений
+        sender_thread.join(timeout=5)
         self.disconnect()
+        if self.cache:
+            self.cache.close()
+        if self.metrics_file_on_exit:
+            self.save_stats(self.metrics_file)
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Использование: python simple_console_chat.py <server_address>")
-        print("Пример: python simple_console_chat.py localhost:8080")
-        sys.exit(1)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Простой консольный чат', epilog='Пример: python simple_console_chat.py localhost:8080')
+    parser.add_argument('server_address', help='Адрес сервера')
+    # Необязательный файл, куда при выходе записываются метрики в формате Prometheus
+    parser.add_argument('metrics_file', nargs='?', default=None, help='Файл для метрик в формате Prometheus, записывается при выходе')
+    add_transport_arguments(parser)
+    args = parser.parse_args()
     
-    server_address = sys.argv[1]
+    server_address = args.server_address
+    metrics_file = args.metrics_file
     
     # Получаем никнейм пользователя
     nickname = input("Введите ваше имя: ").strip()
@@ -727,7 +969,7 @@ def main():
         sys.exit(1)
     
     # Создаем и запускаем чат
-    chat = SimpleConsoleChat(server_address)
+    chat = SimpleConsoleChat(server_address, metrics_file=metrics_file, transport=TransportOptions.from_args(args))
     chat.nickname = nickname
     
     if not chat.connect():
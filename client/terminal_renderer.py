@@ -0,0 +1,152 @@
+import re
+import shutil
+import sys
+import threading
+import time
+import unicodedata
+
+
+DEFAULT_MAX_FPS = 20
+
+ANSI_ESCAPE = re.compile(r"\033\[[0-9;?]*[A-Za-z]")
+
+
+def char_width(char):
+    if unicodedata.combining(char) or char == "\ufe0f":
+        return 0
+    return 2 if unicodedata.east_asian_width(char) in ("W", "F") else 1
+
+
+def visible_width(text):
+    """Ширина строки в колонках терминала без учёта ANSI-последовательностей"""
+    return sum(char_width(char) for char in ANSI_ESCAPE.sub("", text))
+
+
+def fit(text, width):
+    """Обрезать строку до width колонок, чтобы она не переносилась"""
+    result = []
+    used = 0
+    pos = 0
+    styled = False
+    while pos < len(text):
+        match = ANSI_ESCAPE.match(text, pos)
+        if match:
+            result.append(match.group())
+            styled = True
+            pos = match.end()
+            continue
+        w = char_width(text[pos])
+        if used + w > width:
+            if styled:
+                result.append("\033[0m")
+            break
+        result.append(text[pos])
+        used += w
+        pos += 1
+    return "".join(result)
+
+
+class TerminalRenderer:
+    """Экран из именованных областей, перерисовывающий только изменившиеся строки
+
+    compose() возвращает {область: [строки]}, области выводятся в порядке regions,
+    последняя строка кадра - приглашение ко вводу. Рендерер помнит, что сейчас на
+    экране, и пишет только отличающиеся строки через позиционирование курсора.
+    Фоновые перерисовки (request) сливаются и выполняются не чаще max_fps раз в
+    секунду, курсор пользователя при этом сохраняется. Если экран изменён в обход
+    рендерера (invalidate), фоновые перерисовки ждут следующей render().
+    """
+
+    def __init__(self, regions, compose, stream=None, max_fps=DEFAULT_MAX_FPS, schedule=None, on_frame=None):
+        self.regions = regions
+        self.compose = compose
+        self.stream = stream or sys.stdout
+        self.min_interval = 1.0 / max_fps
+        self.schedule = schedule or self._schedule_timer
+        self.on_frame = on_frame  # on_frame(секунды, полная ли перерисовка, байт записано)
+        self.screen = None  # Строки на экране; None - экран неизвестен, нужна полная перерисовка
+        self.size = None
+        self.last_render = 0.0
+        self.scheduled = False
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _schedule_timer(delay, callback):
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+
+    @property
+    def valid(self):
+        """На экране последний кадр рендерера"""
+        return self.screen is not None
+
+    def invalidate(self):
+        """Экран изменён в обход рендерера, следующий кадр рисуется целиком"""
+        with self.lock:
+            self.screen = None
+
+    def render(self):
+        """Перерисовать сразу и поставить курсор в конец приглашения"""
+        with self.lock:
+            self._draw(background=False)
+
+    def request(self):
+        """Запросить фоновую перерисовку"""
+        with self.lock:
+            if self.scheduled:
+                return
+            self.scheduled = True
+            delay = max(0.0, self.last_render + self.min_interval - time.monotonic())
+        self.schedule(delay, self._flush)
+
+    def _flush(self):
+        with self.lock:
+            self.scheduled = False
+            # Вывод команды на экране не затирается до следующего ввода
+            if self.screen is not None:
+                self._draw(background=True)
+
+    def _frame(self, columns, rows):
+        regions = self.compose()
+        lines = []
+        for name in self.regions:
+            for line in regions.get(name, ()):
+                lines.extend(line.split("\n"))
+        # Кадр на строку ниже высоты терминала: Enter после ввода не прокручивает экран
+        lines = lines[-(rows - 1):] if rows > 1 else lines[-1:]
+        return [fit(line, columns - 1) for line in lines]
+
+    def _draw(self, background):
+        started = time.perf_counter()
+        size = shutil.get_terminal_size()
+        frame = self._frame(size.columns, size.lines)
+
+        full = self.screen is None or size != self.size
+        out = []
+        if full:
+            out.append("\033[H\033[2J")
+            for row, line in enumerate(frame, start=1):
+                out.append(f"\033[{row};1H{line}")
+        else:
+            for row, line in enumerate(frame, start=1):
+                if row > len(self.screen) or self.screen[row - 1] != line:
+                    out.append(f"\033[{row};1H{line}\033[K")
+            for row in range(len(frame) + 1, len(self.screen) + 1):
+                out.append(f"\033[{row};1H\033[K")
+
+        if background and not full:
+            # Курсор остаётся там, где пользователь набирает текст
+            if out:
+                out = ["\0337", *out, "\0338"]
+        elif frame:
+            out.append(f"\033[{len(frame)};{visible_width(frame[-1]) + 1}H")
+
+        data = "".join(out)
+        self.stream.write(data)
+        self.stream.flush()
+        self.screen = frame
+        self.size = size
+        self.last_render = time.monotonic()
+        if self.on_frame:
+            self.on_frame(time.perf_counter() - started, full, len(data.encode()))
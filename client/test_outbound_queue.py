@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+from generated import messenger_pb2
+from outbound_queue import BLOCK, DROP_OLDEST, DROPPED_OLDEST, MERGE, MERGED, QUEUED, REJECTED, OutboundQueue
+
+
+def message(content, chat_id="general"):
+    return messenger_pb2.ChatMessage(content=content, chat_id=chat_id, type=messenger_pb2.MESSAGE)
+
+
+def got_in(seq, chat_id="general"):
+    return messenger_pb2.ChatMessage(chat_id=chat_id, type=messenger_pb2.USER_GOT_IN, seq=seq)
+
+
+def drain(queue):
+    frames = []
+    while queue.qsize():
+        frames.append(queue.get_nowait())
+    return frames
+
+
+class OutboundQueueOfferTest(unittest.TestCase):
+    def setUp(self):
+        self.dropped = []
+
+    def queue(self, maxsize, policy):
+        return OutboundQueue(maxsize, policy, on_drop=self.dropped.append)
+
+    def test_queued(self):
+        queue = self.queue(2, MERGE)
+        self.assertEqual(queue.offer(message("a")), QUEUED)
+        self.assertEqual(queue.offer(message("b")), QUEUED)
+        self.assertEqual([frame.content for frame in drain(queue)], ["a", "b"])
+        self.assertEqual(self.dropped, [])
+
+    def test_merged(self):
+        queue = self.queue(3, MERGE)
+        stale = got_in(1)
+        queue.offer(stale)
+        queue.offer(message("a"))
+
+        # Повторный вход в тот же чат заменяет кадр на его месте, в другой чат - ставится
+        self.assertEqual(queue.offer(got_in(5)), MERGED)
+        self.assertEqual(queue.offer(got_in(7, chat_id="random")), QUEUED)
+
+        frames = drain(queue)
+        self.assertEqual([(frame.type, frame.seq) for frame in frames], [
+            (messenger_pb2.USER_GOT_IN, 5),
+            (messenger_pb2.MESSAGE, 0),
+            (messenger_pb2.USER_GOT_IN, 7),
+        ])
+        self.assertEqual(self.dropped, [stale])
+
+    def test_merged_into_full_queue(self):
+        queue = self.queue(1, MERGE)
+        queue.offer(got_in(1))
+        self.assertEqual(queue.offer(got_in(2)), MERGED)
+        self.assertEqual(queue.qsize(), 1)
+
+    def test_rejected(self):
+        queue = self.queue(1, MERGE)
+        queue.offer(message("a"))
+        self.assertEqual(queue.offer(message("b")), REJECTED)
+        self.assertEqual(queue.offer(got_in(1)), REJECTED)
+        self.assertEqual([frame.content for frame in drain(queue)], ["a"])
+        # Отклонённый кадр отдаёт вызывающему enqueue, on_drop его не получает
+        self.assertEqual(self.dropped, [])
+
+    def test_block_offer_does_not_wait(self):
+        queue = self.queue(1, BLOCK)
+        queue.offer(message("a"))
+        self.assertEqual(queue.offer(message("b")), REJECTED)
+
+    def test_dropped_oldest(self):
+        queue = self.queue(2, DROP_OLDEST)
+        first = message("a")
+        queue.offer(first)
+        queue.offer(message("b"))
+        self.assertEqual(queue.offer(message("c")), DROPPED_OLDEST)
+        self.assertEqual([frame.content for frame in drain(queue)], ["b", "c"])
+        self.assertEqual(self.dropped, [first])
+
+    def test_close_beyond_limit(self):
+        queue = self.queue(1, MERGE)
+        queue.offer(message("a"))
+        queue.close()
+        self.assertEqual([frame and frame.content for frame in drain(queue)], ["a", None])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            OutboundQueue(1, "spill")
+
+
+class OutboundQueueBlockTest(unittest.IsolatedAsyncioTestCase):
+    async def test_put_waits_for_room(self):
+        queue = OutboundQueue(1, BLOCK)
+        self.assertEqual(await queue.put(message("a")), QUEUED)
+
+        put = asyncio.create_task(queue.put(message("b")))
+        await asyncio.sleep(0.01)
+        self.assertFalse(put.done())
+
+        self.assertEqual(queue.get_nowait().content, "a")
+        self.assertEqual(await asyncio.wait_for(put, timeout=1), QUEUED)
+        self.assertEqual((await queue.get()).content, "b")
+
+    async def test_get_waits_for_frame(self):
+        queue = OutboundQueue(1, BLOCK)
+        get = asyncio.create_task(queue.get())
+        await asyncio.sleep(0.01)
+        self.assertFalse(get.done())
+
+        queue.offer(message("a"))
+        self.assertEqual((await asyncio.wait_for(get, timeout=1)).content, "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
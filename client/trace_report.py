@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import sys
+
+
+def percentile(sorted_samples, p):
+    index = max(0, min(len(sorted_samples) - 1, int(round(p / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+class TraceSpan:
+    __slots__ = ("service", "trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, service, raw):
+        self.service = service
+        self.trace_id = raw["traceId"]
+        self.span_id = raw["spanId"]
+        self.parent_id = raw.get("parentSpanId") or None
+        self.name = raw["name"]
+        self.start_ns = int(raw["startTimeUnixNano"])
+        self.end_ns = int(raw["endTimeUnixNano"])
+        self.attributes = {
+            attribute["key"]: next(iter(attribute["value"].values()), "")
+            for attribute in raw.get("attributes", [])
+        }
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+    @property
+    def stage(self):
+        return f"{self.service}: {self.name}"
+
+
+def load_spans(paths):
+    """Спаны из файлов OTLP-JSON клиентов и сервера (по ExportTraceServiceRequest на строку)"""
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                for resource_spans in json.loads(line).get("resourceSpans", []):
+                    service = "unknown"
+                    for attribute in resource_spans.get("resource", {}).get("attributes", []):
+                        if attribute["key"] == "service.name":
+                            service = attribute["value"].get("stringValue", service)
+                    for scope_spans in resource_spans.get("scopeSpans", []):
+                        for raw in scope_spans.get("spans", []):
+                            spans.append(TraceSpan(service, raw))
+    return spans
+
+
+def group_traces(spans):
+    traces = {}
+    for span in spans:
+        traces.setdefault(span.trace_id, []).append(span)
+    for trace in traces.values():
+        trace.sort(key=lambda span: span.start_ns)
+    return traces
+
+
+def stage_summary(spans):
+    durations = {}
+    for span in spans:
+        durations.setdefault(span.stage, []).append(span.duration_ms)
+
+    result = {}
+    for stage, samples in sorted(durations.items()):
+        samples.sort()
+        result[stage] = {
+            "count": len(samples),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+            "max_ms": round(samples[-1], 3),
+        }
+    return result
+
+
+def trace_duration_ms(trace):
+    return (max(span.end_ns for span in trace) - trace[0].start_ns) / 1e6
+
+
+def print_report(spans, traces, slowest):
+    print(f"Спанов: {len(spans)}, трасс: {len(traces)}")
+    print()
+    print(f"{'этап':<60}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage, summary in stage_summary(spans).items():
+        print(
+            f"{stage:<60}{summary['count']:>8}{summary['p50_ms']:>10.2f}"
+            f"{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['max_ms']:>10.2f}"
+        )
+
+    ranked = sorted(traces.items(), key=lambda item: trace_duration_ms(item[1]), reverse=True)
+    for trace_id, trace in ranked[:slowest]:
+        print()
+        print(f"Трасса {trace_id}: {trace_duration_ms(trace):.2f} мс от первого спана до последнего")
+        start = trace[0].start_ns
+        depth = {}
+        for span in trace:
+            depth[span.span_id] = depth.get(span.parent_id, -1) + 1
+            indent = "  " * depth[span.span_id]
+            print(f"  +{(span.start_ns - start) / 1e6:>9.2f} мс {span.duration_ms:>9.2f} мс  {indent}{span.stage}")
+
+
+def chrome_trace(traces):
+    """Трассы в формате Chrome Trace Event (chrome://tracing, Perfetto): процесс - сервис, поток - трасса"""
+    services = {}
+    events = []
+    for tid, (trace_id, trace) in enumerate(sorted(traces.items(), key=lambda item: item[1][0].start_ns), start=1):
+        for span in trace:
+            pid = services.setdefault(span.service, len(services) + 1)
+            events.append({
+                "name": span.name,
+                "cat": span.service,
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": {"trace_id": trace_id, "span_id": span.span_id, "parent_span_id": span.parent_id, **span.attributes},
+            })
+    for service, pid in services.items():
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": service}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Разбор трасс клиентов и сервера: задержки по этапам и самые медленные трассы')
+    parser.add_argument('files', nargs='+', help='Файлы OTLP-JSON (--trace-file клиентов, tracing.file сервера)')
+    parser.add_argument('--slowest', type=int, default=5, help='Сколько самых медленных трасс показать (по умолчанию: 5)')
+    parser.add_argument('--chrome', default=None, help='Сохранить трассы в формате Chrome Trace Event в этот файл')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    spans = load_spans(args.files)
+    if not spans:
+        print("❌ В файлах нет спанов", file=sys.stderr)
+        sys.exit(1)
+
+    traces = group_traces(spans)
+    print_report(spans, traces, args.slowest)
+
+    if args.chrome:
+        with open(args.chrome, "w") as f:
+            json.dump(chrome_trace(traces), f, ensure_ascii=False)
+        print(f"\n✅ Chrome trace сохранён в {args.chrome}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
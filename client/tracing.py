@@ -0,0 +1,255 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+import grpc
+
+
+TRACEPARENT = "traceparent"
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL = 1.0
+INSTRUMENTATION_SCOPE = "grpc-chat/client/tracing"
+
+# Значения SpanKind из OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+
+STATUS_ERROR = 2
+
+# Текущий спан задачи asyncio или потока, родитель для вложенных спанов и RPC
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class SpanContext(namedtuple("SpanContext", ["trace_id", "span_id"])):
+    """Идентификаторы спана в hex, как в ChatMessage.trace_id/span_id"""
+
+    @property
+    def valid(self):
+        return len(self.trace_id) == 32 and len(self.span_id) == 16 and self.trace_id.strip("0") != ""
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+def parse_traceparent(value):
+    parts = value.split("-")
+    if len(parts) != 4 or parts[0] != "00":
+        return None
+    context = SpanContext(parts[1], parts[2])
+    return context if context.valid else None
+
+
+def attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes):
+    return [{"key": key, "value": attribute_value(value)} for key, value in attributes.items()]
+
+
+class Span:
+    __slots__ = ("tracer", "name", "kind", "context", "parent_id", "start_ns", "end_ns", "attributes", "failed", "token")
+
+    def __init__(self, tracer, name, context, parent_id, kind, attributes, start_ns):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.context = context
+        self.parent_id = parent_id
+        self.start_ns = start_ns
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.failed = False
+        self.token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.failed = True
+        self.attributes["error"] = str(error)
+
+    def end(self, end_ns=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        self.tracer.export(self)
+
+    def __enter__(self):
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_span.reset(self.token)
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.record_error(exc)
+        self.end()
+        return False
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.failed:
+            span["status"] = {"code": STATUS_ERROR}
+        return span
+
+
+class NoopSpan:
+    """Спан выключенного трассировщика: ничего не пишет и не меняет current_span"""
+
+    context = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self, end_ns=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer:
+    """Спаны процесса в файл в формате OTLP-JSON, по ExportTraceServiceRequest на строку
+
+    Тот же формат пишет сервер, файлы клиентов и сервера разбираются вместе
+    (trace_report.py или otlpjsonfile-ресивер OpenTelemetry Collector).
+    Без path трассировка выключена и start_span возвращает NOOP_SPAN.
+    """
+
+    def __init__(self, path=None, service_name="grpc-chat-client"):
+        self.path = path
+        self.resource = {"service.name": service_name}
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def start_span(self, name, parent=None, kind=SPAN_KIND_INTERNAL, attributes=None, start_ns=None):
+        """Спан под parent (SpanContext), а без него - под current_span или в новой трассе"""
+        if not self.enabled:
+            return NOOP_SPAN
+        if parent is None:
+            active = current_span.get()
+            parent = active.context if active is not None else None
+
+        span_id = os.urandom(8).hex()
+        if parent is not None and parent.valid:
+            context = SpanContext(parent.trace_id, span_id)
+            parent_id = parent.span_id
+        else:
+            context = SpanContext(os.urandom(16).hex(), span_id)
+            parent_id = None
+        return Span(self, name, context, parent_id, kind, attributes, start_ns or time.time_ns())
+
+    def start_child(self, name, kind=SPAN_KIND_INTERNAL, attributes=None):
+        """Спан под current_span; без активного спана ничего не пишется, новая трасса не начинается"""
+        active = current_span.get()
+        if active is None:
+            return NOOP_SPAN
+        return self.start_span(name, parent=active.context, kind=kind, attributes=attributes)
+
+    def export(self, span):
+        with self.lock:
+            self.buffer.append(span.to_otlp())
+            if len(self.buffer) < EXPORT_BATCH_SIZE and time.monotonic() - self.last_flush < EXPORT_INTERVAL:
+                return
+            batch, self.buffer = self.buffer, []
+            self.last_flush = time.monotonic()
+            self.write(batch)
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+            self.last_flush = time.monotonic()
+            self.write(batch)
+
+    def write(self, batch):
+        if not batch:
+            return
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": otlp_attributes(self.resource)},
+                "scopeSpans": [{"scope": {"name": INSTRUMENTATION_SCOPE}, "spans": batch}],
+            }]
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+    def close(self):
+        if self.enabled:
+            self.flush()
+
+
+class AioTracingInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    """Клиентский спан на унарный вызов, контекст уходит на сервер в метаданных traceparent"""
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        if not self.tracer.enabled:
+            return await continuation(client_call_details, request)
+
+        method = client_call_details.method
+        if isinstance(method, bytes):
+            method = method.decode()
+        span = self.tracer.start_span(method.rsplit("/", 1)[-1], kind=SPAN_KIND_CLIENT, attributes={
+            "rpc.system": "grpc",
+            "rpc.method": method,
+        })
+
+        metadata = grpc.aio.Metadata(*(client_call_details.metadata or ()))
+        metadata.add(TRACEPARENT, span.context.traceparent())
+        details = grpc.aio.ClientCallDetails(
+            client_call_details.method,
+            client_call_details.timeout,
+            metadata,
+            client_call_details.credentials,
+            client_call_details.wait_for_ready,
+        )
+
+        call = await continuation(details, request)
+        try:
+            await call
+        except grpc.RpcError:
+            # Ошибку получит вызывающий код, когда дождётся call
+            pass
+        code = await call.code()
+        span.set_attribute("rpc.grpc.status_code", code.value[0])
+        if code != grpc.StatusCode.OK:
+            span.failed = True
+        span.end()
+        return call
@@ -0,0 +1,81 @@
+import grpc
+
+
+COMPRESSIONS = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+# Вызовы, запросы которых стоит сжимать: пачки сообщений. Ответы с историей
+# (GetMessages, GetMessagesSince, повтор в ChatStream) сжимает сервер
+COMPRESSED_CALLS = ("SendMessages", "ChatStream")
+
+
+class TransportOptions:
+    """Параметры gRPC-канала клиента: сжатие, keepalive, размер сообщений, окно HTTP/2
+
+    None оставляет значение gRPC по умолчанию. keepalive_time не должен быть
+    меньше keepalive.min_time сервера, иначе тот закроет соединение (too_many_pings).
+    """
+
+    __slots__ = ("compression", "compressed_calls", "keepalive_time", "keepalive_timeout",
+                 "keepalive_without_calls", "max_message_size", "window_size")
+
+    def __init__(self, compression="none", compressed_calls=COMPRESSED_CALLS, keepalive_time=None, keepalive_timeout=None,
+                 keepalive_without_calls=False, max_message_size=None, window_size=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression: {compression}")
+        self.compression = compression
+        self.compressed_calls = compressed_calls
+        self.keepalive_time = keepalive_time
+        self.keepalive_timeout = keepalive_timeout
+        self.keepalive_without_calls = keepalive_without_calls
+        self.max_message_size = max_message_size
+        self.window_size = window_size
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            compression=args.compression,
+            keepalive_time=args.keepalive_time,
+            keepalive_timeout=args.keepalive_timeout,
+            keepalive_without_calls=args.keepalive_without_calls,
+            max_message_size=args.max_message_size,
+            window_size=args.window_size,
+        )
+
+    def channel_options(self):
+        options = []
+        if self.keepalive_time is not None:
+            options.append(("grpc.keepalive_time_ms", int(self.keepalive_time * 1000)))
+            # Без этого после двух пингов без данных gRPC перестаёт их слать
+            options.append(("grpc.http2.max_pings_without_data", 0))
+        if self.keepalive_timeout is not None:
+            options.append(("grpc.keepalive_timeout_ms", int(self.keepalive_timeout * 1000)))
+        if self.keepalive_without_calls:
+            options.append(("grpc.keepalive_permit_without_calls", 1))
+        if self.max_message_size is not None:
+            options.append(("grpc.max_receive_message_length", self.max_message_size))
+            options.append(("grpc.max_send_message_length", self.max_message_size))
+        if self.window_size is not None:
+            # Фиксированное начальное окно вместо подстройки по BDP
+            options.append(("grpc.http2.lookahead_bytes", self.window_size))
+            options.append(("grpc.http2.bdp_probe", 0))
+        return options
+
+    def call_compression(self, call):
+        """Сжатие запросов вызова call ('SendMessages'), None - как у канала"""
+        if self.compression == "none" or call not in self.compressed_calls:
+            return None
+        return COMPRESSIONS[self.compression]
+
+
+def add_transport_arguments(parser):
+    group = parser.add_argument_group('транспорт gRPC')
+    group.add_argument('--compression', choices=sorted(COMPRESSIONS), default='none', help=f'Сжатие запросов {", ".join(COMPRESSED_CALLS)} (по умолчанию: none)')
+    group.add_argument('--keepalive-time', type=float, default=None, help='Интервал keepalive-пингов HTTP/2 в секундах (по умолчанию пинги выключены)')
+    group.add_argument('--keepalive-timeout', type=float, default=None, help='Сколько секунд ждать ответа на пинг (по умолчанию: 20)')
+    group.add_argument('--keepalive-without-calls', action='store_true', help='Слать пинги и без активных вызовов')
+    group.add_argument('--max-message-size', type=int, default=None, help='Максимальный размер сообщения в байтах (по умолчанию: 4 МБ на приём)')
+    group.add_argument('--window-size', type=int, default=None, help='Начальное окно потока HTTP/2 в байтах (по умолчанию подбирается по BDP)')
+    return group
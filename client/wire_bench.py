@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from benchmark import LatencyRecorder
+from reference_server import MAX_BATCH_SIZE, ReferenceServer
+from transport import COMPRESSIONS, TransportOptions
+from generated import messenger_pb2
+from generated import messenger_pb2_grpc
+import grpc
+
+
+# Текст, похожий на переписку: сжимается заметно хуже повторяющегося символа
+WORDS = (
+    "привет", "как", "дела", "сегодня", "завтра", "созвон", "в", "на", "по", "релиз", "сервер",
+    "клиент", "ок", "спасибо", "посмотрю", "кажется", "упало", "починил", "ревью", "ветка",
+    "hello", "deploy", "redis", "grpc", "stream", "latency", "p99", "метрики", "чат", "лог",
+)
+
+
+def chat_text(size):
+    words = []
+    length = 0
+    while length < size:
+        word = random.choice(WORDS) if random.random() > 0.1 else str(random.randint(0, 100000))
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+class CountingProxy:
+    """TCP-прокси между клиентом и сервером, считает байты в обе стороны с заголовками HTTP/2"""
+
+    def __init__(self, upstream):
+        self.upstream_host, self.upstream_port = upstream.rsplit(":", 1)
+        self.sent = 0  # клиент -> сервер
+        self.received = 0  # сервер -> клиент
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"127.0.0.1:{port}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection(self.upstream_host, int(self.upstream_port))
+        try:
+            await asyncio.gather(
+                self.pipe(reader, upstream_writer, "sent"),
+                self.pipe(upstream_reader, writer, "received"),
+                return_exceptions=True,
+            )
+        except asyncio.CancelledError:
+            pass
+
+    async def pipe(self, reader, writer, counter):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                setattr(self, counter, getattr(self, counter) + len(data))
+                writer.write(data)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def snapshot(self):
+        return self.sent, self.received
+
+
+class WireBench:
+    """Байты и задержки загрузки длинной истории при одном режиме сжатия"""
+
+    def __init__(self, args, address, compression):
+        self.args = args
+        self.compression = compression
+        self.proxy = CountingProxy(address)
+        self.transport = TransportOptions(compression=compression, max_message_size=args.max_message_size)
+        self.channel = None
+        self.stub = None
+        self.nickname = f"wire-{uuid.uuid4().hex[:8]}"
+        self.chat_id = None
+        self.results = {}
+
+    async def run(self):
+        address = await self.proxy.start()
+        self.channel = grpc.aio.insecure_channel(address, options=self.transport.channel_options())
+        self.stub = messenger_pb2_grpc.MessengerStub(self.channel)
+        try:
+            await self.fill()
+            for _ in range(self.args.rounds):
+                await self.measure("GetMessages", self.get_page)
+                await self.measure("GetMessagesSince", self.get_since)
+                await self.measure("ChatStream replay", self.replay)
+        finally:
+            await self.channel.close()
+            await self.proxy.stop()
+        return {name: self.summary(result) for name, result in self.results.items()}
+
+    async def fill(self):
+        response = await self.stub.CreateChat(messenger_pb2.CreateChatRequest(name=self.nickname, nickname=self.nickname))
+        self.chat_id = response.chat_id
+
+        sent_before, received_before = self.proxy.snapshot()
+        recorder = LatencyRecorder()
+        for start in range(0, self.args.messages, MAX_BATCH_SIZE):
+            count = min(MAX_BATCH_SIZE, self.args.messages - start)
+            request = messenger_pb2.SendMessagesRequest(
+                messages=[chat_text(self.args.message_size) for _ in range(count)],
+                chat_id=self.chat_id,
+                nickname=self.nickname,
+            )
+            started = time.perf_counter()
+            await self.stub.SendMessages(request, compression=self.transport.call_compression("SendMessages"))
+            recorder.add(time.perf_counter() - started)
+        sent, received = self.proxy.snapshot()
+        self.results["SendMessages"] = {"recorder": recorder, "sent": sent - sent_before, "received": received - received_before}
+
+    async def measure(self, name, operation):
+        result = self.results.setdefault(name, {"recorder": LatencyRecorder(), "sent": 0, "received": 0})
+        sent_before, received_before = self.proxy.snapshot()
+        started = time.perf_counter()
+        await operation()
+        result["recorder"].add(time.perf_counter() - started)
+        sent, received = self.proxy.snapshot()
+        result["sent"] += sent - sent_before
+        result["received"] += received - received_before
+
+    async def get_page(self):
+        await self.stub.GetMessages(messenger_pb2.GetMessagesRequest(chat_id=self.chat_id, limit=self.args.page_size))
+
+    @property
+    def cursor(self):
+        # Нулевой курсор означает последнюю страницу, поэтому догоняем с seq > 0
+        return max(1, self.args.messages - self.args.backlog)
+
+    async def get_since(self):
+        cursor = self.cursor
+        while True:
+            response = await self.stub.GetMessagesSince(messenger_pb2.GetMessagesSinceRequest(chat_id=self.chat_id, cursor=cursor))
+            cursor = response.next_cursor
+            if not response.has_more:
+                return
+
+    async def replay(self):
+        """Повтор пропущенного по стриму: переподключение с resume от того же курсора"""
+        done = asyncio.Event()
+
+        async def requests():
+            yield messenger_pb2.ChatMessage(
+                nickname=self.nickname,
+                type=messenger_pb2.USER_CONNECTED,
+                resume={self.chat_id: self.cursor},
+            )
+            await done.wait()
+
+        call = self.stub.ChatStream(requests(), compression=self.transport.call_compression("ChatStream"))
+        async for frame in call:
+            if frame.type == messenger_pb2.MESSAGE_BATCH and frame.seq >= self.args.messages:
+                break
+        done.set()
+        call.cancel()
+
+    def summary(self, result):
+        recorder = result["recorder"]
+        summary = recorder.summary(sum(recorder.samples))
+        summary.pop("throughput_per_s")
+        count = max(1, summary["count"])
+        summary["bytes_sent_per_call"] = round(result["sent"] / count)
+        summary["bytes_received_per_call"] = round(result["received"] / count)
+        return summary
+
+
+async def run(args):
+    report = {
+        "server": args.server or "reference (in-process)",
+        "config": {
+            "messages": args.messages,
+            "message_size": args.message_size,
+            "page_size": args.page_size,
+            "backlog": args.backlog,
+            "rounds": args.rounds,
+        },
+        "modes": {},
+    }
+    for compression in args.modes:
+        # Ответы сжимает сервер: эталонный запускается с тем же режимом,
+        # у внешнего действует его собственный конфиг
+        server = None
+        address = args.server
+        if address is None:
+            server = ReferenceServer(compression=compression)
+            address = await server.start()
+        try:
+            report["modes"][compression] = await WireBench(args, address, compression).run()
+        finally:
+            if server is not None:
+                await server.stop()
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Байты на проводе и задержки загрузки длинной истории при разном сжатии')
+    parser.add_argument('--server', default=None, help='Адрес сервера (по умолчанию запускается эталонный сервер в процессе)')
+    parser.add_argument('--modes', default='none,gzip', help=f'Режимы сжатия через запятую из {", ".join(sorted(COMPRESSIONS))} (по умолчанию: none,gzip)')
+    parser.add_argument('--messages', type=int, default=5000, help='Сообщений в истории чата')
+    parser.add_argument('--message-size', type=int, default=200, help='Длина сообщения в символах')
+    parser.add_argument('--page-size', type=int, default=500, help='limit для GetMessages')
+    parser.add_argument('--backlog', type=int, default=4000, help='Сколько пропущенных сообщений догонять через GetMessagesSince и ChatStream')
+    parser.add_argument('--rounds', type=int, default=20, help='Сколько раз загрузить историю каждым способом')
+    parser.add_argument('--max-message-size', type=int, default=None, help='Максимальный размер сообщения gRPC в байтах')
+    parser.add_argument('--output', default=None, help='Файл для JSON-отчёта (по умолчанию stdout)')
+    args = parser.parse_args()
+    args.modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    for mode in args.modes:
+        if mode not in COMPRESSIONS:
+            parser.error(f"неизвестный режим сжатия: {mode}")
+    return args
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"✅ Отчёт сохранён в {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+package cluster
+
+import (
+	"context"
+	"log"
+	"strings"
+	"sync"
+
+	"github.com/google/uuid"
+	"github.com/kuzin57/grpc-chat/server/internal/config"
+	"github.com/kuzin57/grpc-chat/server/internal/generated"
+	"github.com/redis/go-redis/v9"
+	"google.golang.org/protobuf/proto"
+)
+
+const (
+	// Frames of a chat go to its own channel, an instance subscribes only while the chat has local sessions
+	frameChannelPrefix = "chat_events:"
+	// Membership and registry changes go to every instance
+	controlChannel = "cluster_events"
+)
+
+// Handler applies what other instances published
+type Handler interface {
+	DeliverRemote(ctx context.Context, frame *generated.ChatMessage)
+	ApplyMembership(chatID, nickname string, joined bool)
+	InvalidateChat(chatID string)
+}
+
+// Bus fans chat frames and membership changes out to the other server instances over Redis pub/sub.
+// Each instance still delivers to its own sessions directly and skips its own events.
+type Bus struct {
+	client   *redis.Client
+	pubsub   *redis.PubSub
+	instance string
+
+	mu      sync.Mutex
+	pending map[string]bool // chat -> subscribe or unsubscribe, applied by the subscriptions loop
+	changed chan struct{}
+	done    chan struct{}
+	wg      sync.WaitGroup
+}
+
+func NewBus(cfg config.RedisConfig) (*Bus, error) {
+	client := redis.NewClient(&redis.Options{
+		Addr:     cfg.Host + ":" + cfg.Port,
+		Password: cfg.Password,
+		Username: cfg.User,
+	})
+
+	if err := client.Ping(context.Background()).Err(); err != nil {
+		return nil, err
+	}
+
+	return &Bus{
+		client:   client,
+		instance: uuid.NewString(),
+		pending:  make(map[string]bool),
+		changed:  make(chan struct{}, 1),
+		done:     make(chan struct{}),
+	}, nil
+}
+
+func (b *Bus) Instance() string {
+	return b.instance
+}
+
+// Start subscribes to the control channel and starts delivering events of other instances to handler
+func (b *Bus) Start(ctx context.Context, handler Handler) error {
+	b.pubsub = b.client.Subscribe(ctx, controlChannel)
+
+	// Wait for the subscription, events published before it would be lost silently
+	if _, err := b.pubsub.Receive(ctx); err != nil {
+		return err
+	}
+
+	b.wg.Add(2)
+	go b.receive(handler)
+	go b.subscriptions()
+
+	return nil
+}
+
+// Watch subscribes the instance to the chat frames, it is called when the chat gets its first local session.
+// It never blocks, the subscription is applied in the background.
+func (b *Bus) Watch(chatID string) {
+	b.setPending(chatID, true)
+}
+
+// Unwatch unsubscribes once the chat has no local sessions
+func (b *Bus) Unwatch(chatID string) {
+	b.setPending(chatID, false)
+}
+
+func (b *Bus) setPending(chatID string, subscribe bool) {
+	b.mu.Lock()
+	b.pending[chatID] = subscribe
+	b.mu.Unlock()
+
+	select {
+	case b.changed <- struct{}{}:
+	default:
+	}
+}
+
+func (b *Bus) PublishFrame(ctx context.Context, chatID string, frame *generated.ChatMessage) error {
+	data, err := proto.Marshal(frame)
+	if err != nil {
+		return err
+	}
+
+	return b.publish(ctx, frameChannelPrefix+chatID, envelope{
+		kind:   kindFrame,
+		chatID: chatID,
+		frame:  data,
+	})
+}
+
+func (b *Bus) PublishMembership(ctx context.Context, chatID, nickname string, joined bool) error {
+	kind := kindLeave
+	if joined {
+		kind = kindJoin
+	}
+
+	return b.publish(ctx, controlChannel, envelope{
+		kind:     kind,
+		chatID:   chatID,
+		nickname: nickname,
+	})
+}
+
+// PublishChatChanged makes other instances drop their cached registry entry of the chat
+func (b *Bus) PublishChatChanged(ctx context.Context, chatID string) error {
+	return b.publish(ctx, controlChannel, envelope{
+		kind:   kindChatChanged,
+		chatID: chatID,
+	})
+}
+
+func (b *Bus) publish(ctx context.Context, channel string, e envelope) error {
+	e.instance = b.instance
+
+	return b.client.Publish(ctx, channel, e.marshal()).Err()
+}
+
+func (b *Bus) receive(handler Handler) {
+	defer b.wg.Done()
+
+	for message := range b.pubsub.Channel() {
+		e, err := unmarshalEnvelope([]byte(message.Payload))
+		if err != nil {
+			log.Printf("Cluster event on %s dropped: %v", message.Channel, err)
+			continue
+		}
+
+		if e.instance == b.instance {
+			continue
+		}
+
+		switch e.kind {
+		case kindFrame:
+			frame := &generated.ChatMessage{}
+			if err := proto.Unmarshal(e.frame, frame); err != nil {
+				log.Printf("Cluster frame of chat %s dropped: %v", e.chatID, err)
+				continue
+			}
+
+			handler.DeliverRemote(context.Background(), frame)
+		case kindJoin, kindLeave:
+			handler.ApplyMembership(e.chatID, e.nickname, e.kind == kindJoin)
+		case kindChatChanged:
+			handler.InvalidateChat(e.chatID)
+		default:
+			log.Printf("Unknown cluster event %d on %s", e.kind, message.Channel)
+		}
+	}
+}
+
+func (b *Bus) subscriptions() {
+	defer b.wg.Done()
+
+	for {
+		select {
+		case <-b.changed:
+		case <-b.done:
+			return
+		}
+
+		b.mu.Lock()
+		pending := b.pending
+		b.pending = make(map[string]bool)
+		b.mu.Unlock()
+
+		var subscribe, unsubscribe []string
+		for chatID, watch := range pending {
+			if watch {
+				subscribe = append(subscribe, frameChannelPrefix+chatID)
+			} else {
+				unsubscribe = append(unsubscribe, frameChannelPrefix+chatID)
+			}
+		}
+
+		ctx := context.Background()
+
+		if len(subscribe) > 0 {
+			if err := b.pubsub.Subscribe(ctx, subscribe...); err != nil {
+				log.Printf("Failed to subscribe to %s: %v", strings.Join(subscribe, ", "), err)
+			}
+		}
+
+		if len(unsubscribe) > 0 {
+			if err := b.pubsub.Unsubscribe(ctx, unsubscribe...); err != nil {
+				log.Printf("Failed to unsubscribe from %s: %v", strings.Join(unsubscribe, ", "), err)
+			}
+		}
+	}
+}
+
+func (b *Bus) Close() error {
+	close(b.done)
+
+	var err error
+	if b.pubsub != nil {
+		err = b.pubsub.Close()
+	}
+
+	b.wg.Wait()
+
+	if closeErr := b.client.Close(); err == nil {
+		err = closeErr
+	}
+
+	return err
+}
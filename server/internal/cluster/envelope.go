@@ -0,0 +1,77 @@
+package cluster
+
+import (
+	"encoding/binary"
+	"errors"
+)
+
+type eventKind byte
+
+const (
+	kindFrame eventKind = iota + 1
+	kindJoin
+	kindLeave
+	kindChatChanged
+)
+
+var errMalformedEnvelope = errors.New("malformed cluster envelope")
+
+// envelope is what instances publish to each other: kind, fields as uvarint-length-prefixed strings,
+// then the marshalled frame for kindFrame
+type envelope struct {
+	kind     eventKind
+	instance string
+	chatID   string
+	nickname string
+	frame    []byte
+}
+
+func (e envelope) marshal() []byte {
+	size := 1 + 3*binary.MaxVarintLen64 + len(e.instance) + len(e.chatID) + len(e.nickname) + len(e.frame)
+
+	data := make([]byte, 0, size)
+	data = append(data, byte(e.kind))
+	data = appendString(data, e.instance)
+	data = appendString(data, e.chatID)
+	data = appendString(data, e.nickname)
+
+	return append(data, e.frame...)
+}
+
+func unmarshalEnvelope(data []byte) (envelope, error) {
+	if len(data) == 0 {
+		return envelope{}, errMalformedEnvelope
+	}
+
+	e := envelope{kind: eventKind(data[0])}
+	data = data[1:]
+
+	for _, field := range []*string{&e.instance, &e.chatID, &e.nickname} {
+		value, rest, err := readString(data)
+		if err != nil {
+			return envelope{}, err
+		}
+
+		*field, data = value, rest
+	}
+
+	e.frame = data
+
+	return e, nil
+}
+
+func appendString(data []byte, value string) []byte {
+	data = binary.AppendUvarint(data, uint64(len(value)))
+	return append(data, value...)
+}
+
+func readString(data []byte) (string, []byte, error) {
+	length, n := binary.Uvarint(data)
+	if n <= 0 || uint64(len(data)-n) < length {
+		return "", nil, errMalformedEnvelope
+	}
+
+	data = data[n:]
+
+	return string(data[:length]), data[length:], nil
+}
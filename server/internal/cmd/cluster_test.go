@@ -0,0 +1,300 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"net"
+	"os"
+	"slices"
+	"strings"
+	"sync"
+	"testing"
+	"time"
+
+	"github.com/google/uuid"
+	"github.com/kuzin57/grpc-chat/server/internal/config"
+	"github.com/kuzin57/grpc-chat/server/internal/generated"
+	"github.com/redis/go-redis/v9"
+	"google.golang.org/grpc"
+	"google.golang.org/grpc/credentials/insecure"
+)
+
+const (
+	clusterMessages = 50
+	clusterInterval = 10 * time.Millisecond
+	// Subscriptions to the chat channel are applied in the background after join
+	clusterSettle  = 500 * time.Millisecond
+	clusterTimeout = 5 * time.Second
+	// p95 of the delivery between instances, Redis pub/sub on the same host adds a few milliseconds
+	clusterLatencyBound = 250 * time.Millisecond
+)
+
+// TestClusterDelivery starts two instances on one Redis, alice is connected to the first one,
+// bob and the second device of alice to the second one. The Redis address is taken from
+// REDIS_ADDR (localhost:6379 by default), REDIS_USER and REDIS_PASSWORD; the test is skipped
+// if Redis is not reachable. Everything the test writes is deleted when it ends.
+func TestClusterDelivery(t *testing.T) {
+	var (
+		redisConfig = clusterRedis(t)
+		// The chat and the nicknames start with the prefix, so do all the keys built from them
+		prefix = "cluster_test:" + uuid.NewString()[:8]
+		ctx    = context.Background()
+	)
+
+	// Registered first to run last, after both instances have stopped
+	deleteKeys(t, redisConfig, prefix)
+
+	var (
+		first  = startInstance(t, redisConfig)
+		second = startInstance(t, redisConfig)
+	)
+
+	alice := openSession(t, first, prefix+":alice")
+	bob := openSession(t, second, prefix+":bob")
+	aliceSecond := openSession(t, second, alice.nickname)
+
+	created, err := first.CreateChat(ctx, &generated.CreateChatRequest{Name: prefix, Nickname: alice.nickname}, grpc.WaitForReady(true))
+	if err != nil {
+		t.Fatalf("failed to create chat: %v", err)
+	}
+
+	joined, err := second.JoinChat(ctx, &generated.JoinChatRequest{ChatId: created.ChatId, Nickname: bob.nickname}, grpc.WaitForReady(true))
+	if err != nil || !joined.Success {
+		t.Fatalf("failed to join chat: %v", err)
+	}
+
+	time.Sleep(clusterSettle)
+
+	t.Run("first->second", func(t *testing.T) {
+		checkDirection(t, alice, created.ChatId, prefix+":a:", map[string]*session{
+			"bob":                 bob,
+			"alice_second_device": aliceSecond,
+		})
+	})
+
+	t.Run("second->first", func(t *testing.T) {
+		checkDirection(t, bob, created.ChatId, prefix+":b:", map[string]*session{
+			"alice": alice,
+		})
+	})
+}
+
+func checkDirection(t *testing.T, sender *session, chatID, prefix string, receivers map[string]*session) {
+	sent := make(map[string]time.Time, clusterMessages)
+
+	for i := range clusterMessages {
+		content := fmt.Sprintf("%s%d", prefix, i)
+		sent[content] = time.Now()
+
+		if err := sender.send(&generated.ChatMessage{
+			Type:     generated.ChatMessageType_MESSAGE,
+			Content:  content,
+			Nickname: sender.nickname,
+			ChatId:   chatID,
+		}); err != nil {
+			t.Fatalf("failed to send message: %v", err)
+		}
+
+		time.Sleep(clusterInterval)
+	}
+
+	deadline := time.Now().Add(clusterTimeout)
+	for name, receiver := range receivers {
+		received := receiver.wait(prefix, len(sent), deadline)
+
+		if missing := len(sent) - len(received); missing > 0 {
+			t.Errorf("%s: %d of %d messages not delivered", name, missing, len(sent))
+			continue
+		}
+
+		latencies := make([]time.Duration, 0, len(received))
+		for content, at := range received {
+			latencies = append(latencies, at.Sub(sent[content]))
+		}
+
+		slices.Sort(latencies)
+
+		p95 := latencies[len(latencies)*95/100]
+		if p95 > clusterLatencyBound {
+			t.Errorf("%s: p95 delivery latency %s exceeds %s", name, p95, clusterLatencyBound)
+		}
+
+		t.Logf("%s: p50 %s, p95 %s, max %s", name, latencies[len(latencies)/2], p95, latencies[len(latencies)-1])
+	}
+}
+
+func clusterRedis(t *testing.T) config.RedisConfig {
+	addr := os.Getenv("REDIS_ADDR")
+	if addr == "" {
+		addr = "localhost:6379"
+	}
+
+	conn, err := net.DialTimeout("tcp", addr, time.Second)
+	if err != nil {
+		t.Skipf("Redis is not reachable on %s: %v", addr, err)
+	}
+	conn.Close()
+
+	host, port, err := net.SplitHostPort(addr)
+	if err != nil {
+		t.Fatalf("invalid REDIS_ADDR %q: %v", addr, err)
+	}
+
+	return config.RedisConfig{
+		Host:     host,
+		Port:     port,
+		User:     os.Getenv("REDIS_USER"),
+		Password: os.Getenv("REDIS_PASSWORD"),
+	}
+}
+
+// deleteKeys removes the keys containing prefix once the test and its cleanups are done
+func deleteKeys(t *testing.T, redisConfig config.RedisConfig, prefix string) {
+	t.Cleanup(func() {
+		client := redis.NewClient(&redis.Options{
+			Addr:     redisConfig.Host + ":" + redisConfig.Port,
+			Username: redisConfig.User,
+			Password: redisConfig.Password,
+		})
+		defer client.Close()
+
+		var (
+			ctx  = context.Background()
+			keys []string
+			iter = client.Scan(ctx, 0, "*"+prefix+"*", 1000).Iterator()
+		)
+
+		for iter.Next(ctx) {
+			keys = append(keys, iter.Val())
+		}
+
+		if err := iter.Err(); err != nil {
+			t.Errorf("failed to find keys of %s: %v", prefix, err)
+			return
+		}
+
+		if len(keys) == 0 {
+			return
+		}
+
+		if err := client.Del(ctx, keys...).Err(); err != nil {
+			t.Errorf("failed to delete %d keys of %s: %v", len(keys), prefix, err)
+		}
+	})
+}
+
+// startInstance runs a server with cluster fan-out on a free port and returns a client of it
+func startInstance(t *testing.T, redisConfig config.RedisConfig) generated.MessengerClient {
+	listener, err := net.Listen("tcp", "127.0.0.1:0")
+	if err != nil {
+		t.Fatalf("failed to pick a port: %v", err)
+	}
+
+	_, port, _ := net.SplitHostPort(listener.Addr().String())
+	listener.Close()
+
+	server, err := NewGRPCServer(&config.Config{
+		Port:    port,
+		Cluster: config.ClusterConfig{Enabled: true},
+		Redis:   redisConfig,
+	})
+	if err != nil {
+		t.Fatalf("failed to create server: %v", err)
+	}
+
+	go func() {
+		if err := server.Start(); err != nil {
+			t.Errorf("server on port %s failed: %v", port, err)
+		}
+	}()
+	t.Cleanup(server.Stop)
+
+	client, err := grpc.NewClient("127.0.0.1:"+port, grpc.WithTransportCredentials(insecure.NewCredentials()))
+	if err != nil {
+		t.Fatalf("failed to create client: %v", err)
+	}
+	t.Cleanup(func() { client.Close() })
+
+	return generated.NewMessengerClient(client)
+}
+
+// session is a ChatStream of one user that records when frames with a given content arrived
+type session struct {
+	nickname string
+	stream   generated.Messenger_ChatStreamClient
+
+	mu       sync.Mutex
+	received map[string]time.Time
+}
+
+func openSession(t *testing.T, client generated.MessengerClient, nickname string) *session {
+	ctx, cancel := context.WithCancel(context.Background())
+	t.Cleanup(cancel)
+
+	stream, err := client.ChatStream(ctx, grpc.WaitForReady(true))
+	if err != nil {
+		t.Fatalf("failed to open stream: %v", err)
+	}
+
+	s := &session{
+		nickname: nickname,
+		stream:   stream,
+		received: make(map[string]time.Time),
+	}
+
+	// The server registers the user on its first frame
+	if err := s.send(&generated.ChatMessage{Type: generated.ChatMessageType_USER_CONNECTED, Nickname: nickname}); err != nil {
+		t.Fatalf("failed to connect %s: %v", nickname, err)
+	}
+
+	go s.receive()
+
+	return s
+}
+
+func (s *session) send(frame *generated.ChatMessage) error {
+	return s.stream.Send(frame)
+}
+
+func (s *session) receive() {
+	for {
+		frame, err := s.stream.Recv()
+		if err != nil {
+			return
+		}
+
+		now := time.Now()
+		items := []*generated.ChatMessage{frame}
+		if frame.Type == generated.ChatMessageType_MESSAGE_BATCH {
+			items = frame.Batch
+		}
+
+		s.mu.Lock()
+		for _, item := range items {
+			if _, ok := s.received[item.Content]; item.Type == generated.ChatMessageType_MESSAGE && !ok {
+				s.received[item.Content] = now
+			}
+		}
+		s.mu.Unlock()
+	}
+}
+
+// wait returns the arrival times of messages with the prefix once count of them arrived or the deadline passed
+func (s *session) wait(prefix string, count int, deadline time.Time) map[string]time.Time {
+	for {
+		s.mu.Lock()
+		received := make(map[string]time.Time, count)
+		for content, at := range s.received {
+			if strings.HasPrefix(content, prefix) {
+				received[content] = at
+			}
+		}
+		s.mu.Unlock()
+
+		if len(received) >= count || time.Now().After(deadline) {
+			return received
+		}
+
+		time.Sleep(50 * time.Millisecond)
+	}
+}
@@ -1,31 +1,58 @@
 package main
 
 import (
+	"context"
+	"errors"
 	"flag"
 	"fmt"
 	"log"
 	"net"
+	"net/http"
 	"os"
 	"os/signal"
 	"syscall"
 
+	"github.com/kuzin57/grpc-chat/server/internal/cluster"
 	"github.com/kuzin57/grpc-chat/server/internal/config"
 	"github.com/kuzin57/grpc-chat/server/internal/generated"
 	"github.com/kuzin57/grpc-chat/server/internal/repository"
+	"github.com/kuzin57/grpc-chat/server/internal/rooms"
 	"github.com/kuzin57/grpc-chat/server/internal/server"
 	"github.com/kuzin57/grpc-chat/server/internal/services/messenger"
+	"github.com/kuzin57/grpc-chat/server/internal/tracing"
+	"github.com/kuzin57/grpc-chat/server/internal/transport"
 	"google.golang.org/grpc"
 	"gopkg.in/yaml.v2"
 )
 
 type GRPCServer struct {
-	server *grpc.Server
-	port   string
+	server  *grpc.Server
+	metrics *http.Server
+	bus     *cluster.Bus
+	tracer  *tracing.Tracer
+	port    string
 }
 
 func NewGRPCServer(config *config.Config) (*GRPCServer, error) {
+	tracer, err := tracing.NewTracer(config.Tracing)
+	if err != nil {
+		return nil, fmt.Errorf("failed to create tracer: %w", err)
+	}
+
+	options, err := transport.ServerOptions(config.GRPC)
+	if err != nil {
+		return nil, fmt.Errorf("failed to configure transport: %w", err)
+	}
+
 	var (
-		grpcServer = grpc.NewServer()
+		compressor = transport.NewCompressor(config.GRPC)
+		grpcServer = grpc.NewServer(append(options,
+			grpc.ChainUnaryInterceptor(
+				tracing.UnaryServerInterceptor(tracer),
+				compressor.UnaryServerInterceptor(),
+			),
+			grpc.StreamInterceptor(compressor.StreamServerInterceptor()),
+		)...)
 	)
 
 	repository, err := repository.NewRepository(config)
@@ -33,25 +60,96 @@ func NewGRPCServer(config *config.Config) (*GRPCServer, error) {
 		return nil, fmt.Errorf("failed to create repository: %w", err)
 	}
 
+	memberships, err := repository.GetMemberships(context.Background())
+	if err != nil {
+		return nil, fmt.Errorf("failed to load chat memberships: %w", err)
+	}
+
+	policy, err := rooms.ParsePolicy(config.Streams.OverflowPolicy)
+	if err != nil {
+		return nil, fmt.Errorf("failed to configure streams: %w", err)
+	}
+
+	index := rooms.NewIndex(memberships, rooms.QueueConfig{
+		Size:   config.Streams.QueueSize,
+		Policy: policy,
+	})
+
 	var (
-		messengerService = messenger.NewService(repository)
-		server           = server.NewServer(messengerService)
+		bus       *cluster.Bus
+		publisher messenger.Cluster
 	)
 
+	if config.Cluster.Enabled {
+		bus, err = cluster.NewBus(config.Redis)
+		if err != nil {
+			return nil, fmt.Errorf("failed to create cluster bus: %w", err)
+		}
+
+		publisher = bus
+		index.SetWatcher(bus)
+	}
+
+	var (
+		messengerService = messenger.NewService(repository, index, publisher, tracer)
+		server           = server.NewServer(messengerService, tracer)
+	)
+
+	if bus != nil {
+		if err := bus.Start(context.Background(), messengerService); err != nil {
+			return nil, fmt.Errorf("failed to start cluster bus: %w", err)
+		}
+
+		log.Printf("Cluster fan-out enabled, instance %s", bus.Instance())
+	}
+
 	generated.RegisterMessengerServer(grpcServer, server)
 
 	return &GRPCServer{
-		server: grpcServer,
-		port:   config.Port,
+		server:  grpcServer,
+		metrics: newMetricsServer(config.Streams.MetricsAddr, index),
+		bus:     bus,
+		tracer:  tracer,
+		port:    config.Port,
 	}, nil
 }
 
+func newMetricsServer(addr string, index *rooms.Index) *http.Server {
+	if addr == "" {
+		return nil
+	}
+
+	mux := http.NewServeMux()
+	mux.HandleFunc("/metrics", func(w http.ResponseWriter, _ *http.Request) {
+		w.Header().Set("Content-Type", "text/plain; version=0.0.4")
+
+		if err := index.WriteMetrics(w); err != nil {
+			log.Printf("Failed to write metrics: %v", err)
+		}
+	})
+
+	return &http.Server{
+		Addr:    addr,
+		Handler: mux,
+	}
+}
+
 func (s *GRPCServer) Start() error {
 	listener, err := net.Listen("tcp", "0.0.0.0:"+s.port)
 	if err != nil {
 		return fmt.Errorf("failed to listen on port %s: %w", s.port, err)
 	}
 
+	if s.metrics != nil {
+		go func() {
+			log.Printf("Metrics server starting on %s", s.metrics.Addr)
+
+			if err := s.metrics.ListenAndServe(); err != nil && !errors.Is(err, http.ErrServerClosed) {
+				log.Printf("Metrics server failed: %v", err)
+			}
+		}()
+	}
+
 	log.Printf("gRPC server starting on port %s", s.port)
 
 	if err := s.server.Serve(listener); err != nil {
@@ -64,6 +162,22 @@ func (s *GRPCServer) Start() error {
 func (s *GRPCServer) Stop() {
 	log.Println("Stopping gRPC server...")
 	s.server.GracefulStop()
+
+	if s.metrics != nil {
+		if err := s.metrics.Close(); err != nil {
+			log.Printf("Failed to close metrics server: %v", err)
+		}
+	}
+
+	if s.bus != nil {
+		if err := s.bus.Close(); err != nil {
+			log.Printf("Failed to close cluster bus: %v", err)
+		}
+	}
+
+	if err := s.tracer.Close(); err != nil {
+		log.Printf("Failed to close tracer: %v", err)
+	}
 }
 
 type Config struct {
@@ -0,0 +1,163 @@
+package codec
+
+import (
+	"strconv"
+	"time"
+
+	"github.com/kuzin57/grpc-chat/server/internal/entities"
+)
+
+// Field plans: hash fields of the entities in the order HMGET returns them, the names follow the redis tags
+var (
+	MessageFields  = []string{"id", "content", "nickname", "chat_id", "created_at", "seq"}
+	ChatUserFields = []string{"chat_id", "nickname", "new_messages"}
+	ChatFields     = []string{"id", "name", "created_by", "created_at", "ttl"}
+)
+
+const (
+	messageID = iota
+	messageContent
+	messageNickname
+	messageChatID
+	messageCreatedAt
+	messageSeq
+)
+
+const (
+	chatUserChatID = iota
+	chatUserNickname
+	chatUserNewMessages
+)
+
+const (
+	chatID = iota
+	chatName
+	chatCreatedBy
+	chatCreatedAt
+	chatTTL
+)
+
+// EncodeMessage returns field/value pairs of a single HSET, the same hash createMessagesScript writes
+func EncodeMessage(message *entities.Message) []any {
+	return []any{
+		"id", message.ID,
+		"content", message.Content,
+		"nickname", message.Nickname,
+		"chat_id", message.ChatID,
+		"created_at", message.CreatedAt.Format(time.RFC3339Nano),
+		"seq", strconv.FormatInt(message.Seq, 10),
+	}
+}
+
+// EncodeChatUser returns field/value pairs of a single HSET
+func EncodeChatUser(chatUser *entities.ChatUser) []any {
+	return []any{
+		"chat_id", chatUser.ChatID,
+		"nickname", chatUser.Nickname,
+		"new_messages", strconv.Itoa(chatUser.NewMessages),
+	}
+}
+
+// EncodeChat returns field/value pairs of a single HSET
+func EncodeChat(chat *entities.Chat) []any {
+	return []any{
+		"id", chat.ID,
+		"name", chat.Name,
+		"created_by", chat.CreatedBy,
+		"created_at", chat.CreatedAt.Format(time.RFC3339Nano),
+		"ttl", strconv.FormatInt(int64(chat.TTL), 10),
+	}
+}
+
+// DecodeMessage decodes an HMGET reply for MessageFields, ok is false if the hash does not exist
+func DecodeMessage(values []any) (message *entities.Message, ok bool, err error) {
+	if len(values) != len(MessageFields) || values[messageID] == nil {
+		return nil, false, nil
+	}
+
+	createdAt, err := parseTime(values[messageCreatedAt])
+	if err != nil {
+		return nil, true, err
+	}
+
+	seq, err := parseInt(values[messageSeq], 64)
+	if err != nil {
+		return nil, true, err
+	}
+
+	return &entities.Message{
+		ID:        str(values[messageID]),
+		Content:   str(values[messageContent]),
+		Nickname:  str(values[messageNickname]),
+		ChatID:    str(values[messageChatID]),
+		CreatedAt: createdAt,
+		Seq:       seq,
+	}, true, nil
+}
+
+// DecodeChatUser decodes an HMGET reply for ChatUserFields, ok is false if the hash does not exist
+func DecodeChatUser(values []any) (chatUser *entities.ChatUser, ok bool, err error) {
+	if len(values) != len(ChatUserFields) || values[chatUserChatID] == nil {
+		return nil, false, nil
+	}
+
+	newMessages, err := parseInt(values[chatUserNewMessages], 0)
+	if err != nil {
+		return nil, true, err
+	}
+
+	return &entities.ChatUser{
+		ChatID:      str(values[chatUserChatID]),
+		Nickname:    str(values[chatUserNickname]),
+		NewMessages: int(newMessages),
+	}, true, nil
+}
+
+// DecodeChat decodes an HMGET reply for ChatFields, ok is false if the chat is not registered
+func DecodeChat(values []any) (chat *entities.Chat, ok bool, err error) {
+	if len(values) != len(ChatFields) || values[chatID] == nil {
+		return nil, false, nil
+	}
+
+	createdAt, err := parseTime(values[chatCreatedAt])
+	if err != nil {
+		return nil, true, err
+	}
+
+	ttl, err := parseInt(values[chatTTL], 32)
+	if err != nil {
+		return nil, true, err
+	}
+
+	return &entities.Chat{
+		ID:        str(values[chatID]),
+		Name:      str(values[chatName]),
+		CreatedBy: str(values[chatCreatedBy]),
+		CreatedAt: createdAt,
+		TTL:       int32(ttl),
+	}, true, nil
+}
+
+// str returns the reply value, a missing field is empty
+func str(value any) string {
+	s, _ := value.(string)
+	return s
+}
+
+func parseInt(value any, bitSize int) (int64, error) {
+	s := str(value)
+	if s == "" {
+		return 0, nil
+	}
+
+	return strconv.ParseInt(s, 10, bitSize)
+}
+
+func parseTime(value any) (time.Time, error) {
+	s := str(value)
+	if s == "" {
+		return time.Time{}, nil
+	}
+
+	return time.Parse(time.RFC3339Nano, s)
+}
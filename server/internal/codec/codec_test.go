@@ -0,0 +1,367 @@
+package codec
+
+import (
+	"encoding"
+	"fmt"
+	"reflect"
+	"strconv"
+	"sync"
+	"testing"
+	"time"
+
+	"github.com/kuzin57/grpc-chat/server/internal/entities"
+)
+
+var (
+	benchChatUser = &entities.ChatUser{
+		ChatID:      "general",
+		Nickname:    "alice",
+		NewMessages: 42,
+	}
+
+	benchMessage = &entities.Message{
+		ID:        "6f1c2a9e-5b7d-4c1e-9a0b-3d2f1e4c5b6a",
+		Content:   "привет, созвон завтра в 11, посмотрю ревью до него",
+		Nickname:  "alice",
+		ChatID:    "general",
+		CreatedAt: time.Date(2025, 6, 1, 12, 30, 0, 123456789, time.UTC),
+		Seq:       123456,
+	}
+
+	benchChat = &entities.Chat{
+		ID:        "general",
+		Name:      "general",
+		CreatedBy: "alice",
+		CreatedAt: time.Date(2025, 6, 1, 12, 0, 0, 0, time.UTC),
+		TTL:       60,
+	}
+)
+
+func TestMessageRoundTrip(t *testing.T) {
+	messages := map[string]*entities.Message{
+		"full": benchMessage,
+		"empty strings": {
+			ID:        "1",
+			CreatedAt: time.Date(2025, 6, 1, 12, 30, 0, 0, time.FixedZone("MSK", 3*60*60)),
+			Seq:       1,
+		},
+		"zero": {ID: "1"},
+	}
+
+	for name, message := range messages {
+		t.Run(name, func(t *testing.T) {
+			decoded, ok, err := DecodeMessage(reply(EncodeMessage(message), MessageFields))
+			if err != nil || !ok {
+				t.Fatalf("DecodeMessage() ok = %v, err = %v", ok, err)
+			}
+
+			if !decoded.CreatedAt.Equal(message.CreatedAt) {
+				t.Errorf("CreatedAt = %v, want %v", decoded.CreatedAt, message.CreatedAt)
+			}
+
+			decoded.CreatedAt = message.CreatedAt
+			if *decoded != *message {
+				t.Errorf("DecodeMessage() = %+v, want %+v", *decoded, *message)
+			}
+		})
+	}
+}
+
+func TestChatUserRoundTrip(t *testing.T) {
+	chatUsers := map[string]*entities.ChatUser{
+		"full":          benchChatUser,
+		"empty strings": {ChatID: "general"},
+		"negative":      {ChatID: "general", Nickname: "alice", NewMessages: -1},
+	}
+
+	for name, chatUser := range chatUsers {
+		t.Run(name, func(t *testing.T) {
+			decoded, ok, err := DecodeChatUser(reply(EncodeChatUser(chatUser), ChatUserFields))
+			if err != nil || !ok {
+				t.Fatalf("DecodeChatUser() ok = %v, err = %v", ok, err)
+			}
+
+			if *decoded != *chatUser {
+				t.Errorf("DecodeChatUser() = %+v, want %+v", *decoded, *chatUser)
+			}
+		})
+	}
+}
+
+func TestDecodeMessageMissingFields(t *testing.T) {
+	// Hashes written before seq existed, or with created_at stored empty
+	for name, values := range map[string][]any{
+		"nil":   {"1", "hi", "alice", "general", nil, nil},
+		"empty": {"1", "hi", "alice", "general", "", ""},
+	} {
+		t.Run(name, func(t *testing.T) {
+			message, ok, err := DecodeMessage(values)
+			if err != nil || !ok {
+				t.Fatalf("DecodeMessage() ok = %v, err = %v", ok, err)
+			}
+
+			want := entities.Message{ID: "1", Content: "hi", Nickname: "alice", ChatID: "general"}
+			if *message != want {
+				t.Errorf("DecodeMessage() = %+v, want %+v", *message, want)
+			}
+		})
+	}
+
+	message, ok, err := DecodeMessage([]any{"1", nil, nil, nil, nil, nil})
+	if err != nil || !ok || *message != (entities.Message{ID: "1"}) {
+		t.Errorf("DecodeMessage() = %+v, %v, %v, want only the ID", message, ok, err)
+	}
+}
+
+func TestDecodeChatUserMissingFields(t *testing.T) {
+	for name, values := range map[string][]any{
+		"nil":   {"general", nil, nil},
+		"empty": {"general", "", ""},
+	} {
+		t.Run(name, func(t *testing.T) {
+			chatUser, ok, err := DecodeChatUser(values)
+			if err != nil || !ok {
+				t.Fatalf("DecodeChatUser() ok = %v, err = %v", ok, err)
+			}
+
+			if want := (entities.ChatUser{ChatID: "general"}); *chatUser != want {
+				t.Errorf("DecodeChatUser() = %+v, want %+v", *chatUser, want)
+			}
+		})
+	}
+}
+
+func TestDecodeNotFound(t *testing.T) {
+	// HMGET of a missing key returns nil for every field, a nil first field means the hash does not exist
+	for name, values := range map[string][]any{
+		"missing":      make([]any, len(MessageFields)),
+		"no id":        {nil, "hi", "alice", "general", "", "1"},
+		"short reply":  {"1", "hi"},
+		"empty reply":  nil,
+		"chat user id": {nil, "alice", "3"},
+	} {
+		t.Run(name, func(t *testing.T) {
+			if len(values) == len(ChatUserFields) {
+				if chatUser, ok, err := DecodeChatUser(values); chatUser != nil || ok || err != nil {
+					t.Errorf("DecodeChatUser() = %v, %v, %v, want not found", chatUser, ok, err)
+				}
+
+				return
+			}
+
+			if message, ok, err := DecodeMessage(values); message != nil || ok || err != nil {
+				t.Errorf("DecodeMessage() = %v, %v, %v, want not found", message, ok, err)
+			}
+		})
+	}
+}
+
+func TestDecodeMalformed(t *testing.T) {
+	for name, values := range map[string][]any{
+		"seq":        {"1", "hi", "alice", "general", "", "x"},
+		"created_at": {"1", "hi", "alice", "general", "yesterday", "1"},
+	} {
+		t.Run(name, func(t *testing.T) {
+			if _, ok, err := DecodeMessage(values); !ok || err == nil {
+				t.Errorf("DecodeMessage() ok = %v, err = %v, want an error", ok, err)
+			}
+		})
+	}
+
+	if _, ok, err := DecodeChatUser([]any{"general", "alice", "many"}); !ok || err == nil {
+		t.Errorf("DecodeChatUser() ok = %v, err = %v, want an error", ok, err)
+	}
+}
+
+// Benchmarks compare the codec with the reflection path the repository used before it.
+// Commands are only built, not sent: the old path is reproduced without go-redis as one
+// HSET per field found by reflection and a Scan of the HGETALL map by redis tags.
+
+func BenchmarkEncodeChatUser(b *testing.B) {
+	benchmarkEncode(b, benchChatUser, func() []any { return EncodeChatUser(benchChatUser) })
+}
+
+func BenchmarkEncodeMessage(b *testing.B) {
+	benchmarkEncode(b, benchMessage, func() []any { return EncodeMessage(benchMessage) })
+}
+
+func BenchmarkEncodeChat(b *testing.B) {
+	benchmarkEncode(b, benchChat, func() []any { return EncodeChat(benchChat) })
+}
+
+func BenchmarkDecodeChatUser(b *testing.B) {
+	benchmarkDecode(b, EncodeChatUser(benchChatUser), ChatUserFields, func() any { return &entities.ChatUser{} }, func(values []any) error {
+		_, _, err := DecodeChatUser(values)
+		return err
+	})
+}
+
+func BenchmarkDecodeMessage(b *testing.B) {
+	benchmarkDecode(b, EncodeMessage(benchMessage), MessageFields, func() any { return &entities.Message{} }, func(values []any) error {
+		_, _, err := DecodeMessage(values)
+		return err
+	})
+}
+
+func BenchmarkDecodeChat(b *testing.B) {
+	benchmarkDecode(b, EncodeChat(benchChat), ChatFields, func() any { return &entities.Chat{} }, func(values []any) error {
+		_, _, err := DecodeChat(values)
+		return err
+	})
+}
+
+func benchmarkEncode(b *testing.B, entity any, encode func() []any) {
+	const key = "hash:general"
+
+	b.Run("reflect", func(b *testing.B) {
+		b.ReportAllocs()
+
+		var buf []byte
+		for i := 0; i < b.N; i++ {
+			buf = buf[:0]
+			for _, cmd := range setStructCommands(key, entity) {
+				buf = appendCommand(buf, cmd)
+			}
+		}
+	})
+
+	b.Run("codec", func(b *testing.B) {
+		b.ReportAllocs()
+
+		var buf []byte
+		for i := 0; i < b.N; i++ {
+			buf = appendCommand(buf[:0], append([]any{"hset", key}, encode()...))
+		}
+	})
+}
+
+func benchmarkDecode(b *testing.B, pairs []any, fields []string, newEntity func() any, decode func([]any) error) {
+	hash := make(map[string]string, len(pairs)/2)
+	for i := 0; i < len(pairs); i += 2 {
+		hash[pairs[i].(string)] = pairs[i+1].(string)
+	}
+
+	values := reply(pairs, fields)
+
+	b.Run("scan", func(b *testing.B) {
+		b.ReportAllocs()
+
+		for i := 0; i < b.N; i++ {
+			if err := scanHash(hash, newEntity()); err != nil {
+				b.Fatal(err)
+			}
+		}
+	})
+
+	b.Run("codec", func(b *testing.B) {
+		b.ReportAllocs()
+
+		for i := 0; i < b.N; i++ {
+			if err := decode(values); err != nil {
+				b.Fatal(err)
+			}
+		}
+	})
+}
+
+// reply turns HSET pairs into the HMGET reply for fields, a field missing from pairs is nil
+func reply(pairs []any, fields []string) []any {
+	values := make([]any, len(fields))
+
+	for i, field := range fields {
+		for j := 0; j < len(pairs); j += 2 {
+			if pairs[j] == field {
+				values[i] = pairs[j+1]
+			}
+		}
+	}
+
+	return values
+}
+
+// setStructCommands is the write path the codec replaced: one HSET per field found by reflection
+func setStructCommands(key string, value any) [][]any {
+	val := reflect.ValueOf(value).Elem()
+	cmds := make([][]any, 0, val.NumField())
+
+	for i := 0; i < val.NumField(); i++ {
+		cmds = append(cmds, []any{"hset", key, val.Type().Field(i).Tag.Get("redis"), val.Field(i).Interface()})
+	}
+
+	return cmds
+}
+
+// appendCommand renders command arguments the way the go-redis writer does
+func appendCommand(buf []byte, args []any) []byte {
+	for _, arg := range args {
+		switch v := arg.(type) {
+		case string:
+			buf = append(buf, v...)
+		case int:
+			buf = strconv.AppendInt(buf, int64(v), 10)
+		case int32:
+			buf = strconv.AppendInt(buf, int64(v), 10)
+		case int64:
+			buf = strconv.AppendInt(buf, v, 10)
+		case time.Time:
+			buf = v.AppendFormat(buf, time.RFC3339Nano)
+		default:
+			buf = fmt.Append(buf, v)
+		}
+	}
+
+	return buf
+}
+
+// structFields caches redis tag -> field index per type, as go-redis does for Scan
+var structFields sync.Map
+
+// scanHash is the read path the codec replaced: the HGETALL map is set into the struct by its redis tags
+func scanHash(hash map[string]string, dst any) error {
+	val := reflect.ValueOf(dst).Elem()
+
+	cached, ok := structFields.Load(val.Type())
+	if !ok {
+		fields := make(map[string]int, val.NumField())
+		for i := 0; i < val.NumField(); i++ {
+			fields[val.Type().Field(i).Tag.Get("redis")] = i
+		}
+
+		cached, _ = structFields.LoadOrStore(val.Type(), fields)
+	}
+
+	fields := cached.(map[string]int)
+
+	for key, value := range hash {
+		i, ok := fields[key]
+		if !ok {
+			continue
+		}
+
+		field := val.Field(i)
+
+		if unmarshaler, ok := field.Addr().Interface().(encoding.TextUnmarshaler); ok {
+			if err := unmarshaler.UnmarshalText([]byte(value)); err != nil {
+				return err
+			}
+
+			continue
+		}
+
+		switch field.Kind() {
+		case reflect.String:
+			field.SetString(value)
+		case reflect.Int, reflect.Int32, reflect.Int64:
+			n, err := strconv.ParseInt(value, 10, field.Type().Bits())
+			if err != nil {
+				return err
+			}
+
+			field.SetInt(n)
+		default:
+			return fmt.Errorf("cannot scan %s into %s", key, field.Type())
+		}
+	}
+
+	return nil
+}
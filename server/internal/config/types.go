@@ -1,8 +1,51 @@
 package config
 
+import "time"
+
 type Config struct {
-	Port  string      `yaml:"port"`
-	Redis RedisConfig `yaml:"redis"`
+	Port    string        `yaml:"port"`
+	GRPC    GRPCConfig    `yaml:"grpc"`
+	Streams StreamsConfig `yaml:"streams"`
+	Cluster ClusterConfig `yaml:"cluster"`
+	Redis   RedisConfig   `yaml:"redis"`
+	Tracing TracingConfig `yaml:"tracing"`
+}
+
+// GRPCConfig tunes the transport, zero values keep grpc-go defaults
+type GRPCConfig struct {
+	// Compression of responses: "gzip", "deflate" or empty for none.
+	// Applied only to CompressedMethods and only if the client accepts it
+	Compression       string          `yaml:"compression"`
+	CompressedMethods []string        `yaml:"compressed_methods"`
+	MaxRecvMsgSize    int             `yaml:"max_recv_msg_size"`
+	MaxSendMsgSize    int             `yaml:"max_send_msg_size"`
+	WindowSize        int32           `yaml:"window_size"`
+	ConnWindowSize    int32           `yaml:"conn_window_size"`
+	Keepalive         KeepaliveConfig `yaml:"keepalive"`
+}
+
+type KeepaliveConfig struct {
+	Time    time.Duration `yaml:"time"`
+	Timeout time.Duration `yaml:"timeout"`
+	// MinTime is the shortest client ping interval tolerated before GOAWAY
+	MinTime             time.Duration `yaml:"min_time"`
+	PermitWithoutStream bool          `yaml:"permit_without_stream"`
+}
+
+// StreamsConfig bounds the outbound queue of every ChatStream connection
+type StreamsConfig struct {
+	// QueueSize is the number of frames queued for one connection, 256 if zero
+	QueueSize int `yaml:"queue_size"`
+	// OverflowPolicy for a full queue: "drop", "coalesce" (default) or "disconnect"
+	OverflowPolicy string `yaml:"overflow_policy"`
+	// MetricsAddr serves queue metrics on /metrics in the Prometheus text format, empty disables it
+	MetricsAddr string `yaml:"metrics_addr"`
+}
+
+// ClusterConfig lets several server instances share one Redis behind a load balancer
+type ClusterConfig struct {
+	// Enabled publishes broadcasts and membership changes to the other instances over Redis pub/sub
+	Enabled bool `yaml:"enabled"`
 }
 
 type RedisConfig struct {
@@ -11,3 +54,9 @@ type RedisConfig struct {
 	Password string `yaml:"password"`
 	User     string `yaml:"user"`
 }
+
+type TracingConfig struct {
+	// File receives spans as OTLP-JSON lines, empty disables tracing
+	File        string `yaml:"file"`
+	ServiceName string `yaml:"service_name"`
+}
@@ -1,5 +1,17 @@
 package entities
 
+import "time"
+
+// Chat is the registry entry of a chat
+type Chat struct {
+	ID        string    `json:"id" redis:"id"`
+	Name      string    `json:"name" redis:"name"`
+	CreatedBy string    `json:"created_by" redis:"created_by"`
+	CreatedAt time.Time `json:"created_at" redis:"created_at"`
+	// TTL of the chat messages in minutes, 0 keeps them forever
+	TTL int32 `json:"ttl" redis:"ttl"`
+}
+
 type ChatUser struct {
 	ChatID      string `json:"chat_id" redis:"chat_id"`
 	Nickname    string `json:"nickname" redis:"nickname"`
@@ -8,4 +8,5 @@ type Message struct {
 	Nickname  string    `json:"nickname" redis:"nickname"`
 	ChatID    string    `json:"chat_id" redis:"chat_id"`
 	CreatedAt time.Time `json:"created_at" redis:"created_at"`
+	Seq       int64     `json:"seq" redis:"seq"`
 }
@@ -0,0 +1,75 @@
+package repository
+
+import (
+	"sync"
+	"time"
+
+	"github.com/kuzin57/grpc-chat/server/internal/entities"
+)
+
+const (
+	// Bounds staleness of entries changed by other server instances
+	chatCacheTTL        = time.Minute
+	chatCacheMaxEntries = 10000
+)
+
+type cachedChat struct {
+	chat      *entities.Chat
+	expiresAt time.Time
+}
+
+// chatCache keeps registry entries in process, so the existence check on the send path skips Redis.
+// Only existing chats are cached: a chat created by another instance must become visible at once.
+type chatCache struct {
+	mu    sync.RWMutex
+	chats map[string]cachedChat
+}
+
+func newChatCache() *chatCache {
+	return &chatCache{
+		chats: make(map[string]cachedChat),
+	}
+}
+
+func (c *chatCache) get(chatID string) (*entities.Chat, bool) {
+	c.mu.RLock()
+	defer c.mu.RUnlock()
+
+	entry, ok := c.chats[chatID]
+	if !ok || time.Now().After(entry.expiresAt) {
+		return nil, false
+	}
+
+	return entry.chat, true
+}
+
+func (c *chatCache) put(chat *entities.Chat) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	now := time.Now()
+
+	if len(c.chats) >= chatCacheMaxEntries {
+		for chatID, entry := range c.chats {
+			if now.After(entry.expiresAt) {
+				delete(c.chats, chatID)
+			}
+		}
+
+		if len(c.chats) >= chatCacheMaxEntries {
+			clear(c.chats)
+		}
+	}
+
+	c.chats[chat.ID] = cachedChat{
+		chat:      chat,
+		expiresAt: now.Add(chatCacheTTL),
+	}
+}
+
+func (c *chatCache) invalidate(chatID string) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	delete(c.chats, chatID)
+}
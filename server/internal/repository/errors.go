@@ -3,5 +3,6 @@ package repository
 import "errors"
 
 var (
-	ErrChatNotFound = errors.New("chat not found")
+	ErrChatNotFound      = errors.New("chat not found")
+	ErrChatAlreadyExists = errors.New("chat already exists")
 )
@@ -3,10 +3,13 @@ package repository
 import (
 	"context"
 	"log"
-	"reflect"
+	"slices"
+	"strconv"
+	"strings"
 	"time"
 
 	"github.com/google/uuid"
+	"github.com/kuzin57/grpc-chat/server/internal/codec"
 	"github.com/kuzin57/grpc-chat/server/internal/config"
 	"github.com/kuzin57/grpc-chat/server/internal/entities"
 	"github.com/kuzin57/grpc-chat/server/internal/utils"
@@ -16,10 +19,17 @@ import (
 const (
 	scanChatUsersChunkSize = 100
 	chatMessagesChunkSize  = 100
+
+	// Markers of one-off backfills from chat_user keys written before the derived keys existed
+	membershipsIndexedKey = "migrations:memberships"
+	chatRegistryFilledKey = "migrations:chat_registry"
+	// Marker of the one-off indexing of message hashes written before chat_messages existed
+	messagesIndexedKey = "migrations:messages_index"
 )
 
 type Repository struct {
 	redisClient *redis.Client
+	chats       *chatCache
 }
 
 func NewRepository(config *config.Config) (*Repository, error) {
@@ -34,54 +44,83 @@ func NewRepository(config *config.Config) (*Repository, error) {
 		return nil, err
 	}
 
-	_, err = redisClient.Do(context.Background(), "CONFIG", "SET", "notify-keyspace-events", "KEA").Result()
-	if err != nil {
-		return nil, err
+	repository := &Repository{
+		redisClient: redisClient,
+		chats:       newChatCache(),
 	}
 
-	return &Repository{
-		redisClient: redisClient,
-	}, nil
-}
+	if err := repository.backfill(context.Background(), membershipsIndexedKey, indexMembership); err != nil {
+		return nil, err
+	}
 
-func setStructToKey(ctx context.Context, redisClient *redis.Client, key string, value interface{}) error {
-	val := reflect.ValueOf(value).Elem()
+	if err := repository.backfill(context.Background(), chatRegistryFilledKey, registerChat); err != nil {
+		return nil, err
+	}
 
-	settter := func(p redis.Pipeliner) error {
-		for i := range val.NumField() {
-			var (
-				field = val.Type().Field(i)
-				tag   = field.Tag.Get("redis")
-			)
+	if err := repository.indexMessages(context.Background()); err != nil {
+		return nil, err
+	}
 
-			if err := p.HSet(ctx, key, tag, val.Field(i).Interface()).Err(); err != nil {
-				return err
-			}
-		}
+	return repository, nil
+}
 
-		return nil
-	}
+type unindexedMessage struct {
+	key       string
+	id        string
+	createdAt time.Time
+}
 
-	if _, err := redisClient.Pipelined(ctx, settter); err != nil {
+// indexMessages gives message hashes without a seq, written before the per-chat index existed,
+// seqs in created_at order and adds them to the chat index, once per Redis
+func (r *Repository) indexMessages(ctx context.Context) error {
+	done, err := r.redisClient.Exists(ctx, messagesIndexedKey).Result()
+	if err != nil || done > 0 {
 		return err
 	}
 
-	return nil
-}
-
-func lookupByKeyPattern[T any](ctx context.Context, redisClient *redis.Client, pattern string) ([]*T, error) {
 	var (
-		allKeys []string
-		cursor  uint64
+		cursor uint64
+		byChat = make(map[string][]unindexedMessage)
 	)
 
 	for {
-		keys, nextCursor, err := redisClient.Scan(ctx, cursor, pattern, scanChatUsersChunkSize).Result()
+		keys, nextCursor, err := r.redisClient.Scan(ctx, cursor, utils.BuildChatMessageKey("*", "*"), chatMessagesChunkSize).Result()
 		if err != nil {
-			return nil, err
+			return err
+		}
+
+		cmds := make([]*redis.SliceCmd, len(keys))
+
+		_, err = r.redisClient.Pipelined(ctx, func(p redis.Pipeliner) error {
+			for i, key := range keys {
+				cmds[i] = p.HMGet(ctx, key, codec.MessageFields...)
+			}
+
+			return nil
+		})
+		if err != nil {
+			return err
+		}
+
+		for i, cmd := range cmds {
+			message, ok, err := codec.DecodeMessage(cmd.Val())
+			if err != nil {
+				log.Println("Skipping message", keys[i], "error", err)
+				continue
+			}
+
+			// Expired meanwhile or already written with a seq
+			if !ok || message.Seq > 0 {
+				continue
+			}
+
+			byChat[message.ChatID] = append(byChat[message.ChatID], unindexedMessage{
+				key:       keys[i],
+				id:        message.ID,
+				createdAt: message.CreatedAt,
+			})
 		}
 
-		allKeys = append(allKeys, keys...)
 		cursor = nextCursor
 
 		if cursor == 0 {
@@ -89,94 +128,231 @@ func lookupByKeyPattern[T any](ctx context.Context, redisClient *redis.Client, p
 		}
 	}
 
-	if len(allKeys) == 0 {
-		return nil, nil
+	indexed := 0
+
+	for chatID, messages := range byChat {
+		if err := r.indexChatMessages(ctx, chatID, messages); err != nil {
+			return err
+		}
+
+		indexed += len(messages)
 	}
 
-	result := make([]*T, 0, len(allKeys))
-	for _, key := range allKeys {
-		var value T
+	log.Println("Indexed", indexed, "messages of", len(byChat), "chats")
 
-		err := redisClient.HGetAll(ctx, key).Scan(&value)
-		if err != nil {
-			log.Println("Error getting value from key", key, "error", err)
+	return r.redisClient.Set(ctx, messagesIndexedKey, 1, 0).Err()
+}
 
-			continue
+// indexChatMessages reserves seqs after the current counter, so they never collide with messages written since
+func (r *Repository) indexChatMessages(ctx context.Context, chatID string, messages []unindexedMessage) error {
+	slices.SortFunc(messages, func(a, b unindexedMessage) int {
+		if c := a.createdAt.Compare(b.createdAt); c != 0 {
+			return c
 		}
 
-		result = append(result, &value)
+		return strings.Compare(a.id, b.id)
+	})
+
+	lastSeq, err := r.redisClient.IncrBy(ctx, utils.BuildChatMessageSeqKey(chatID), int64(len(messages))).Result()
+	if err != nil {
+		return err
 	}
 
-	return result, nil
+	firstSeq := lastSeq - int64(len(messages)) + 1
+
+	for start := 0; start < len(messages); start += chatMessagesChunkSize {
+		chunk := messages[start:min(start+chatMessagesChunkSize, len(messages))]
+
+		_, err := r.redisClient.Pipelined(ctx, func(p redis.Pipeliner) error {
+			for i, message := range chunk {
+				seq := firstSeq + int64(start+i)
+
+				p.HSet(ctx, message.key, "seq", seq)
+				p.ZAdd(ctx, utils.BuildChatMessagesIndexKey(chatID), redis.Z{Score: float64(seq), Member: message.id})
+			}
+
+			return nil
+		})
+		if err != nil {
+			return err
+		}
+	}
+
+	return nil
 }
 
-func (r *Repository) GetChat(ctx context.Context, chatID string) (string, error) {
-	var (
-		chatKeys []string
-		cursor   uint64
-		err      error
-	)
+// indexMembership fills user_chats and chat_members sets
+func indexMembership(ctx context.Context, p redis.Pipeliner, chatID, nickname string) {
+	p.SAdd(ctx, utils.BuildUserChatsKey(nickname), chatID)
+	p.SAdd(ctx, utils.BuildChatMembersKey(chatID), nickname)
+}
+
+// registerChat adds a registry entry for chats created before the registry, their ID is the name
+func registerChat(ctx context.Context, p redis.Pipeliner, chatID, _ string) {
+	key := utils.BuildChatKey(chatID)
+
+	p.HSetNX(ctx, key, "id", chatID)
+	p.HSetNX(ctx, key, "name", chatID)
+}
+
+// backfill walks existing chat_user keys once per Redis and lets fill derive new keys from them,
+// later writes keep the derived keys up to date
+func (r *Repository) backfill(
+	ctx context.Context,
+	marker string,
+	fill func(ctx context.Context, p redis.Pipeliner, chatID, nickname string),
+) error {
+	done, err := r.redisClient.Exists(ctx, marker).Result()
+	if err != nil || done > 0 {
+		return err
+	}
+
+	var cursor uint64
 
 	for {
-		chatKeys, cursor, err = r.redisClient.Scan(ctx, cursor, utils.BuildChatUserPatternByChat(chatID), 1).Result()
+		keys, nextCursor, err := r.redisClient.Scan(ctx, cursor, utils.BuildChatUserPatternByUser("*"), scanChatUsersChunkSize).Result()
 		if err != nil {
-			return "", err
+			return err
 		}
 
-		if cursor == 0 || len(chatKeys) > 0 {
+		_, err = r.redisClient.Pipelined(ctx, func(p redis.Pipeliner) error {
+			for _, key := range keys {
+				fill(ctx, p, utils.ExtractChatIDFromChatUserKey(key), utils.ExtractNicknameFromChatUserKey(key))
+			}
+
+			return nil
+		})
+		if err != nil {
+			return err
+		}
+
+		cursor = nextCursor
+
+		if cursor == 0 {
 			break
 		}
 	}
 
-	if len(chatKeys) == 0 {
-		return "", ErrChatNotFound
-	}
+	log.Println("Backfilled", marker)
 
-	return utils.ExtractChatIDFromChatUserKey(chatKeys[0]), nil
+	return r.redisClient.Set(ctx, marker, 1, 0).Err()
 }
 
-func (r *Repository) CreateChat(ctx context.Context, chatID, nickname string) (string, error) {
-	key := utils.BuildChatUserKey(chatID, nickname)
+// addChatUser writes the membership hash and both membership sets in one transaction,
+// so the message write script never sees a member without its hash
+func (r *Repository) addChatUser(ctx context.Context, chatUser *entities.ChatUser) error {
+	_, err := r.redisClient.TxPipelined(ctx, func(p redis.Pipeliner) error {
+		p.HSet(ctx, utils.BuildChatUserKey(chatUser.ChatID, chatUser.Nickname), codec.EncodeChatUser(chatUser)...)
+		p.SAdd(ctx, utils.BuildUserChatsKey(chatUser.Nickname), chatUser.ChatID)
+		p.SAdd(ctx, utils.BuildChatMembersKey(chatUser.ChatID), chatUser.Nickname)
 
-	if err := setStructToKey(ctx, r.redisClient, key, &entities.ChatUser{
-		ChatID:   chatID,
-		Nickname: nickname,
-	}); err != nil {
-		return "", err
-	}
+		return nil
+	})
 
-	return chatID, nil
+	return err
 }
 
-func (r *Repository) AddUserToChat(ctx context.Context, chatID, nickname string) error {
-	log.Println("Adding user to chat", chatID, "nickname", nickname)
+// GetChat returns the registry entry of the chat, from the in-process cache when possible
+func (r *Repository) GetChat(ctx context.Context, chatID string) (*entities.Chat, error) {
+	if chat, ok := r.chats.get(chatID); ok {
+		return chat, nil
+	}
 
+	chats, err := r.GetChats(ctx, []string{chatID})
+	if err != nil {
+		return nil, err
+	}
+
+	chat, ok := chats[chatID]
+	if !ok {
+		return nil, ErrChatNotFound
+	}
+
+	return chat, nil
+}
+
+// GetChats returns registry entries of existing chats, reading cache misses in one pipeline
+func (r *Repository) GetChats(ctx context.Context, chatIDs []string) (map[string]*entities.Chat, error) {
 	var (
-		chatKeys []string
-		cursor   uint64
-		err      error
+		result = make(map[string]*entities.Chat, len(chatIDs))
+		missed []string
 	)
 
-	for {
-		chatKeys, cursor, err = r.redisClient.Scan(ctx, cursor, utils.BuildChatUserPatternByChat(chatID), 1).Result()
-		if err != nil {
-			return err
+	for _, chatID := range chatIDs {
+		if chat, ok := r.chats.get(chatID); ok {
+			result[chatID] = chat
+		} else {
+			missed = append(missed, chatID)
 		}
+	}
 
-		if cursor == 0 {
-			break
+	if len(missed) == 0 {
+		return result, nil
+	}
+
+	cmds := make([]*redis.SliceCmd, len(missed))
+
+	_, err := r.redisClient.Pipelined(ctx, func(p redis.Pipeliner) error {
+		for i, chatID := range missed {
+			cmds[i] = p.HMGet(ctx, utils.BuildChatKey(chatID), codec.ChatFields...)
 		}
 
-		if len(chatKeys) > 0 {
-			break
+		return nil
+	})
+	if err != nil {
+		return nil, err
+	}
+
+	for i, cmd := range cmds {
+		chat, ok, err := codec.DecodeChat(cmd.Val())
+		if err != nil {
+			return nil, err
 		}
+
+		if !ok {
+			continue
+		}
+
+		r.chats.put(chat)
+		result[missed[i]] = chat
 	}
 
-	if len(chatKeys) == 0 {
-		return ErrChatNotFound
+	return result, nil
+}
+
+// CreateChat registers the chat and makes its creator the first member.
+// Returns ErrChatAlreadyExists if the chat ID is taken.
+func (r *Repository) CreateChat(ctx context.Context, chat *entities.Chat) error {
+	created, err := createChatScript.Run(ctx, r.redisClient, []string{utils.BuildChatKey(chat.ID)}, codec.EncodeChat(chat)...).Bool()
+	if err != nil {
+		return err
 	}
 
-	err = setStructToKey(ctx, r.redisClient, utils.BuildChatUserKey(chatID, nickname), &entities.ChatUser{
+	if !created {
+		return ErrChatAlreadyExists
+	}
+
+	r.chats.put(chat)
+
+	return r.addChatUser(ctx, &entities.ChatUser{
+		ChatID:   chat.ID,
+		Nickname: chat.CreatedBy,
+	})
+}
+
+// InvalidateChat drops the cached registry entry after it was changed elsewhere
+func (r *Repository) InvalidateChat(chatID string) {
+	r.chats.invalidate(chatID)
+}
+
+func (r *Repository) AddUserToChat(ctx context.Context, chatID, nickname string) error {
+	log.Println("Adding user to chat", chatID, "nickname", nickname)
+
+	if _, err := r.GetChat(ctx, chatID); err != nil {
+		return err
+	}
+
+	err := r.addChatUser(ctx, &entities.ChatUser{
 		ChatID:      chatID,
 		Nickname:    nickname,
 		NewMessages: 0,
@@ -191,128 +367,349 @@ func (r *Repository) AddUserToChat(ctx context.Context, chatID, nickname string)
 }
 
 func (r *Repository) RemoveUserFromChat(ctx context.Context, chatID, nickname string) error {
-	_, err := r.redisClient.Del(ctx, utils.BuildChatUserKey(chatID, nickname)).Result()
-	if err != nil {
-		return err
-	}
+	_, err := r.redisClient.TxPipelined(ctx, func(p redis.Pipeliner) error {
+		p.Del(ctx, utils.BuildChatUserKey(chatID, nickname))
+		p.SRem(ctx, utils.BuildUserChatsKey(nickname), chatID)
+		p.SRem(ctx, utils.BuildChatMembersKey(chatID), nickname)
 
-	return nil
+		return nil
+	})
+
+	return err
 }
 
+// GetUserChats reads the user's chat index, cost depends on the user's chat count only
 func (r *Repository) GetUserChats(ctx context.Context, nickname string) ([]string, error) {
-	chatKeys, _, err := r.redisClient.Scan(ctx, 0, utils.BuildChatUserPatternByUser(nickname), 100).Result()
+	chats, err := r.redisClient.SMembers(ctx, utils.BuildUserChatsKey(nickname)).Result()
 	if err != nil {
 		return nil, err
 	}
 
-	return utils.MapSlice(chatKeys, utils.ExtractChatIDFromChatUserKey), nil
+	slices.Sort(chats)
+
+	return chats, nil
 }
 
-func (r *Repository) GetChatsUsers(ctx context.Context, nickname string, chatsIDs []string) (map[string]*entities.ChatUser, error) {
-	keys := make(map[string]string)
-	for _, chatID := range chatsIDs {
-		keys[chatID] = utils.BuildChatUserKey(chatID, nickname)
-	}
+// GetMemberships returns members of all chats, walking chat_members sets once at startup
+func (r *Repository) GetMemberships(ctx context.Context) (map[string][]string, error) {
+	var (
+		result = make(map[string][]string)
+		cursor uint64
+	)
 
-	result := make(map[string]*entities.ChatUser)
+	for {
+		keys, nextCursor, err := r.redisClient.Scan(ctx, cursor, utils.BuildChatMembersKey("*"), scanChatUsersChunkSize).Result()
+		if err != nil {
+			return nil, err
+		}
 
-	for chatID, key := range keys {
-		var chatUser entities.ChatUser
+		cmds := make([]*redis.StringSliceCmd, len(keys))
 
-		err := r.redisClient.HGetAll(ctx, key).Scan(&chatUser)
+		_, err = r.redisClient.Pipelined(ctx, func(p redis.Pipeliner) error {
+			for i, key := range keys {
+				cmds[i] = p.SMembers(ctx, key)
+			}
+
+			return nil
+		})
 		if err != nil {
 			return nil, err
 		}
 
-		result[chatID] = &chatUser
+		for i, cmd := range cmds {
+			result[utils.ExtractChatIDFromChatMembersKey(keys[i])] = cmd.Val()
+		}
+
+		cursor = nextCursor
+
+		if cursor == 0 {
+			break
+		}
 	}
 
 	return result, nil
 }
 
-func (r *Repository) CreateMessage(ctx context.Context, message entities.Message) (string, error) {
-	message.ID = uuid.NewString()
+// GetChatsUsers reads the user's membership hashes of all chats in one pipeline
+func (r *Repository) GetChatsUsers(ctx context.Context, nickname string, chatsIDs []string) (map[string]*entities.ChatUser, error) {
+	chatUsers, err := r.getChatUsers(ctx, utils.MapSlice(chatsIDs, func(chatID string) string {
+		return utils.BuildChatUserKey(chatID, nickname)
+	}))
+	if err != nil {
+		return nil, err
+	}
+
+	result := make(map[string]*entities.ChatUser, len(chatUsers))
+	for _, chatUser := range chatUsers {
+		result[chatUser.ChatID] = chatUser
+	}
+
+	return result, nil
+}
+
+// getChatUsers reads membership hashes in one pipeline, skipping keys that no longer exist
+func (r *Repository) getChatUsers(ctx context.Context, keys []string) ([]*entities.ChatUser, error) {
+	if len(keys) == 0 {
+		return nil, nil
+	}
+
+	cmds := make([]*redis.SliceCmd, len(keys))
 
-	err := setStructToKey(ctx, r.redisClient, utils.BuildChatMessageKey(message.ChatID, message.ID), &message)
+	_, err := r.redisClient.Pipelined(ctx, func(p redis.Pipeliner) error {
+		for i, key := range keys {
+			cmds[i] = p.HMGet(ctx, key, codec.ChatUserFields...)
+		}
+
+		return nil
+	})
 	if err != nil {
-		return "", err
+		return nil, err
+	}
+
+	result := make([]*entities.ChatUser, 0, len(keys))
+
+	for _, cmd := range cmds {
+		chatUser, ok, err := codec.DecodeChatUser(cmd.Val())
+		if err != nil {
+			return nil, err
+		}
+
+		// Set entry without the membership hash: the user has just left the chat
+		if !ok {
+			continue
+		}
+
+		result = append(result, chatUser)
 	}
 
-	chatUsers, err := r.GetUsersByChatID(ctx, message.ChatID)
+	return result, nil
+}
+
+func (r *Repository) CreateMessage(ctx context.Context, message entities.Message) (entities.Message, error) {
+	messages, err := r.CreateMessages(ctx, []entities.Message{message})
 	if err != nil {
-		return "", err
+		return entities.Message{}, err
 	}
 
-	for _, user := range chatUsers {
-		if user.Nickname != message.Nickname {
-			user.NewMessages++
+	return messages[0], nil
+}
 
-			err := setStructToKey(ctx, r.redisClient, utils.BuildChatUserKey(message.ChatID, user.Nickname), user)
-			if err != nil {
-				return "", err
-			}
+// CreateMessages stores a batch of messages of one chat in one server-side step:
+// seq reservation, message hashes, index entries and unread counters of all
+// members are written by createMessagesScript atomically.
+func (r *Repository) CreateMessages(ctx context.Context, messages []entities.Message) ([]entities.Message, error) {
+	if len(messages) == 0 {
+		return nil, nil
+	}
+
+	chatID := messages[0].ChatID
+
+	var (
+		keys = []string{
+			utils.BuildChatMessageSeqKey(chatID),
+			utils.BuildChatMessagesIndexKey(chatID),
+			utils.BuildChatMembersKey(chatID),
+			utils.BuildChatKey(chatID),
 		}
+		args = make([]any, 0, 3+len(messages)*createMessagesScriptFields)
+	)
+
+	args = append(args, utils.BuildChatMessageKey(chatID, ""), utils.BuildChatUserKey(chatID, ""), chatID)
+
+	for i := range messages {
+		messages[i].ID = uuid.NewString()
+
+		args = append(args,
+			messages[i].ID,
+			messages[i].Content,
+			messages[i].Nickname,
+			messages[i].CreatedAt.Format(time.RFC3339Nano),
+		)
+	}
+
+	lastSeq, err := createMessagesScript.Run(ctx, r.redisClient, keys, args...).Int64()
+	if err != nil {
+		return nil, err
 	}
 
-	return message.ID, nil
+	firstSeq := lastSeq - int64(len(messages)) + 1
+	for i := range messages {
+		messages[i].Seq = firstSeq + int64(i)
+	}
+
+	return messages, nil
 }
 
-func (r *Repository) GetMessages(ctx context.Context, chatID string) ([]*entities.Message, error) {
-	return lookupByKeyPattern[entities.Message](ctx, r.redisClient, utils.BuildChatMessagePatternByChat(chatID))
+// GetMessages returns a page of at most limit messages ordered by seq.
+// With after set the page starts right after it, otherwise it is the newest page
+// below before (or the newest page of the chat). Zero before/after means unbounded.
+func (r *Repository) GetMessages(ctx context.Context, chatID string, limit int, before, after int64) ([]*entities.Message, bool, error) {
+	rangeBy := &redis.ZRangeBy{
+		Min:   "-inf",
+		Max:   "+inf",
+		Count: int64(limit + 1),
+	}
+
+	if after > 0 {
+		rangeBy.Min = "(" + strconv.FormatInt(after, 10)
+	}
+
+	if before > 0 {
+		rangeBy.Max = "(" + strconv.FormatInt(before, 10)
+	}
+
+	var (
+		key = utils.BuildChatMessagesIndexKey(chatID)
+		ids []string
+		err error
+	)
+
+	if after > 0 {
+		ids, err = r.redisClient.ZRangeByScore(ctx, key, rangeBy).Result()
+	} else {
+		ids, err = r.redisClient.ZRevRangeByScore(ctx, key, rangeBy).Result()
+	}
+
+	if err != nil {
+		return nil, false, err
+	}
+
+	hasMore := len(ids) > limit
+	if hasMore {
+		ids = ids[:limit]
+	}
+
+	if after == 0 {
+		slices.Reverse(ids)
+	}
+
+	messages, err := r.getMessagesByIDs(ctx, chatID, ids)
+	if err != nil {
+		return nil, false, err
+	}
+
+	return messages, hasMore, nil
 }
 
-func (r *Repository) SetMessagesRead(ctx context.Context, chatID, nickname string) error {
-	chatUser := entities.ChatUser{
-		ChatID:   chatID,
-		Nickname: nickname,
+func (r *Repository) getMessagesByIDs(ctx context.Context, chatID string, ids []string) ([]*entities.Message, error) {
+	if len(ids) == 0 {
+		return nil, nil
 	}
 
-	err := setStructToKey(ctx, r.redisClient, utils.BuildChatUserKey(chatID, nickname), &chatUser)
+	cmds := make([]*redis.SliceCmd, len(ids))
+
+	_, err := r.redisClient.Pipelined(ctx, func(p redis.Pipeliner) error {
+		for i, id := range ids {
+			cmds[i] = p.HMGet(ctx, utils.BuildChatMessageKey(chatID, id), codec.MessageFields...)
+		}
+
+		return nil
+	})
 	if err != nil {
-		return err
+		return nil, err
 	}
 
-	return nil
+	var (
+		result  = make([]*entities.Message, 0, len(ids))
+		expired []any
+	)
+
+	for i, cmd := range cmds {
+		message, ok, err := codec.DecodeMessage(cmd.Val())
+		if err != nil {
+			log.Println("Error getting message", ids[i], "error", err)
+
+			continue
+		}
+
+		// Message hash is gone because of chat TTL while the index still lists it
+		if !ok {
+			expired = append(expired, ids[i])
+			continue
+		}
+
+		result = append(result, message)
+	}
+
+	if len(expired) > 0 {
+		if err := r.redisClient.ZRem(ctx, utils.BuildChatMessagesIndexKey(chatID), expired...).Err(); err != nil {
+			log.Println("Error trimming expired messages of chat", chatID, "error", err)
+		}
+	}
+
+	return result, nil
 }
 
-func (r *Repository) GetUsersByChatID(ctx context.Context, chatID string) ([]*entities.ChatUser, error) {
-	return lookupByKeyPattern[entities.ChatUser](ctx, r.redisClient, utils.BuildChatUserPatternByChat(chatID))
+// SetMessagesRead resets only the counter, so it cannot overwrite increments made meanwhile by CreateMessages
+func (r *Repository) SetMessagesRead(ctx context.Context, chatID, nickname string) error {
+	return r.redisClient.HSet(ctx, utils.BuildChatUserKey(chatID, nickname), chatUserNewMessagesField, 0).Err()
 }
 
-// TTL in minutes
+// SetTTLToChat stores the chat retention policy in minutes, 0 removes it. New messages get
+// the TTL on write; existing history is updated walking the chat index in pipelined batches.
 func (r *Repository) SetTTLToChat(ctx context.Context, chatID string, ttl int32) error {
+	chatKey := utils.BuildChatKey(chatID)
+
+	var err error
+	if ttl > 0 {
+		err = r.redisClient.HSet(ctx, chatKey, chatTTLField, ttl).Err()
+	} else {
+		err = r.redisClient.HDel(ctx, chatKey, chatTTLField).Err()
+	}
+
+	r.chats.invalidate(chatID)
+
+	if err != nil {
+		return err
+	}
+
 	var (
-		messageKeys []string
-		cursor      uint64
+		indexKey = utils.BuildChatMessagesIndexKey(chatID)
+		cursor   int64
+		updated  int
 	)
 
+	// Paging by seq rather than by rank: trimming expired index entries does not shift the walk
 	for {
-		keys, nextCursor, err := r.redisClient.Scan(ctx, cursor, utils.BuildChatMessagePatternByChat(chatID), chatMessagesChunkSize).Result()
+		members, err := r.redisClient.ZRangeByScoreWithScores(ctx, indexKey, &redis.ZRangeBy{
+			Min:   "(" + strconv.FormatInt(cursor, 10),
+			Max:   "+inf",
+			Count: chatMessagesChunkSize,
+		}).Result()
 		if err != nil {
 			return err
 		}
 
-		messageKeys = append(messageKeys, keys...)
-
-		if cursor == 0 {
+		if len(members) == 0 {
 			break
 		}
 
-		cursor = nextCursor
-	}
+		_, err = r.redisClient.Pipelined(ctx, func(p redis.Pipeliner) error {
+			for _, member := range members {
+				key := utils.BuildChatMessageKey(chatID, member.Member.(string))
 
-	if len(messageKeys) == 0 {
-		return nil
-	}
+				if ttl > 0 {
+					p.Expire(ctx, key, time.Duration(ttl)*time.Minute)
+				} else {
+					p.Persist(ctx, key)
+				}
+			}
 
-	for _, messageKey := range messageKeys {
-		_, err := r.redisClient.Expire(ctx, messageKey, time.Duration(ttl)*time.Minute).Result()
+			return nil
+		})
 		if err != nil {
 			return err
 		}
+
+		updated += len(members)
+		cursor = int64(members[len(members)-1].Score)
+
+		if len(members) < chatMessagesChunkSize {
+			break
+		}
 	}
 
-	log.Println("Set TTL to chat", chatID, "ttl", ttl)
+	log.Println("Set TTL to chat", chatID, "ttl", ttl, "messages", updated)
 
 	return nil
 }
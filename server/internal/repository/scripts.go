@@ -0,0 +1,68 @@
+package repository
+
+import "github.com/redis/go-redis/v9"
+
+const (
+	chatUserNewMessagesField = "new_messages"
+	chatTTLField             = "ttl"
+
+	// id, content, nickname, created_at per message in createMessagesScript ARGV
+	createMessagesScriptFields = 4
+)
+
+// createMessagesScript stores a batch of messages of one chat and bumps the unread
+// counters of its members in a single atomic step. Message hashes get the chat TTL
+// policy from the registry, so retention also covers messages sent after it was set.
+//
+// KEYS: seq counter, messages index, members set, chat registry hash.
+// ARGV: message key prefix, chat_user key prefix, chat ID, then per message
+// id, content, nickname, created_at. Hash fields are codec.MessageFields,
+// written with one HSET per message. Returns the seq of the last message.
+var createMessagesScript = redis.NewScript(`
+local count = (#ARGV - 3) / 4
+local ttl = tonumber(redis.call('HGET', KEYS[4], 'ttl') or '0')
+local lastSeq = redis.call('INCRBY', KEYS[1], count)
+local firstSeq = lastSeq - count + 1
+local sent = {}
+
+for i = 0, count - 1 do
+	local base = 4 + i * 4
+	local id, nickname, seq = ARGV[base], ARGV[base + 2], firstSeq + i
+
+	redis.call('HSET', ARGV[1] .. id,
+		'id', id,
+		'content', ARGV[base + 1],
+		'nickname', nickname,
+		'chat_id', ARGV[3],
+		'created_at', ARGV[base + 3],
+		'seq', seq)
+	if ttl > 0 then
+		redis.call('EXPIRE', ARGV[1] .. id, ttl * 60)
+	end
+	redis.call('ZADD', KEYS[2], seq, id)
+
+	sent[nickname] = (sent[nickname] or 0) + 1
+end
+
+for _, member in ipairs(redis.call('SMEMBERS', KEYS[3])) do
+	local unread = count - (sent[member] or 0)
+	if unread > 0 then
+		redis.call('HINCRBY', ARGV[2] .. member, 'new_messages', unread)
+	end
+end
+
+return lastSeq
+`)
+
+// createChatScript writes the chat registry hash unless the chat already exists.
+//
+// KEYS: chat registry key. ARGV: field/value pairs. Returns 1 if created, 0 otherwise.
+var createChatScript = redis.NewScript(`
+if redis.call('EXISTS', KEYS[1]) == 1 then
+	return 0
+end
+
+redis.call('HSET', KEYS[1], unpack(ARGV))
+
+return 1
+`)
@@ -0,0 +1,383 @@
+package rooms
+
+import (
+	"context"
+	"fmt"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/kuzin57/grpc-chat/server/internal/generated"
+	"google.golang.org/grpc/codes"
+	"google.golang.org/grpc/status"
+)
+
+// OverflowPolicy decides what Offer does when the connection queue is full
+type OverflowPolicy string
+
+const (
+	// PolicyDrop drops the new frame, the client gets the messages on its next resync or reconnect
+	PolicyDrop OverflowPolicy = "drop"
+	// PolicyCoalesce merges the new message into the last queued message frame of the chat,
+	// drops presence events and disconnects the client if a message still does not fit
+	PolicyCoalesce OverflowPolicy = "coalesce"
+	// PolicyDisconnect closes the stream, the client reconnects and resumes from its last seq
+	PolicyDisconnect OverflowPolicy = "disconnect"
+
+	DefaultQueueSize = 256
+
+	// Coalesced batch is capped like a client MESSAGE_BATCH
+	maxCoalescedBatch = 500
+
+	// How long closing a connection waits for a writer stuck in Send. A client that stopped
+	// reading keeps Send blocked until the stream context ends, which needs the handler to return.
+	writerStopTimeout = 10 * time.Second
+)
+
+func ParsePolicy(name string) (OverflowPolicy, error) {
+	switch policy := OverflowPolicy(name); policy {
+	case "":
+		return PolicyCoalesce, nil
+	case PolicyDrop, PolicyCoalesce, PolicyDisconnect:
+		return policy, nil
+	default:
+		return "", fmt.Errorf("unknown overflow policy %q", name)
+	}
+}
+
+// OfferResult is what happened to a frame offered to a connection
+type OfferResult string
+
+const (
+	Queued       OfferResult = "queued"
+	Coalesced    OfferResult = "coalesced"
+	Dropped      OfferResult = "dropped"
+	Disconnected OfferResult = "disconnected"
+)
+
+var (
+	ErrSlowConsumer     = status.Error(codes.ResourceExhausted, "outbound queue overflow, reconnect and resume")
+	ErrConnectionClosed = status.Error(codes.Unavailable, "connection closed")
+)
+
+// Connection owns a registered stream: frames go through a bounded queue drained by a
+// single writer goroutine, so Send is never called concurrently and a slow client only
+// holds up its own writer
+type Connection struct {
+	id     uint64
+	stream generated.Messenger_ChatStreamServer
+	size   int
+	policy OverflowPolicy
+	stats  *Stats
+
+	mu        sync.Mutex
+	frames    []*generated.ChatMessage
+	nicknames map[string]struct{}
+	closed    bool
+	err       error
+
+	wake  chan struct{} // frame queued, for the writer
+	space chan struct{} // frame taken, for a blocked Send
+	done  chan struct{}
+	// Closed once the writer has returned and will not call Send again
+	writerDone chan struct{}
+
+	sent      atomic.Int64
+	dropped   atomic.Int64
+	coalesced atomic.Int64
+}
+
+func newConnection(id uint64, stream generated.Messenger_ChatStreamServer, size int, policy OverflowPolicy, stats *Stats) *Connection {
+	c := &Connection{
+		id:         id,
+		stream:     stream,
+		size:       size,
+		policy:     policy,
+		stats:      stats,
+		nicknames:  make(map[string]struct{}),
+		wake:       make(chan struct{}, 1),
+		space:      make(chan struct{}, 1),
+		done:       make(chan struct{}),
+		writerDone: make(chan struct{}),
+	}
+
+	go c.write()
+
+	return c
+}
+
+// ID identifies the session, a user connected from several devices has one per device
+func (c *Connection) ID() uint64 {
+	return c.id
+}
+
+// Nicknames returns the users registered on the session
+func (c *Connection) Nicknames() []string {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	nicknames := make([]string, 0, len(c.nicknames))
+	for nickname := range c.nicknames {
+		nicknames = append(nicknames, nickname)
+	}
+
+	return nicknames
+}
+
+// attach registers the user on the session unless it is already closed
+func (c *Connection) attach(nickname string) bool {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	if c.closed {
+		return false
+	}
+
+	c.nicknames[nickname] = struct{}{}
+
+	return true
+}
+
+// Send queues a reply of the stream's own handler (history replay, acks), waiting for room instead of applying the policy
+func (c *Connection) Send(ctx context.Context, frame *generated.ChatMessage) error {
+	for {
+		c.mu.Lock()
+
+		if c.closed {
+			c.mu.Unlock()
+			return c.Err()
+		}
+
+		if len(c.frames) < c.size {
+			c.push(frame)
+			c.mu.Unlock()
+			c.stats.frames(Queued)
+
+			return nil
+		}
+
+		c.mu.Unlock()
+
+		select {
+		case <-c.space:
+		case <-c.done:
+		case <-ctx.Done():
+			return ctx.Err()
+		}
+	}
+}
+
+// Offer queues a broadcast frame without waiting, applying the overflow policy when the queue is full
+func (c *Connection) Offer(frame *generated.ChatMessage) OfferResult {
+	result := c.offer(frame)
+
+	switch result {
+	case Dropped:
+		c.dropped.Add(1)
+	case Coalesced:
+		c.coalesced.Add(1)
+	case Disconnected:
+		c.Close(ErrSlowConsumer)
+	}
+
+	c.stats.frames(result)
+
+	return result
+}
+
+func (c *Connection) offer(frame *generated.ChatMessage) OfferResult {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	if c.closed {
+		return Dropped
+	}
+
+	if len(c.frames) < c.size {
+		c.push(frame)
+		return Queued
+	}
+
+	switch c.policy {
+	case PolicyDrop:
+		return Dropped
+	case PolicyCoalesce:
+		if c.coalesce(frame) {
+			return Coalesced
+		}
+
+		if !isMessageFrame(frame) && frame.Type != generated.ChatMessageType_SET_TTL_TO_CHAT {
+			return Dropped
+		}
+	}
+
+	return Disconnected
+}
+
+// coalesce replaces the last queued frame of the chat with a MESSAGE_BATCH holding it and the new
+// messages. Queued frames are shared between recipients, so they are never modified in place.
+func (c *Connection) coalesce(frame *generated.ChatMessage) bool {
+	if !isMessageFrame(frame) {
+		return false
+	}
+
+	for i := len(c.frames) - 1; i >= 0; i-- {
+		queued := c.frames[i]
+		if queued.ChatId != frame.ChatId {
+			continue
+		}
+
+		if !isMessageFrame(queued) {
+			return false
+		}
+
+		items := append(batchItems(queued), batchItems(frame)...)
+		if len(items) > maxCoalescedBatch {
+			return false
+		}
+
+		c.frames[i] = &generated.ChatMessage{
+			Nickname:  frame.Nickname,
+			ChatId:    frame.ChatId,
+			CreatedAt: queued.CreatedAt,
+			Type:      generated.ChatMessageType_MESSAGE_BATCH,
+			Seq:       frame.Seq,
+			Batch:     items,
+			TraceId:   frame.TraceId,
+			SpanId:    frame.SpanId,
+		}
+
+		return true
+	}
+
+	return false
+}
+
+func isMessageFrame(frame *generated.ChatMessage) bool {
+	return frame.Type == generated.ChatMessageType_MESSAGE || frame.Type == generated.ChatMessageType_MESSAGE_BATCH
+}
+
+func batchItems(frame *generated.ChatMessage) []*generated.ChatMessage {
+	if frame.Type == generated.ChatMessageType_MESSAGE_BATCH {
+		return append([]*generated.ChatMessage(nil), frame.Batch...)
+	}
+
+	return []*generated.ChatMessage{frame}
+}
+
+func (c *Connection) push(frame *generated.ChatMessage) {
+	c.frames = append(c.frames, frame)
+	signal(c.wake)
+}
+
+func (c *Connection) write() {
+	defer close(c.writerDone)
+
+	for {
+		frame, ok := c.next()
+		if !ok {
+			return
+		}
+
+		if err := c.stream.Send(frame); err != nil {
+			c.Close(err)
+			return
+		}
+
+		c.sent.Add(1)
+	}
+}
+
+func (c *Connection) next() (*generated.ChatMessage, bool) {
+	for {
+		c.mu.Lock()
+
+		if c.closed {
+			c.mu.Unlock()
+			return nil, false
+		}
+
+		if len(c.frames) > 0 {
+			frame := c.frames[0]
+			c.frames[0] = nil
+			c.frames = c.frames[1:]
+			c.mu.Unlock()
+
+			signal(c.space)
+
+			return frame, true
+		}
+
+		c.mu.Unlock()
+
+		select {
+		case <-c.wake:
+		case <-c.done:
+			return nil, false
+		}
+	}
+}
+
+// Close stops the writer, queued frames are discarded. The first error wins.
+func (c *Connection) Close(err error) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	if c.closed {
+		return
+	}
+
+	if err == nil {
+		err = ErrConnectionClosed
+	}
+
+	c.closed = true
+	c.err = err
+	c.frames = nil
+
+	if err == ErrSlowConsumer {
+		c.stats.slowConsumers.Add(1)
+	}
+
+	close(c.done)
+}
+
+// Wait blocks until the writer has returned, at most timeout. The stream handler must not return
+// while the writer may still call Send; false means it is still blocked in Send.
+func (c *Connection) Wait(timeout time.Duration) bool {
+	timer := time.NewTimer(timeout)
+	defer timer.Stop()
+
+	select {
+	case <-c.writerDone:
+		return true
+	case <-timer.C:
+		return false
+	}
+}
+
+// Done is closed once the connection is closed, the stream handler should return Err then
+func (c *Connection) Done() <-chan struct{} {
+	return c.done
+}
+
+func (c *Connection) Err() error {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	return c.err
+}
+
+func (c *Connection) Depth() int {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	return len(c.frames)
+}
+
+func signal(ch chan struct{}) {
+	select {
+	case ch <- struct{}{}:
+	default:
+	}
+}
@@ -0,0 +1,305 @@
+package rooms
+
+import (
+	"errors"
+	"fmt"
+	"sync"
+	"testing"
+	"time"
+
+	"github.com/kuzin57/grpc-chat/server/internal/generated"
+)
+
+// blockingStream is a client that stops reading: every Send blocks until release is closed
+type blockingStream struct {
+	generated.Messenger_ChatStreamServer
+
+	sending chan *generated.ChatMessage // frames the writer has started to send
+	release chan struct{}
+
+	mu   sync.Mutex
+	sent []*generated.ChatMessage
+}
+
+func newBlockingStream() *blockingStream {
+	return &blockingStream{
+		sending: make(chan *generated.ChatMessage, 100),
+		release: make(chan struct{}),
+	}
+}
+
+func (s *blockingStream) Send(frame *generated.ChatMessage) error {
+	s.sending <- frame
+	<-s.release
+
+	s.mu.Lock()
+	s.sent = append(s.sent, frame)
+	s.mu.Unlock()
+
+	return nil
+}
+
+func (s *blockingStream) sentContents() []string {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	contents := make([]string, 0, len(s.sent))
+	for _, frame := range s.sent {
+		for _, item := range batchItems(frame) {
+			contents = append(contents, item.Content)
+		}
+	}
+
+	return contents
+}
+
+// waitSent waits until the stream has sent count frames
+func (s *blockingStream) waitSent(t *testing.T, count int) {
+	t.Helper()
+
+	deadline := time.Now().Add(time.Second)
+	for {
+		s.mu.Lock()
+		sent := len(s.sent)
+		s.mu.Unlock()
+
+		if sent >= count {
+			return
+		}
+
+		if time.Now().After(deadline) {
+			t.Fatalf("sent %d frames, want %d", sent, count)
+		}
+
+		time.Sleep(time.Millisecond)
+	}
+}
+
+func message(chatID string, seq int64) *generated.ChatMessage {
+	return &generated.ChatMessage{
+		Content: fmt.Sprintf("%s:%d", chatID, seq),
+		ChatId:  chatID,
+		Type:    generated.ChatMessageType_MESSAGE,
+		Seq:     seq,
+	}
+}
+
+// stalledConnection returns a connection whose writer is blocked in Send on a first frame,
+// so everything offered next stays in the queue
+func stalledConnection(t *testing.T, size int, policy OverflowPolicy) (*Connection, *blockingStream) {
+	t.Helper()
+
+	stream := newBlockingStream()
+	conn := newConnection(1, stream, size, policy, &Stats{})
+
+	t.Cleanup(func() {
+		conn.Close(nil)
+
+		select {
+		case <-stream.release:
+		default:
+			close(stream.release)
+		}
+
+		conn.Wait(time.Second)
+	})
+
+	if result := conn.Offer(message("general", 1)); result != Queued {
+		t.Fatalf("Offer() = %s, want %s", result, Queued)
+	}
+
+	<-stream.sending
+
+	return conn, stream
+}
+
+func TestOfferDrop(t *testing.T) {
+	conn, stream := stalledConnection(t, 2, PolicyDrop)
+
+	for seq := int64(2); seq <= 3; seq++ {
+		if result := conn.Offer(message("general", seq)); result != Queued {
+			t.Fatalf("Offer(%d) = %s, want %s", seq, result, Queued)
+		}
+	}
+
+	if result := conn.Offer(message("general", 4)); result != Dropped {
+		t.Fatalf("Offer() on a full queue = %s, want %s", result, Dropped)
+	}
+
+	if dropped := conn.dropped.Load(); dropped != 1 {
+		t.Errorf("dropped = %d, want 1", dropped)
+	}
+
+	if conn.stats.dropped.Load() != 1 || conn.stats.queued.Load() != 3 {
+		t.Errorf("stats dropped = %d, queued = %d, want 1 and 3", conn.stats.dropped.Load(), conn.stats.queued.Load())
+	}
+
+	close(stream.release)
+	stream.waitSent(t, 3)
+
+	if got, want := fmt.Sprint(stream.sentContents()), "[general:1 general:2 general:3]"; got != want {
+		t.Errorf("sent %s, want %s", got, want)
+	}
+
+	select {
+	case <-conn.Done():
+		t.Error("connection closed by the drop policy")
+	default:
+	}
+}
+
+func TestOfferCoalesce(t *testing.T) {
+	conn, stream := stalledConnection(t, 2, PolicyCoalesce)
+
+	queued := message("general", 2)
+	conn.Offer(queued)
+	conn.Offer(&generated.ChatMessage{ChatId: "random", Type: generated.ChatMessageType_USER_JOINED})
+
+	if result := conn.Offer(message("general", 3)); result != Coalesced {
+		t.Fatalf("Offer() of a message = %s, want %s", result, Coalesced)
+	}
+
+	if result := conn.Offer(&generated.ChatMessage{ChatId: "general", Type: generated.ChatMessageType_USER_JOINED}); result != Dropped {
+		t.Errorf("Offer() of a presence event = %s, want %s", result, Dropped)
+	}
+
+	if depth := conn.Depth(); depth != 2 {
+		t.Errorf("Depth() = %d, want 2", depth)
+	}
+
+	if queued.Type != generated.ChatMessageType_MESSAGE || len(queued.Batch) != 0 {
+		t.Error("queued frame modified in place, it may be shared with other recipients")
+	}
+
+	close(stream.release)
+	stream.waitSent(t, 3)
+
+	stream.mu.Lock()
+	batch := stream.sent[1]
+	stream.mu.Unlock()
+
+	if batch.Type != generated.ChatMessageType_MESSAGE_BATCH || batch.Seq != 3 {
+		t.Errorf("coalesced frame is %s with seq %d, want MESSAGE_BATCH with seq 3", batch.Type, batch.Seq)
+	}
+
+	if got, want := fmt.Sprint(stream.sentContents()), "[general:1 general:2 general:3 ]"; got != want {
+		t.Errorf("sent %s, want %s", got, want)
+	}
+
+	if coalesced := conn.coalesced.Load(); coalesced != 1 {
+		t.Errorf("coalesced = %d, want 1", coalesced)
+	}
+}
+
+func TestOfferCoalesceDisconnects(t *testing.T) {
+	conn, _ := stalledConnection(t, 1, PolicyCoalesce)
+
+	conn.Offer(&generated.ChatMessage{ChatId: "general", Type: generated.ChatMessageType_USER_JOINED})
+
+	// The chat has no queued message frame to merge into
+	if result := conn.Offer(message("general", 2)); result != Disconnected {
+		t.Fatalf("Offer() = %s, want %s", result, Disconnected)
+	}
+
+	if !errors.Is(conn.Err(), ErrSlowConsumer) {
+		t.Errorf("Err() = %v, want %v", conn.Err(), ErrSlowConsumer)
+	}
+}
+
+func TestOfferDisconnect(t *testing.T) {
+	conn, stream := stalledConnection(t, 1, PolicyDisconnect)
+
+	conn.Offer(message("general", 2))
+
+	if result := conn.Offer(message("general", 3)); result != Disconnected {
+		t.Fatalf("Offer() = %s, want %s", result, Disconnected)
+	}
+
+	select {
+	case <-conn.Done():
+	default:
+		t.Fatal("slow connection not closed")
+	}
+
+	if !errors.Is(conn.Err(), ErrSlowConsumer) {
+		t.Errorf("Err() = %v, want %v", conn.Err(), ErrSlowConsumer)
+	}
+
+	if conn.stats.slowConsumers.Load() != 1 {
+		t.Errorf("slow consumers = %d, want 1", conn.stats.slowConsumers.Load())
+	}
+
+	if result := conn.Offer(message("general", 4)); result != Dropped {
+		t.Errorf("Offer() after close = %s, want %s", result, Dropped)
+	}
+
+	// The frame in Send is the last one, the queued frame is discarded
+	close(stream.release)
+
+	if !conn.Wait(time.Second) {
+		t.Fatal("writer did not stop")
+	}
+
+	if got, want := fmt.Sprint(stream.sentContents()), "[general:1]"; got != want {
+		t.Errorf("sent %s, want %s", got, want)
+	}
+}
+
+func TestCloseWaitsForWriter(t *testing.T) {
+	var (
+		index  = NewIndex(map[string][]string{"general": {"alice"}}, QueueConfig{Size: 4})
+		stream = newBlockingStream()
+		conn   = index.Open(stream)
+	)
+
+	index.Connect("alice", conn)
+
+	if recipients := index.Recipients("general", nil); len(recipients) != 1 {
+		t.Fatalf("Recipients() = %d sessions, want 1", len(recipients))
+	}
+
+	conn.Offer(message("general", 1))
+	<-stream.sending
+
+	if conn.Wait(10 * time.Millisecond) {
+		t.Fatal("Wait() = true while the writer is in Send")
+	}
+
+	closed := make(chan struct{})
+	go func() {
+		index.Close(conn)
+		close(closed)
+	}()
+
+	select {
+	case <-closed:
+		t.Fatal("Close() returned while the writer is in Send")
+	case <-time.After(50 * time.Millisecond):
+	}
+
+	if recipients := index.Recipients("general", nil); len(recipients) != 0 {
+		t.Errorf("Recipients() = %d sessions after Close, want 0", len(recipients))
+	}
+
+	close(stream.release)
+
+	select {
+	case <-closed:
+	case <-time.After(time.Second):
+		t.Fatal("Close() did not return after Send finished")
+	}
+
+	if !conn.Wait(time.Second) {
+		t.Error("writer still running after Close")
+	}
+
+	if result := conn.Offer(message("general", 2)); result != Dropped {
+		t.Errorf("Offer() after Close = %s, want %s", result, Dropped)
+	}
+
+	select {
+	case frame := <-stream.sending:
+		t.Errorf("Send(%s) after Close", frame.Content)
+	default:
+	}
+}
@@ -0,0 +1,322 @@
+package rooms
+
+import (
+	"hash/maphash"
+	"log"
+	"sync"
+	"sync/atomic"
+
+	"github.com/kuzin57/grpc-chat/server/internal/generated"
+)
+
+const shardsCount = 64
+
+// Recipient is a connected session of a chat member
+type Recipient struct {
+	Nickname string
+	Conn     *Connection
+}
+
+// Watcher learns when a chat gets its first local session and loses its last one.
+// It is called under the chat shard lock and must not block.
+type Watcher interface {
+	Watch(chatID string)
+	Unwatch(chatID string)
+}
+
+// QueueConfig bounds the outbound queue of every connection
+type QueueConfig struct {
+	Size   int
+	Policy OverflowPolicy
+}
+
+// Index keeps chat membership and connected sessions in memory, so fan-out
+// touches only the online members of a chat and never Redis.
+//
+// Users and chats live in separate shard sets picked by key hash. A user shard lock
+// may be taken before a chat shard lock, never the other way round.
+type Index struct {
+	queue   QueueConfig
+	stats   *Stats
+	seed    maphash.Seed
+	nextID  atomic.Uint64
+	watcher Watcher
+
+	users [shardsCount]userShard
+	chats [shardsCount]chatShard
+
+	connections sync.Map // session ID -> *Connection
+}
+
+type userShard struct {
+	mu    sync.Mutex
+	users map[string]*user
+}
+
+// user is a chat member with the sessions it is connected on, one per device
+type user struct {
+	chats    map[string]struct{}
+	sessions map[uint64]*Connection
+}
+
+type chatShard struct {
+	mu     sync.RWMutex
+	online map[string]map[member]struct{} // chat -> connected sessions of its members
+}
+
+// member is a user on one session, a session may carry several users
+type member struct {
+	conn     *Connection
+	nickname string
+}
+
+// NewIndex builds the index from chat -> nicknames memberships, with nobody connected
+func NewIndex(memberships map[string][]string, queue QueueConfig) *Index {
+	if queue.Size <= 0 {
+		queue.Size = DefaultQueueSize
+	}
+
+	if queue.Policy == "" {
+		queue.Policy = PolicyCoalesce
+	}
+
+	index := &Index{
+		queue: queue,
+		stats: &Stats{},
+		seed:  maphash.MakeSeed(),
+	}
+
+	for i := range shardsCount {
+		index.users[i].users = make(map[string]*user)
+		index.chats[i].online = make(map[string]map[member]struct{})
+	}
+
+	for chatID, nicknames := range memberships {
+		for _, nickname := range nicknames {
+			index.user(nickname).chats[chatID] = struct{}{}
+		}
+	}
+
+	return index
+}
+
+// SetWatcher must be called before the first session connects
+func (i *Index) SetWatcher(watcher Watcher) {
+	i.watcher = watcher
+}
+
+func (i *Index) Join(chatID, nickname string) {
+	shard := i.userShard(nickname)
+
+	shard.mu.Lock()
+	defer shard.mu.Unlock()
+
+	u := i.user(nickname)
+	u.chats[chatID] = struct{}{}
+
+	for _, conn := range u.sessions {
+		i.setOnline(chatID, nickname, conn)
+	}
+}
+
+func (i *Index) Leave(chatID, nickname string) {
+	shard := i.userShard(nickname)
+
+	shard.mu.Lock()
+	defer shard.mu.Unlock()
+
+	u, ok := shard.users[nickname]
+	if !ok {
+		return
+	}
+
+	delete(u.chats, chatID)
+
+	for _, conn := range u.sessions {
+		i.setOffline(chatID, nickname, conn)
+	}
+
+	i.dropIfEmpty(shard, nickname, u)
+}
+
+// Open starts the outbound writer of a new session, nobody receives frames on it until Connect
+func (i *Index) Open(stream generated.Messenger_ChatStreamServer) *Connection {
+	conn := newConnection(i.nextID.Add(1), stream, i.queue.Size, i.queue.Policy, i.stats)
+	i.connections.Store(conn.ID(), conn)
+
+	return conn
+}
+
+// Close stops the session, disconnects every user registered on it and waits for its writer,
+// so the stream handler returns only after the last Send
+func (i *Index) Close(conn *Connection) {
+	conn.Close(nil)
+
+	for _, nickname := range conn.Nicknames() {
+		i.Disconnect(nickname, conn)
+	}
+
+	i.connections.Delete(conn.ID())
+
+	if !conn.Wait(writerStopTimeout) {
+		log.Printf("Writer of session %d is still blocked in Send after %s", conn.ID(), writerStopTimeout)
+	}
+}
+
+// Connect adds conn to the sessions the user receives frames on, other devices stay connected
+func (i *Index) Connect(nickname string, conn *Connection) {
+	shard := i.userShard(nickname)
+
+	shard.mu.Lock()
+	defer shard.mu.Unlock()
+
+	// A closed session must not come back through a frame still being handled
+	if !conn.attach(nickname) {
+		return
+	}
+
+	u := i.user(nickname)
+	u.sessions[conn.ID()] = conn
+
+	for chatID := range u.chats {
+		i.setOnline(chatID, nickname, conn)
+	}
+}
+
+func (i *Index) Disconnect(nickname string, conn *Connection) {
+	shard := i.userShard(nickname)
+
+	shard.mu.Lock()
+	defer shard.mu.Unlock()
+
+	u, ok := shard.users[nickname]
+	if !ok {
+		return
+	}
+
+	if _, ok := u.sessions[conn.ID()]; !ok {
+		return
+	}
+
+	delete(u.sessions, conn.ID())
+
+	for chatID := range u.chats {
+		i.setOffline(chatID, nickname, conn)
+	}
+
+	i.dropIfEmpty(shard, nickname, u)
+}
+
+// Recipients returns the connected sessions of the chat except one, usually the sender's
+func (i *Index) Recipients(chatID string, except *Connection) []Recipient {
+	shard := i.chatShard(chatID)
+
+	shard.mu.RLock()
+	defer shard.mu.RUnlock()
+
+	online := shard.online[chatID]
+	recipients := make([]Recipient, 0, len(online))
+
+	for m := range online {
+		if m.conn == except {
+			continue
+		}
+
+		recipients = append(recipients, Recipient{
+			Nickname: m.nickname,
+			Conn:     m.conn,
+		})
+	}
+
+	return recipients
+}
+
+// Connected returns the number of users with at least one session
+func (i *Index) Connected() int {
+	connected := 0
+
+	for s := range shardsCount {
+		shard := &i.users[s]
+
+		shard.mu.Lock()
+		for _, u := range shard.users {
+			if len(u.sessions) > 0 {
+				connected++
+			}
+		}
+		shard.mu.Unlock()
+	}
+
+	return connected
+}
+
+func (i *Index) userShard(nickname string) *userShard {
+	return &i.users[maphash.String(i.seed, nickname)%shardsCount]
+}
+
+func (i *Index) chatShard(chatID string) *chatShard {
+	return &i.chats[maphash.String(i.seed, chatID)%shardsCount]
+}
+
+// user returns the user entry, creating it. The caller holds the user shard lock.
+func (i *Index) user(nickname string) *user {
+	shard := i.userShard(nickname)
+
+	u, ok := shard.users[nickname]
+	if !ok {
+		u = &user{
+			chats:    make(map[string]struct{}),
+			sessions: make(map[uint64]*Connection),
+		}
+		shard.users[nickname] = u
+	}
+
+	return u
+}
+
+func (i *Index) dropIfEmpty(shard *userShard, nickname string, u *user) {
+	if len(u.chats) == 0 && len(u.sessions) == 0 {
+		delete(shard.users, nickname)
+	}
+}
+
+func (i *Index) setOnline(chatID, nickname string, conn *Connection) {
+	shard := i.chatShard(chatID)
+
+	shard.mu.Lock()
+	defer shard.mu.Unlock()
+
+	online, ok := shard.online[chatID]
+	if !ok {
+		online = make(map[member]struct{})
+		shard.online[chatID] = online
+
+		if i.watcher != nil {
+			i.watcher.Watch(chatID)
+		}
+	}
+
+	online[member{conn: conn, nickname: nickname}] = struct{}{}
+}
+
+func (i *Index) setOffline(chatID, nickname string, conn *Connection) {
+	shard := i.chatShard(chatID)
+
+	shard.mu.Lock()
+	defer shard.mu.Unlock()
+
+	online, ok := shard.online[chatID]
+	if !ok {
+		return
+	}
+
+	delete(online, member{conn: conn, nickname: nickname})
+
+	if len(online) == 0 {
+		delete(shard.online, chatID)
+
+		if i.watcher != nil {
+			i.watcher.Unwatch(chatID)
+		}
+	}
+}
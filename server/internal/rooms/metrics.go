@@ -0,0 +1,112 @@
+package rooms
+
+import (
+	"fmt"
+	"io"
+	"sort"
+	"strings"
+	"sync/atomic"
+)
+
+// Stats counts offered frames of all connections, including the closed ones
+type Stats struct {
+	queued        atomic.Int64
+	coalesced     atomic.Int64
+	dropped       atomic.Int64
+	disconnected  atomic.Int64
+	slowConsumers atomic.Int64
+}
+
+func (s *Stats) frames(result OfferResult) {
+	switch result {
+	case Queued:
+		s.queued.Add(1)
+	case Coalesced:
+		s.coalesced.Add(1)
+	case Dropped:
+		s.dropped.Add(1)
+	case Disconnected:
+		s.disconnected.Add(1)
+	}
+}
+
+type connectionStats struct {
+	id        uint64
+	nicknames string
+	depth     int
+	sent      int64
+	dropped   int64
+	coalesced int64
+}
+
+// WriteMetrics writes the outbound queue metrics in the Prometheus text format
+func (i *Index) WriteMetrics(w io.Writer) error {
+	var connections []connectionStats
+
+	i.connections.Range(func(_, value any) bool {
+		conn := value.(*Connection)
+
+		names := conn.Nicknames()
+		sort.Strings(names)
+
+		connections = append(connections, connectionStats{
+			id:        conn.id,
+			nicknames: strings.Join(names, ","),
+			depth:     conn.Depth(),
+			sent:      conn.sent.Load(),
+			dropped:   conn.dropped.Load(),
+			coalesced: conn.coalesced.Load(),
+		})
+
+		return true
+	})
+
+	users := i.Connected()
+
+	sort.Slice(connections, func(a, b int) bool {
+		return connections[a].id < connections[b].id
+	})
+
+	var b strings.Builder
+
+	fmt.Fprintf(&b, "# TYPE chat_stream_sessions gauge\nchat_stream_sessions %d\n", len(connections))
+	fmt.Fprintf(&b, "# TYPE chat_stream_users gauge\nchat_stream_users %d\n", users)
+	fmt.Fprintf(&b, "# TYPE chat_stream_queue_capacity gauge\nchat_stream_queue_capacity %d\n", i.queue.Size)
+
+	b.WriteString("# TYPE chat_stream_frames_total counter\n")
+	for _, counter := range []struct {
+		result OfferResult
+		value  int64
+	}{
+		{Queued, i.stats.queued.Load()},
+		{Coalesced, i.stats.coalesced.Load()},
+		{Dropped, i.stats.dropped.Load()},
+		{Disconnected, i.stats.disconnected.Load()},
+	} {
+		fmt.Fprintf(&b, "chat_stream_frames_total{result=%q} %d\n", counter.result, counter.value)
+	}
+
+	fmt.Fprintf(&b, "# TYPE chat_stream_slow_consumers_total counter\nchat_stream_slow_consumers_total %d\n", i.stats.slowConsumers.Load())
+
+	perConnection := []struct {
+		name, kind string
+		value      func(connectionStats) int64
+	}{
+		{"chat_stream_queue_depth", "gauge", func(c connectionStats) int64 { return int64(c.depth) }},
+		{"chat_stream_connection_sent_total", "counter", func(c connectionStats) int64 { return c.sent }},
+		{"chat_stream_connection_dropped_total", "counter", func(c connectionStats) int64 { return c.dropped }},
+		{"chat_stream_connection_coalesced_total", "counter", func(c connectionStats) int64 { return c.coalesced }},
+	}
+
+	for _, metric := range perConnection {
+		fmt.Fprintf(&b, "# TYPE %s %s\n", metric.name, metric.kind)
+
+		for _, conn := range connections {
+			fmt.Fprintf(&b, "%s{session=\"%d\",nicknames=%q} %d\n", metric.name, conn.id, conn.nicknames, metric.value(conn))
+		}
+	}
+
+	_, err := io.WriteString(w, b.String())
+
+	return err
+}
@@ -2,33 +2,35 @@ package server
 
 import (
 	"context"
-	"sync"
 
 	"github.com/kuzin57/grpc-chat/server/internal/entities"
 	"github.com/kuzin57/grpc-chat/server/internal/generated"
+	"github.com/kuzin57/grpc-chat/server/internal/rooms"
 )
 
 type MessengerService interface {
 	SendMessage(ctx context.Context, text, nickname, chatID string) (entities.Message, error)
-	GetMessages(ctx context.Context, chatID string) ([]*entities.Message, error)
-	GetUserChats(ctx context.Context, nickname string) ([]string, map[string]*entities.ChatUser, error)
+	SendMessages(ctx context.Context, texts []string, nickname, chatID string) ([]entities.Message, error)
+	GetMessages(ctx context.Context, chatID string, limit int, before, after int64) ([]*entities.Message, bool, error)
+	GetMessagesSince(ctx context.Context, chatID string, cursor int64) ([]*entities.Message, int64, bool, error)
+	GetUserChats(ctx context.Context, nickname string) ([]*entities.Chat, map[string]*entities.ChatUser, error)
 	CreateChat(ctx context.Context, name, nickname string) (string, error)
 	AddUserToChat(ctx context.Context, chatID, nickname string) error
 	RemoveUserFromChat(ctx context.Context, chatID, nickname string) error
 	SetMessagesRead(ctx context.Context, chatID, nickname string) error
-	Broadcast(
-		ctx context.Context,
-		message entities.Message,
-		messageType generated.ChatMessageType,
-		streams map[string]generated.Messenger_ChatStreamServer,
-		mu *sync.RWMutex,
-	) error
+	OpenStream(stream generated.Messenger_ChatStreamServer) *rooms.Connection
+	CloseStream(conn *rooms.Connection)
+	ConnectStream(nickname string, conn *rooms.Connection)
+	Broadcast(ctx context.Context, origin *rooms.Connection, message entities.Message, messageType generated.ChatMessageType) error
+	BroadcastBatch(ctx context.Context, origin *rooms.Connection, messages []entities.Message) error
 	SetTTLToChat(ctx context.Context, chatID string, ttl int32) error
 }
 
 type MessengerServer interface {
 	SendMessage(context.Context, *generated.SendMessageRequest) (*generated.SendMessageResponse, error)
+	SendMessages(context.Context, *generated.SendMessagesRequest) (*generated.SendMessagesResponse, error)
 	GetMessages(context.Context, *generated.GetMessagesRequest) (*generated.GetMessagesResponse, error)
+	GetMessagesSince(context.Context, *generated.GetMessagesSinceRequest) (*generated.GetMessagesSinceResponse, error)
 	GetUserChats(context.Context, *generated.GetUserChatsRequest) (*generated.GetUserChatsResponse, error)
 	CreateChat(context.Context, *generated.CreateChatRequest) (*generated.CreateChatResponse, error)
 	LeaveChat(context.Context, *generated.LeaveChatRequest) (*generated.LeaveChatResponse, error)
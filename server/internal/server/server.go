@@ -5,12 +5,14 @@ import (
 	"errors"
 	"io"
 	"log"
-	"sync"
 	"time"
 
 	"github.com/kuzin57/grpc-chat/server/internal/entities"
 	"github.com/kuzin57/grpc-chat/server/internal/generated"
 	"github.com/kuzin57/grpc-chat/server/internal/repository"
+	"github.com/kuzin57/grpc-chat/server/internal/rooms"
+	"github.com/kuzin57/grpc-chat/server/internal/services/messenger"
+	"github.com/kuzin57/grpc-chat/server/internal/tracing"
 	"github.com/kuzin57/grpc-chat/server/internal/utils"
 	"google.golang.org/grpc/codes"
 	"google.golang.org/grpc/status"
@@ -24,16 +26,13 @@ var (
 type Server struct {
 	generated.UnimplementedMessengerServer
 	messengerService MessengerService
-
-	streams map[string]generated.Messenger_ChatStreamServer
-	mu      *sync.RWMutex
+	tracer           *tracing.Tracer
 }
 
-func NewServer(messengerService MessengerService) *Server {
+func NewServer(messengerService MessengerService, tracer *tracing.Tracer) *Server {
 	return &Server{
 		messengerService: messengerService,
-		mu:               &sync.RWMutex{},
-		streams:          make(map[string]generated.Messenger_ChatStreamServer),
+		tracer:           tracer,
 	}
 }
 
@@ -54,10 +53,46 @@ func (s *Server) SendMessage(ctx context.Context, req *generated.SendMessageRequ
 	}, nil
 }
 
+func (s *Server) SendMessages(ctx context.Context, req *generated.SendMessagesRequest) (*generated.SendMessagesResponse, error) {
+	log.Println("Sending", len(req.Messages), "messages to chat", req.ChatId)
+
+	messages, err := s.messengerService.SendMessages(ctx, req.Messages, req.Nickname, req.ChatId)
+	if err != nil {
+		switch {
+		case errors.Is(err, repository.ErrChatNotFound):
+			return nil, status.Errorf(codes.NotFound, "chat not found")
+		case errors.Is(err, messenger.ErrBatchTooLarge):
+			return nil, status.Errorf(codes.InvalidArgument, "too many messages in batch")
+		}
+
+		return nil, err
+	}
+
+	// Streaming members get the batch as one MESSAGE_BATCH frame, the same as one sent over the stream
+	broadcastCtx, cancel := context.WithTimeout(tracing.Detached(ctx), 10*time.Second)
+	err = s.messengerService.BroadcastBatch(broadcastCtx, nil, messages)
+	cancel()
+	if err != nil {
+		log.Printf("Broadcast error (non-fatal): %v", err)
+	}
+
+	response := &generated.SendMessagesResponse{
+		MessageIds: make([]string, len(messages)),
+		Seqs:       make([]int64, len(messages)),
+	}
+
+	for i, message := range messages {
+		response.MessageIds[i] = message.ID
+		response.Seqs[i] = message.Seq
+	}
+
+	return response, nil
+}
+
 func (s *Server) GetMessages(ctx context.Context, req *generated.GetMessagesRequest) (*generated.GetMessagesResponse, error) {
 	log.Println("Getting received messages for:", req.ChatId)
 
-	messages, err := s.messengerService.GetMessages(ctx, req.ChatId)
+	messages, hasMore, err := s.messengerService.GetMessages(ctx, req.ChatId, int(req.Limit), req.Before, req.After)
 	if err != nil {
 		if errors.Is(err, repository.ErrChatNotFound) {
 			return nil, status.Errorf(codes.NotFound, "chat not found")
@@ -67,18 +102,41 @@ func (s *Server) GetMessages(ctx context.Context, req *generated.GetMessagesRequ
 	}
 
 	return &generated.GetMessagesResponse{
-		Messages: utils.MapSlice(messages, func(message *entities.Message) *generated.Message {
-			return &generated.Message{
-				Id:        message.ID,
-				Content:   message.Content,
-				Nickname:  message.Nickname,
-				ChatId:    message.ChatID,
-				CreatedAt: message.CreatedAt.Format(time.RFC3339),
-			}
-		}),
+		Messages: utils.MapSlice(messages, toGeneratedMessage),
+		HasMore:  hasMore,
 	}, nil
 }
 
+func (s *Server) GetMessagesSince(ctx context.Context, req *generated.GetMessagesSinceRequest) (*generated.GetMessagesSinceResponse, error) {
+	log.Println("Getting messages for:", req.ChatId, "since", req.Cursor)
+
+	messages, nextCursor, hasMore, err := s.messengerService.GetMessagesSince(ctx, req.ChatId, req.Cursor)
+	if err != nil {
+		if errors.Is(err, repository.ErrChatNotFound) {
+			return nil, status.Errorf(codes.NotFound, "chat not found")
+		}
+
+		return nil, err
+	}
+
+	return &generated.GetMessagesSinceResponse{
+		Messages:   utils.MapSlice(messages, toGeneratedMessage),
+		NextCursor: nextCursor,
+		HasMore:    hasMore,
+	}, nil
+}
+
+func toGeneratedMessage(message *entities.Message) *generated.Message {
+	return &generated.Message{
+		Id:        message.ID,
+		Content:   message.Content,
+		Nickname:  message.Nickname,
+		ChatId:    message.ChatID,
+		CreatedAt: message.CreatedAt.Format(time.RFC3339),
+		Seq:       message.Seq,
+	}
+}
+
 func (s *Server) GetUserChats(ctx context.Context, req *generated.GetUserChatsRequest) (*generated.GetUserChatsResponse, error) {
 	log.Println("Getting user chats for:", req.Nickname)
 
@@ -88,25 +146,42 @@ func (s *Server) GetUserChats(ctx context.Context, req *generated.GetUserChatsRe
 	}
 
 	return &generated.GetUserChatsResponse{
-		Chats: utils.MapSliceIf(chats, func(chatID string) (*generated.ChatStats, bool) {
-			chatUser, ok := chatUsers[chatID]
+		Chats: utils.MapSliceIf(chats, func(chat *entities.Chat) (*generated.ChatStats, bool) {
+			chatUser, ok := chatUsers[chat.ID]
 			if !ok {
 				return nil, false
 			}
 
-			return &generated.ChatStats{
-				NewMessages: int32(chatUser.NewMessages),
-				ChatId:      chatID,
-			}, true
+			return toGeneratedChatStats(chat, chatUser), true
 		}),
 	}, nil
 }
 
+func toGeneratedChatStats(chat *entities.Chat, chatUser *entities.ChatUser) *generated.ChatStats {
+	stats := &generated.ChatStats{
+		ChatId:      chat.ID,
+		NewMessages: int32(chatUser.NewMessages),
+		Name:        chat.Name,
+		CreatedBy:   chat.CreatedBy,
+	}
+
+	// Chats registered by the backfill have no creation time
+	if !chat.CreatedAt.IsZero() {
+		stats.CreatedAt = chat.CreatedAt.Format(time.RFC3339)
+	}
+
+	return stats
+}
+
 func (s *Server) CreateChat(ctx context.Context, req *generated.CreateChatRequest) (*generated.CreateChatResponse, error) {
 	log.Println("Creating chat:", req.Name, "for:", req.Nickname)
 
 	chatID, err := s.messengerService.CreateChat(ctx, req.Name, req.Nickname)
 	if err != nil {
+		if errors.Is(err, messenger.ErrChatAlreadyExists) {
+			return nil, status.Errorf(codes.AlreadyExists, "chat already exists")
+		}
+
 		return nil, err
 	}
 
@@ -155,138 +230,290 @@ func (s *Server) SetMessagesRead(ctx context.Context, req *generated.SetMessages
 }
 
 func (s *Server) ChatStream(stream generated.Messenger_ChatStreamServer) error {
-	for {
-		ctx := stream.Context()
+	// Frames to the client go through the session queue, its users stop receiving chats once it is closed.
+	// CloseStream waits for the queue writer, so no Send happens after the handler returns.
+	conn := s.messengerService.OpenStream(stream)
+	defer s.messengerService.CloseStream(conn)
+
+	var (
+		ctx      = stream.Context()
+		requests = make(chan *generated.ChatMessage)
+		recvErr  = make(chan error, 1)
+		// Users are registered in the session index once, on their first frame, not on every heartbeat
+		registered = make(map[string]struct{})
+	)
+
+	go func() {
+		for {
+			req, err := stream.Recv()
+			if err != nil {
+				recvErr <- err
+				return
+			}
+
+			select {
+			case requests <- req:
+			case <-conn.Done():
+				return
+			}
+		}
+	}()
 
+	for {
 		select {
 		case <-ctx.Done():
 			log.Println("Stream context cancelled")
 			return ctx.Err()
-		default:
+		case <-conn.Done():
+			// Slow consumer or failed send, the client reconnects and resumes from its last seq
+			log.Println("Chat stream closed:", conn.Err())
+			return conn.Err()
+		case err := <-recvErr:
+			if errors.Is(err, io.EOF) {
+				log.Println("Chat stream EOF")
+				return nil
+			}
+
+			log.Println("Chat stream error:", err)
+			return err
+		case req := <-requests:
+			if _, ok := registered[req.Nickname]; !ok {
+				registered[req.Nickname] = struct{}{}
+				s.messengerService.ConnectStream(req.Nickname, conn)
+				log.Println("User", req.Nickname, "registered on session", conn.ID())
+			}
+
+			frameCtx, span := s.startFrameSpan(ctx, req)
+			s.handleFrame(frameCtx, conn, req)
+			span.End()
+		}
+	}
+}
+
+// startFrameSpan continues the sender's trace for frames that carry one; heartbeats and untraced clients get no span
+func (s *Server) startFrameSpan(ctx context.Context, req *generated.ChatMessage) (context.Context, *tracing.Span) {
+	parent, ok := tracing.ParseSpanContext(req.TraceId, req.SpanId)
+	if !ok {
+		return ctx, nil
+	}
+
+	return s.tracer.StartRemote(ctx, "ChatStream.recv", tracing.SpanKindServer, parent,
+		tracing.Attribute{Key: "type", Value: req.Type.String()},
+		tracing.Attribute{Key: "chat_id", Value: req.ChatId},
+		tracing.Attribute{Key: "nickname", Value: req.Nickname},
+		tracing.Attribute{Key: "batch", Value: len(req.Batch)},
+	)
+}
+
+func (s *Server) handleFrame(ctx context.Context, conn *rooms.Connection, req *generated.ChatMessage) {
+	var err error
+
+	message := entities.Message{
+		Content:   req.Content,
+		Nickname:  req.Nickname,
+		ChatID:    req.ChatId,
+		CreatedAt: time.Now(),
+	}
+
+	log.Println("[Chat stream] message:", message)
+	log.Println("[Chat stream] message type:", req.Type)
+
+	switch req.Type {
+	case generated.ChatMessageType_MESSAGE, generated.ChatMessageType_SET_TTL_TO_CHAT:
+		message, err = s.messengerService.SendMessage(ctx, req.Content, req.Nickname, req.ChatId)
+		if err != nil {
+			log.Println("Chat stream error:", err)
+			s.sendFailed(ctx, conn, req, []*generated.ChatMessage{req}, err)
+			return
+		}
+
+		if req.Ttl != nil {
+			if err = s.messengerService.SetTTLToChat(ctx, req.ChatId, *req.Ttl); err != nil {
+				log.Println("Chat stream error:", err)
+				return
+			}
+
+			// The sender learns that the policy is in effect, others get the usual broadcast
+			if err = conn.Send(ctx, toTTLAckFrame(message, *req.Ttl)); err != nil {
+				log.Println("Chat stream error:", err)
+			}
 		}
 
-		req, err := stream.Recv()
-		if errors.Is(err, io.EOF) {
-			log.Println("Chat stream EOF")
-			break
+		log.Println("Chat stream message:", message)
+	case generated.ChatMessageType_MESSAGE_BATCH:
+		texts := make([]string, len(req.Batch))
+		for i, item := range req.Batch {
+			texts[i] = item.Content
 		}
 
+		messages, err := s.messengerService.SendMessages(ctx, texts, req.Nickname, req.ChatId)
 		if err != nil {
 			log.Println("Chat stream error:", err)
-			return err
+			s.sendFailed(ctx, conn, req, req.Batch, err)
+			return
 		}
 
-		message := entities.Message{
-			Content:   req.Content,
-			Nickname:  req.Nickname,
-			ChatID:    req.ChatId,
-			CreatedAt: time.Now(),
+		log.Println("Chat stream batch:", len(messages), "messages to chat", req.ChatId)
+
+		broadcastCtx, cancel := context.WithTimeout(tracing.Detached(ctx), 10*time.Second)
+		err = s.messengerService.BroadcastBatch(broadcastCtx, conn, messages)
+		cancel()
+		if err != nil {
+			log.Printf("Broadcast error (non-fatal): %v", err)
 		}
 
-		log.Println("[Chat stream] message:", message)
-		log.Println("[Chat stream] message type:", req.Type)
+		return
+	case generated.ChatMessageType_USER_CONNECTED:
+		if req.Content == "heartbeat" {
+			log.Println("Heartbeat received from:", req.Nickname)
+			return
+		}
 
-		switch req.Type {
-		case generated.ChatMessageType_MESSAGE, generated.ChatMessageType_SET_TTL_TO_CHAT:
-			message, err = s.messengerService.SendMessage(ctx, req.Content, req.Nickname, req.ChatId)
-			if err != nil {
-				log.Println("Chat stream error:", err)
-				continue
-			}
+		log.Println("User connected:", req.Nickname, "session", conn.ID())
 
-			if req.Ttl != nil {
-				if err = s.messengerService.SetTTLToChat(ctx, req.ChatId, *req.Ttl); err != nil {
-					log.Println("Chat stream error:", err)
-					continue
-				}
+		// Reconnected client sends the last seen seq per chat and gets only what it missed
+		for chatID, cursor := range req.Resume {
+			if err := s.replayMessages(ctx, conn, chatID, cursor); err != nil {
+				log.Println("Chat stream resume error:", err, "chat", chatID)
 			}
+		}
 
-			s.mu.Lock()
-			s.streams[req.Nickname] = stream
-			s.mu.Unlock()
+		return
+	case generated.ChatMessageType_USER_JOINED:
+		if err = s.messengerService.SetMessagesRead(ctx, req.ChatId, req.Nickname); err != nil {
+			log.Println("Chat stream error:", err)
+			return
+		}
 
-			log.Println("Chat stream message:", message)
-		case generated.ChatMessageType_USER_CONNECTED:
-			s.mu.Lock()
-			s.streams[req.Nickname] = stream
-			s.mu.Unlock()
+		log.Printf("User %s joined chat %s", req.Nickname, req.ChatId)
 
-			if req.Content == "heartbeat" {
-				log.Println("Heartbeat received from:", req.Nickname)
-				continue
-			}
+		select {
+		case <-ctx.Done():
+			log.Printf("Stream context cancelled for user %s, skipping broadcast", req.Nickname)
+			return
+		default:
+		}
+	case generated.ChatMessageType_USER_GOT_IN:
+		if err = s.messengerService.SetMessagesRead(ctx, req.ChatId, req.Nickname); err != nil {
+			log.Println("Chat stream error:", err)
+			return
+		}
 
-			log.Println("User connected and registered:", req.Nickname)
-			continue
-		case generated.ChatMessageType_USER_JOINED:
-			if err = s.messengerService.SetMessagesRead(ctx, req.ChatId, req.Nickname); err != nil {
+		// The client loads its history itself and sends the last seq it has,
+		// only messages after it are replayed; without a seq there is nothing to resume
+		if req.Seq > 0 {
+			if err = s.replayMessages(ctx, conn, req.ChatId, req.Seq); err != nil {
 				log.Println("Chat stream error:", err)
-				continue
+				return
 			}
 
-			s.mu.Lock()
-			s.streams[req.Nickname] = stream
-			s.mu.Unlock()
-			log.Printf("User %s joined chat %s, total active streams: %d", req.Nickname, req.ChatId, len(s.streams))
+			log.Println("Chat stream messages replayed:", req.ChatId, "nickname", req.Nickname, "after", req.Seq)
+		}
 
-			select {
-			case <-ctx.Done():
-				log.Printf("Stream context cancelled for user %s, skipping broadcast", req.Nickname)
-				continue
-			default:
-			}
-		case generated.ChatMessageType_USER_GOT_IN:
-			if err = s.messengerService.SetMessagesRead(ctx, req.ChatId, req.Nickname); err != nil {
-				log.Println("Chat stream error:", err)
-				continue
-			}
+		return
+	case generated.ChatMessageType_USER_LEFT:
+		// Membership changes come with LeaveChat, the stream stays connected for the other chats
+		log.Println("Chat stream user left:", req.ChatId, "nickname", req.Nickname)
+	default:
+		log.Println("Unknown chat message type:", req.Type)
+		return
+	}
 
-			s.mu.Lock()
-			s.streams[req.Nickname] = stream
-			s.mu.Unlock()
+	broadcastCtx, cancel := context.WithTimeout(tracing.Detached(ctx), 10*time.Second)
+	err = s.messengerService.Broadcast(broadcastCtx, conn, message, req.Type)
+	cancel()
+	if err != nil {
+		log.Printf("Broadcast error (non-fatal): %v", err)
+	}
+}
 
-			messages, err := s.messengerService.GetMessages(ctx, req.ChatId)
-			if err != nil {
-				log.Println("Chat stream error:", err)
-				continue
-			}
+// replayMessages sends the messages of the chat after cursor, one MESSAGE_BATCH frame per page
+func (s *Server) replayMessages(ctx context.Context, conn *rooms.Connection, chatID string, cursor int64) error {
+	for {
+		messages, nextCursor, hasMore, err := s.messengerService.GetMessagesSince(ctx, chatID, cursor)
+		if err != nil {
+			return err
+		}
 
-			for _, message := range messages {
-				log.Println("Sending message to user", message.Nickname, "message", message)
-
-				if err := stream.Send(&generated.ChatMessage{
-					Id:        message.ID,
-					Content:   message.Content,
-					Nickname:  message.Nickname,
-					ChatId:    message.ChatID,
-					CreatedAt: message.CreatedAt.Format(time.RFC3339),
-					Type:      generated.ChatMessageType_MESSAGE,
-				}); err != nil {
-					log.Println("Chat stream error:", err)
-					continue
-				}
+		if len(messages) > 0 {
+			if err := conn.Send(ctx, toReplayFrame(chatID, messages)); err != nil {
+				return err
 			}
+		}
 
-			log.Println("Chat stream messages sent:", req.ChatId, "nickname", req.Nickname)
-			continue
-		case generated.ChatMessageType_USER_LEFT:
-			s.mu.Lock()
-			delete(s.streams, req.Nickname)
-			s.mu.Unlock()
+		if !hasMore {
+			return nil
+		}
 
-			log.Println("Chat stream user left:", req.ChatId, "nickname", req.Nickname)
-		default:
-			log.Println("Unknown chat message type:", req.Type)
-			continue
+		cursor = nextCursor
+	}
+}
+
+// sendFailed tells the sender that the messages of its frame were not stored, the client has already shown them as sent
+func (s *Server) sendFailed(ctx context.Context, conn *rooms.Connection, req *generated.ChatMessage, items []*generated.ChatMessage, err error) {
+	reason := "failed to store messages"
+
+	switch {
+	case errors.Is(err, repository.ErrChatNotFound):
+		reason = "chat not found"
+	case errors.Is(err, messenger.ErrBatchTooLarge):
+		reason = "too many messages in batch"
+	}
+
+	frame := &generated.ChatMessage{
+		Content:  reason,
+		Nickname: req.Nickname,
+		ChatId:   req.ChatId,
+		Type:     generated.ChatMessageType_SEND_FAILED,
+		Batch:    make([]*generated.ChatMessage, len(items)),
+	}
+
+	for i, item := range items {
+		frame.Batch[i] = &generated.ChatMessage{
+			Content:  item.Content,
+			Nickname: req.Nickname,
+			ChatId:   req.ChatId,
+			Type:     generated.ChatMessageType_MESSAGE,
 		}
+	}
 
-		broadcastCtx, cancel := context.WithTimeout(context.Background(), 10*time.Second)
-		err = s.messengerService.Broadcast(broadcastCtx, message, req.Type, s.streams, s.mu)
-		cancel()
-		if err != nil {
-			log.Printf("Broadcast error (non-fatal): %v", err)
+	if err := conn.Send(ctx, frame); err != nil {
+		log.Println("Chat stream error:", err)
+	}
+}
+
+func toTTLAckFrame(message entities.Message, ttl int32) *generated.ChatMessage {
+	return &generated.ChatMessage{
+		Id:        message.ID,
+		Content:   message.Content,
+		Nickname:  message.Nickname,
+		ChatId:    message.ChatID,
+		CreatedAt: message.CreatedAt.Format(time.RFC3339),
+		Type:      generated.ChatMessageType_SET_TTL_TO_CHAT,
+		Ttl:       &ttl,
+		Seq:       message.Seq,
+	}
+}
+
+func toReplayFrame(chatID string, messages []*entities.Message) *generated.ChatMessage {
+	frame := &generated.ChatMessage{
+		ChatId: chatID,
+		Type:   generated.ChatMessageType_MESSAGE_BATCH,
+		Seq:    messages[len(messages)-1].Seq,
+		Batch:  make([]*generated.ChatMessage, len(messages)),
+	}
+
+	for i, message := range messages {
+		frame.Batch[i] = &generated.ChatMessage{
+			Id:        message.ID,
+			Content:   message.Content,
+			Nickname:  message.Nickname,
+			ChatId:    message.ChatID,
+			CreatedAt: message.CreatedAt.Format(time.RFC3339),
+			Type:      generated.ChatMessageType_MESSAGE,
+			Seq:       message.Seq,
 		}
 	}
 
-	return nil
+	return frame
 }
@@ -4,4 +4,5 @@ import "errors"
 
 var (
 	ErrChatAlreadyExists = errors.New("chat already exists")
+	ErrBatchTooLarge     = errors.New("messages batch is too large")
 )
@@ -4,18 +4,28 @@ import (
 	"context"
 
 	"github.com/kuzin57/grpc-chat/server/internal/entities"
+	"github.com/kuzin57/grpc-chat/server/internal/generated"
 )
 
 type Repository interface {
-	CreateMessage(ctx context.Context, message entities.Message) (string, error)
-	GetMessages(ctx context.Context, chatID string) ([]*entities.Message, error)
-	CreateChat(ctx context.Context, chatID, nickname string) (string, error)
+	CreateMessage(ctx context.Context, message entities.Message) (entities.Message, error)
+	CreateMessages(ctx context.Context, messages []entities.Message) ([]entities.Message, error)
+	GetMessages(ctx context.Context, chatID string, limit int, before, after int64) ([]*entities.Message, bool, error)
+	CreateChat(ctx context.Context, chat *entities.Chat) error
 	AddUserToChat(ctx context.Context, chatID, nickname string) error
 	RemoveUserFromChat(ctx context.Context, chatID, nickname string) error
-	GetChat(ctx context.Context, chatID string) (string, error)
+	GetChat(ctx context.Context, chatID string) (*entities.Chat, error)
+	GetChats(ctx context.Context, chatIDs []string) (map[string]*entities.Chat, error)
 	GetUserChats(ctx context.Context, nickname string) ([]string, error)
 	SetMessagesRead(ctx context.Context, chatID, nickname string) error
 	GetChatsUsers(ctx context.Context, nickname string, chatsIDs []string) (map[string]*entities.ChatUser, error)
-	GetUsersByChatID(ctx context.Context, chatID string) ([]*entities.ChatUser, error)
 	SetTTLToChat(ctx context.Context, chatID string, ttl int32) error
+	InvalidateChat(chatID string)
+}
+
+// Cluster publishes to the other server instances, nil when the server runs alone
+type Cluster interface {
+	PublishFrame(ctx context.Context, chatID string, frame *generated.ChatMessage) error
+	PublishMembership(ctx context.Context, chatID, nickname string, joined bool) error
+	PublishChatChanged(ctx context.Context, chatID string) error
 }
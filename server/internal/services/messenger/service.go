@@ -4,27 +4,52 @@ import (
 	"context"
 	"errors"
 	"log"
-	"sync"
 	"time"
 
 	"github.com/kuzin57/grpc-chat/server/internal/entities"
 	"github.com/kuzin57/grpc-chat/server/internal/generated"
 	"github.com/kuzin57/grpc-chat/server/internal/repository"
+	"github.com/kuzin57/grpc-chat/server/internal/rooms"
+	"github.com/kuzin57/grpc-chat/server/internal/tracing"
+	"github.com/kuzin57/grpc-chat/server/internal/utils"
+)
+
+const (
+	defaultMessagesPageSize = 50
+	maxMessagesPageSize     = 500
+	messagesSincePageSize   = 100
+	maxMessagesBatchSize    = 500
 )
 
 type Service struct {
-	repo Repository
+	repo    Repository
+	rooms   *rooms.Index
+	cluster Cluster
+	tracer  *tracing.Tracer
 }
 
-func NewService(repo Repository) *Service {
+// NewService creates the service, cluster is nil for a single instance
+func NewService(repo Repository, index *rooms.Index, cluster Cluster, tracer *tracing.Tracer) *Service {
 	return &Service{
-		repo: repo,
+		repo:    repo,
+		rooms:   index,
+		cluster: cluster,
+		tracer:  tracer,
 	}
 }
 
-func (s *Service) SendMessage(ctx context.Context, text, nickname, chatID string) (entities.Message, error) {
+func (s *Service) getChat(ctx context.Context, chatID string) error {
+	ctx, span := s.tracer.Start(ctx, "GetChat", tracing.Attribute{Key: "chat_id", Value: chatID})
+	defer span.End()
+
 	_, err := s.repo.GetChat(ctx, chatID)
-	if err != nil {
+	span.RecordError(err)
+
+	return err
+}
+
+func (s *Service) SendMessage(ctx context.Context, text, nickname, chatID string) (entities.Message, error) {
+	if err := s.getChat(ctx, chatID); err != nil {
 		return entities.Message{}, err
 	}
 
@@ -37,156 +62,310 @@ func (s *Service) SendMessage(ctx context.Context, text, nickname, chatID string
 
 	log.Println("Sending message:", text, "chat", chatID)
 
-	messageID, err := s.repo.CreateMessage(ctx, message)
-	if err != nil {
-		return entities.Message{}, err
+	ctx, span := s.tracer.Start(ctx, "CreateMessage")
+	defer span.End()
+
+	message, err := s.repo.CreateMessage(ctx, message)
+	span.SetAttribute("seq", message.Seq)
+	span.RecordError(err)
+
+	return message, err
+}
+
+func (s *Service) SendMessages(ctx context.Context, texts []string, nickname, chatID string) ([]entities.Message, error) {
+	if len(texts) > maxMessagesBatchSize {
+		return nil, ErrBatchTooLarge
+	}
+
+	if err := s.getChat(ctx, chatID); err != nil {
+		return nil, err
+	}
+
+	createdAt := time.Now()
+
+	messages := make([]entities.Message, len(texts))
+	for i, text := range texts {
+		messages[i] = entities.Message{
+			Content:   text,
+			ChatID:    chatID,
+			Nickname:  nickname,
+			CreatedAt: createdAt,
+		}
 	}
 
-	message.ID = messageID
+	log.Println("Sending", len(messages), "messages to chat", chatID)
+
+	ctx, span := s.tracer.Start(ctx, "CreateMessages", tracing.Attribute{Key: "messages", Value: len(messages)})
+	defer span.End()
 
-	return message, nil
+	messages, err := s.repo.CreateMessages(ctx, messages)
+	span.RecordError(err)
+
+	return messages, err
 }
 
-func (s *Service) GetMessages(ctx context.Context, chatID string) ([]*entities.Message, error) {
-	_, err := s.repo.GetChat(ctx, chatID)
+func (s *Service) GetMessages(ctx context.Context, chatID string, limit int, before, after int64) ([]*entities.Message, bool, error) {
+	if err := s.getChat(ctx, chatID); err != nil {
+		return nil, false, err
+	}
+
+	if limit <= 0 {
+		limit = defaultMessagesPageSize
+	}
+
+	limit = min(limit, maxMessagesPageSize)
+
+	log.Println("Getting messages for", chatID, "limit", limit, "before", before, "after", after)
+	return s.repo.GetMessages(ctx, chatID, limit, before, after)
+}
+
+func (s *Service) GetMessagesSince(ctx context.Context, chatID string, cursor int64) ([]*entities.Message, int64, bool, error) {
+	if err := s.getChat(ctx, chatID); err != nil {
+		return nil, 0, false, err
+	}
+
+	messages, hasMore, err := s.repo.GetMessages(ctx, chatID, messagesSincePageSize, 0, cursor)
 	if err != nil {
-		return nil, err
+		return nil, 0, false, err
 	}
 
-	log.Println("Getting messages for", chatID)
-	return s.repo.GetMessages(ctx, chatID)
+	nextCursor := cursor
+	if len(messages) > 0 {
+		nextCursor = messages[len(messages)-1].Seq
+	}
+
+	return messages, nextCursor, hasMore, nil
 }
 
-func (s *Service) GetUserChats(ctx context.Context, nickname string) ([]string, map[string]*entities.ChatUser, error) {
-	chats, err := s.repo.GetUserChats(ctx, nickname)
+// GetUserChats returns registry entries of the user's chats ordered by ID and the user's membership in each
+func (s *Service) GetUserChats(ctx context.Context, nickname string) ([]*entities.Chat, map[string]*entities.ChatUser, error) {
+	chatIDs, err := s.repo.GetUserChats(ctx, nickname)
 	if err != nil {
 		return nil, nil, err
 	}
 
-	log.Println("Getting chat users for", nickname, "chats", chats)
+	log.Println("Getting chat users for", nickname, "chats", chatIDs)
 
-	chatUsers, err := s.repo.GetChatsUsers(ctx, nickname, chats)
+	chats, err := s.repo.GetChats(ctx, chatIDs)
 	if err != nil {
 		return nil, nil, err
 	}
 
-	return chats, chatUsers, nil
+	chatUsers, err := s.repo.GetChatsUsers(ctx, nickname, chatIDs)
+	if err != nil {
+		return nil, nil, err
+	}
+
+	return utils.MapSliceIf(chatIDs, func(chatID string) (*entities.Chat, bool) {
+		chat, ok := chats[chatID]
+		return chat, ok
+	}), chatUsers, nil
 }
 
 func (s *Service) SetMessagesRead(ctx context.Context, chatID, nickname string) error {
 	return s.repo.SetMessagesRead(ctx, chatID, nickname)
 }
 
+// CreateChat registers a chat whose ID is its name
 func (s *Service) CreateChat(ctx context.Context, name, nickname string) (string, error) {
-	existingChat, err := s.repo.GetChat(ctx, name)
-	if err != nil && !errors.Is(err, repository.ErrChatNotFound) {
-		return "", err
+	chat := &entities.Chat{
+		ID:        name,
+		Name:      name,
+		CreatedBy: nickname,
+		CreatedAt: time.Now(),
 	}
 
-	if existingChat != "" {
-		return "", ErrChatAlreadyExists
+	if err := s.repo.CreateChat(ctx, chat); err != nil {
+		if errors.Is(err, repository.ErrChatAlreadyExists) {
+			return "", ErrChatAlreadyExists
+		}
+
+		return "", err
 	}
 
-	return s.repo.CreateChat(ctx, name, nickname)
+	s.rooms.Join(chat.ID, nickname)
+	s.publishMembership(ctx, chat.ID, nickname, true)
+
+	return chat.ID, nil
 }
 
 func (s *Service) AddUserToChat(ctx context.Context, chatID, nickname string) error {
-	return s.repo.AddUserToChat(ctx, chatID, nickname)
+	if err := s.repo.AddUserToChat(ctx, chatID, nickname); err != nil {
+		return err
+	}
+
+	s.rooms.Join(chatID, nickname)
+	s.publishMembership(ctx, chatID, nickname, true)
+
+	return nil
 }
 
 func (s *Service) RemoveUserFromChat(ctx context.Context, chatID, nickname string) error {
-	return s.repo.RemoveUserFromChat(ctx, chatID, nickname)
+	if err := s.repo.RemoveUserFromChat(ctx, chatID, nickname); err != nil {
+		return err
+	}
+
+	s.rooms.Leave(chatID, nickname)
+	s.publishMembership(ctx, chatID, nickname, false)
+
+	return nil
 }
 
-func (s *Service) Broadcast(
-	ctx context.Context,
-	message entities.Message,
-	messageType generated.ChatMessageType,
-	streams map[string]generated.Messenger_ChatStreamServer,
-	mu *sync.RWMutex,
-) error {
-	users, err := s.repo.GetUsersByChatID(ctx, message.ChatID)
-	if err != nil {
-		return err
+// publishMembership tells the other instances about the change, the write itself has already succeeded
+func (s *Service) publishMembership(ctx context.Context, chatID, nickname string, joined bool) {
+	if s.cluster == nil {
+		return
 	}
 
-	var wg sync.WaitGroup
-	errorChan := make(chan error, len(users))
+	if err := s.cluster.PublishMembership(ctx, chatID, nickname, joined); err != nil {
+		log.Printf("Failed to publish membership of %s in chat %s: %v", nickname, chatID, err)
+	}
+}
 
-	for _, user := range users {
-		if user.Nickname == message.Nickname {
-			continue
-		}
+// ApplyMembership applies a membership change made on another instance
+func (s *Service) ApplyMembership(chatID, nickname string, joined bool) {
+	if joined {
+		s.rooms.Join(chatID, nickname)
+	} else {
+		s.rooms.Leave(chatID, nickname)
+	}
+}
 
-		wg.Add(1)
-		go func(userNickname string) {
-			defer wg.Done()
-
-			mu.RLock()
-			stream, ok := streams[userNickname]
-			mu.RUnlock()
-
-			if !ok {
-				return
-			}
-
-			log.Println("Sending message to user", userNickname, "message", message)
-
-			sendCtx, cancel := context.WithTimeout(context.Background(), 5*time.Second)
-			defer cancel()
-
-			select {
-			case <-sendCtx.Done():
-				log.Printf("Send context cancelled for user %s", userNickname)
-				errorChan <- sendCtx.Err()
-				return
-			default:
-				err := stream.Send(&generated.ChatMessage{
-					Id:        message.ID,
-					Content:   message.Content,
-					Nickname:  message.Nickname,
-					ChatId:    message.ChatID,
-					CreatedAt: message.CreatedAt.Format(time.RFC3339),
-					Type:      messageType,
-				})
-				if err != nil {
-					log.Printf("Failed to send message to user %s: %v", userNickname, err)
-
-					if err.Error() == "rpc error: code = Canceled desc = context canceled" ||
-						err.Error() == "rpc error: code = Unavailable desc = transport is closing" ||
-						err.Error() == "rpc error: code = DeadlineExceeded desc = context deadline exceeded" {
-						log.Printf("Removing closed stream for user %s", userNickname)
-						mu.Lock()
-						delete(streams, userNickname)
-						mu.Unlock()
-					} else {
-						log.Printf("Temporary error for user %s, keeping stream: %v", userNickname, err)
-					}
-					errorChan <- err
-				} else {
-					errorChan <- nil
-				}
-			}
-		}(user.Nickname)
-	}
-
-	wg.Wait()
-	close(errorChan)
-
-	hasErrors := false
-	for err := range errorChan {
-		if err != nil {
-			hasErrors = true
-		}
+// InvalidateChat drops the cached registry entry changed on another instance
+func (s *Service) InvalidateChat(chatID string) {
+	s.repo.InvalidateChat(chatID)
+}
+
+// OpenStream wraps the stream into a connection with its own bounded outbound queue
+func (s *Service) OpenStream(stream generated.Messenger_ChatStreamServer) *rooms.Connection {
+	return s.rooms.Open(stream)
+}
+
+// CloseStream stops the connection and disconnects the users registered on it
+func (s *Service) CloseStream(conn *rooms.Connection) {
+	s.rooms.Close(conn)
+}
+
+// ConnectStream adds conn to the sessions the user receives chat frames on
+func (s *Service) ConnectStream(nickname string, conn *rooms.Connection) {
+	s.rooms.Connect(nickname, conn)
+}
+
+// Broadcast sends the message to every session in the chat but origin, the sender's other devices get it too
+func (s *Service) Broadcast(ctx context.Context, origin *rooms.Connection, message entities.Message, messageType generated.ChatMessageType) error {
+	frame := toChatMessage(message, messageType)
+
+	return s.broadcastFrame(ctx, message.ChatID, origin, frame)
+}
+
+// BroadcastBatch fans a batch of one sender's messages out as a single MESSAGE_BATCH frame
+func (s *Service) BroadcastBatch(ctx context.Context, origin *rooms.Connection, messages []entities.Message) error {
+	if len(messages) == 0 {
+		return nil
 	}
 
-	if hasErrors {
-		log.Printf("Broadcast completed with some errors for chat %s", message.ChatID)
+	frame := &generated.ChatMessage{
+		Nickname:  messages[0].Nickname,
+		ChatId:    messages[0].ChatID,
+		CreatedAt: messages[0].CreatedAt.Format(time.RFC3339),
+		Type:      generated.ChatMessageType_MESSAGE_BATCH,
+		Seq:       messages[len(messages)-1].Seq,
+		Batch:     make([]*generated.ChatMessage, len(messages)),
 	}
 
-	return nil
+	for i, message := range messages {
+		frame.Batch[i] = toChatMessage(message, generated.ChatMessageType_MESSAGE)
+	}
+
+	return s.broadcastFrame(ctx, frame.ChatId, origin, frame)
+}
+
+func toChatMessage(message entities.Message, messageType generated.ChatMessageType) *generated.ChatMessage {
+	return &generated.ChatMessage{
+		Id:        message.ID,
+		Content:   message.Content,
+		Nickname:  message.Nickname,
+		ChatId:    message.ChatID,
+		CreatedAt: message.CreatedAt.Format(time.RFC3339),
+		Type:      messageType,
+		Seq:       message.Seq,
+	}
+}
+
+// broadcastFrame queues the frame to the local sessions of the chat and publishes it to the other instances.
+// It never waits for a recipient: a full queue is handled by the connection overflow policy.
+func (s *Service) broadcastFrame(ctx context.Context, chatID string, origin *rooms.Connection, frame *generated.ChatMessage) error {
+	ctx, span := s.tracer.Start(ctx, "Broadcast",
+		tracing.Attribute{Key: "chat_id", Value: chatID},
+		tracing.Attribute{Key: "type", Value: frame.Type.String()},
+	)
+	defer span.End()
+
+	s.deliver(span, chatID, origin, frame)
+
+	if s.cluster == nil {
+		return nil
+	}
+
+	err := s.cluster.PublishFrame(ctx, chatID, frame)
+	span.RecordError(err)
+
+	return err
+}
+
+// DeliverRemote queues a frame broadcast on another instance to the local sessions of its chat
+func (s *Service) DeliverRemote(ctx context.Context, frame *generated.ChatMessage) {
+	// Like stream frames, only traced broadcasts get a span here
+	var span *tracing.Span
+	if parent, ok := tracing.ParseSpanContext(frame.TraceId, frame.SpanId); ok {
+		_, span = s.tracer.StartRemote(ctx, "Broadcast.remote", tracing.SpanKindConsumer, parent,
+			tracing.Attribute{Key: "chat_id", Value: frame.ChatId},
+			tracing.Attribute{Key: "type", Value: frame.Type.String()},
+		)
+	}
+	defer span.End()
+
+	s.deliver(span, frame.ChatId, nil, frame)
+}
+
+func (s *Service) deliver(span *tracing.Span, chatID string, origin *rooms.Connection, frame *generated.ChatMessage) {
+	// Receivers continue the trace from the delivering span
+	if sc := span.Context(); sc.IsValid() {
+		frame.TraceId = sc.TraceID.String()
+		frame.SpanId = sc.SpanID.String()
+	}
+
+	recipients := s.rooms.Recipients(chatID, origin)
+
+	span.SetAttribute("recipients", len(recipients))
+
+	results := make(map[rooms.OfferResult]int)
+	for _, recipient := range recipients {
+		result := recipient.Conn.Offer(frame)
+		results[result]++
+
+		if result == rooms.Disconnected {
+			log.Printf("Outbound queue of user %s overflowed, disconnecting", recipient.Nickname)
+		}
+	}
+
+	for result, count := range results {
+		if result != rooms.Queued {
+			span.SetAttribute(string(result), count)
+		}
+	}
 }
 
 func (s *Service) SetTTLToChat(ctx context.Context, chatID string, ttl int32) error {
-	return s.repo.SetTTLToChat(ctx, chatID, ttl)
+	if err := s.repo.SetTTLToChat(ctx, chatID, ttl); err != nil {
+		return err
+	}
+
+	if s.cluster != nil {
+		if err := s.cluster.PublishChatChanged(ctx, chatID); err != nil {
+			log.Printf("Failed to publish TTL change of chat %s: %v", chatID, err)
+		}
+	}
+
+	return nil
 }
@@ -0,0 +1,268 @@
+package tracing
+
+import (
+	"bufio"
+	"encoding/json"
+	"fmt"
+	"log"
+	"os"
+	"strconv"
+	"sync/atomic"
+	"time"
+
+	"github.com/kuzin57/grpc-chat/server/internal/config"
+)
+
+const (
+	defaultServiceName   = "grpc-chat-server"
+	spanQueueSize        = 4096
+	exportBatchSize      = 512
+	exportFlushInterval  = time.Second
+	instrumentationScope = "github.com/kuzin57/grpc-chat/server/internal/tracing"
+)
+
+// NewTracer returns nil when tracing is disabled in config
+func NewTracer(cfg config.TracingConfig) (*Tracer, error) {
+	if cfg.File == "" {
+		return nil, nil
+	}
+
+	file, err := os.OpenFile(cfg.File, os.O_CREATE|os.O_WRONLY|os.O_APPEND, 0o644)
+	if err != nil {
+		return nil, fmt.Errorf("failed to open trace file: %w", err)
+	}
+
+	serviceName := cfg.ServiceName
+	if serviceName == "" {
+		serviceName = defaultServiceName
+	}
+
+	exporter := &fileExporter{
+		file:        file,
+		serviceName: serviceName,
+		spans:       make(chan *Span, spanQueueSize),
+		stop:        make(chan struct{}),
+		done:        make(chan struct{}),
+	}
+
+	go exporter.run()
+
+	return &Tracer{exporter: exporter}, nil
+}
+
+// fileExporter writes spans as OTLP-JSON, one ExportTraceServiceRequest per line,
+// the format read by the OpenTelemetry collector's otlpjsonfile receiver
+type fileExporter struct {
+	file        *os.File
+	serviceName string
+	spans       chan *Span
+	stop        chan struct{}
+	done        chan struct{}
+	dropped     atomic.Int64
+	closed      atomic.Bool
+}
+
+func (e *fileExporter) enqueue(span *Span) {
+	if e.closed.Load() {
+		return
+	}
+
+	// Tracing must never slow down message delivery: drop spans when the writer falls behind
+	select {
+	case e.spans <- span:
+	default:
+		if e.dropped.Add(1)%1000 == 1 {
+			log.Printf("Trace exporter queue is full, %d spans dropped", e.dropped.Load())
+		}
+	}
+}
+
+func (e *fileExporter) run() {
+	defer close(e.done)
+
+	var (
+		writer = bufio.NewWriter(e.file)
+		ticker = time.NewTicker(exportFlushInterval)
+		batch  = make([]*Span, 0, exportBatchSize)
+	)
+
+	defer ticker.Stop()
+
+	flush := func() {
+		if len(batch) == 0 {
+			return
+		}
+
+		if err := e.write(writer, batch); err != nil {
+			log.Printf("Failed to export %d spans: %v", len(batch), err)
+		}
+
+		batch = batch[:0]
+	}
+
+	for {
+		select {
+		case span := <-e.spans:
+			batch = append(batch, span)
+			if len(batch) == exportBatchSize {
+				flush()
+			}
+		case <-ticker.C:
+			flush()
+		case <-e.stop:
+			// Spans ended after stop are dropped, the channel is never closed under the senders
+			for {
+				select {
+				case span := <-e.spans:
+					batch = append(batch, span)
+					if len(batch) == exportBatchSize {
+						flush()
+					}
+				default:
+					flush()
+					return
+				}
+			}
+		}
+	}
+}
+
+func (e *fileExporter) write(writer *bufio.Writer, batch []*Span) error {
+	line, err := json.Marshal(e.request(batch))
+	if err != nil {
+		return err
+	}
+
+	if _, err := writer.Write(append(line, '\n')); err != nil {
+		return err
+	}
+
+	return writer.Flush()
+}
+
+func (e *fileExporter) close() error {
+	if !e.closed.CompareAndSwap(false, true) {
+		return nil
+	}
+
+	close(e.stop)
+	<-e.done
+
+	return e.file.Close()
+}
+
+type otlpRequest struct {
+	ResourceSpans []otlpResourceSpans `json:"resourceSpans"`
+}
+
+type otlpResourceSpans struct {
+	Resource   otlpResource     `json:"resource"`
+	ScopeSpans []otlpScopeSpans `json:"scopeSpans"`
+}
+
+type otlpResource struct {
+	Attributes []otlpAttribute `json:"attributes"`
+}
+
+type otlpScopeSpans struct {
+	Scope otlpScope  `json:"scope"`
+	Spans []otlpSpan `json:"spans"`
+}
+
+type otlpScope struct {
+	Name string `json:"name"`
+}
+
+type otlpSpan struct {
+	TraceID           string          `json:"traceId"`
+	SpanID            string          `json:"spanId"`
+	ParentSpanID      string          `json:"parentSpanId,omitempty"`
+	Name              string          `json:"name"`
+	Kind              SpanKind        `json:"kind"`
+	StartTimeUnixNano string          `json:"startTimeUnixNano"`
+	EndTimeUnixNano   string          `json:"endTimeUnixNano"`
+	Attributes        []otlpAttribute `json:"attributes,omitempty"`
+	Status            *otlpStatus     `json:"status,omitempty"`
+}
+
+type otlpStatus struct {
+	Code int `json:"code"`
+}
+
+type otlpAttribute struct {
+	Key   string    `json:"key"`
+	Value otlpValue `json:"value"`
+}
+
+type otlpValue struct {
+	StringValue *string `json:"stringValue,omitempty"`
+	IntValue    *string `json:"intValue,omitempty"`
+	BoolValue   *bool   `json:"boolValue,omitempty"`
+}
+
+const otlpStatusError = 2
+
+func (e *fileExporter) request(batch []*Span) otlpRequest {
+	spans := make([]otlpSpan, len(batch))
+	for i, span := range batch {
+		spans[i] = otlpSpan{
+			TraceID:           span.context.TraceID.String(),
+			SpanID:            span.context.SpanID.String(),
+			Name:              span.name,
+			Kind:              span.kind,
+			StartTimeUnixNano: strconv.FormatInt(span.start.UnixNano(), 10),
+			EndTimeUnixNano:   strconv.FormatInt(span.end.UnixNano(), 10),
+			Attributes:        toOTLPAttributes(span.attributes),
+		}
+
+		if span.parentID != (SpanID{}) {
+			spans[i].ParentSpanID = span.parentID.String()
+		}
+
+		if span.failed {
+			spans[i].Status = &otlpStatus{Code: otlpStatusError}
+		}
+	}
+
+	return otlpRequest{
+		ResourceSpans: []otlpResourceSpans{{
+			Resource: otlpResource{
+				Attributes: toOTLPAttributes([]Attribute{{Key: "service.name", Value: e.serviceName}}),
+			},
+			ScopeSpans: []otlpScopeSpans{{
+				Scope: otlpScope{Name: instrumentationScope},
+				Spans: spans,
+			}},
+		}},
+	}
+}
+
+func toOTLPAttributes(attributes []Attribute) []otlpAttribute {
+	result := make([]otlpAttribute, 0, len(attributes))
+	for _, attribute := range attributes {
+		var value otlpValue
+
+		switch v := attribute.Value.(type) {
+		case string:
+			value.StringValue = &v
+		case bool:
+			value.BoolValue = &v
+		case int:
+			s := strconv.Itoa(v)
+			value.IntValue = &s
+		case int32:
+			s := strconv.FormatInt(int64(v), 10)
+			value.IntValue = &s
+		case int64:
+			s := strconv.FormatInt(v, 10)
+			value.IntValue = &s
+		default:
+			s := fmt.Sprint(v)
+			value.StringValue = &s
+		}
+
+		result = append(result, otlpAttribute{Key: attribute.Key, Value: value})
+	}
+
+	return result
+}
@@ -0,0 +1,68 @@
+package tracing
+
+import (
+	"context"
+	"fmt"
+	"path"
+	"strings"
+
+	"google.golang.org/grpc"
+	"google.golang.org/grpc/metadata"
+	"google.golang.org/grpc/status"
+)
+
+// TraceparentHeader is the W3C Trace Context header carried in gRPC metadata
+const TraceparentHeader = "traceparent"
+
+// ParseTraceparent parses "00-<trace_id>-<span_id>-<flags>"
+func ParseTraceparent(value string) (SpanContext, bool) {
+	parts := strings.Split(value, "-")
+	if len(parts) != 4 || parts[0] != "00" {
+		return SpanContext{}, false
+	}
+
+	return ParseSpanContext(parts[1], parts[2])
+}
+
+func FormatTraceparent(sc SpanContext) string {
+	return fmt.Sprintf("00-%s-%s-01", sc.TraceID, sc.SpanID)
+}
+
+// SpanContextFromIncoming reads the caller's span from the request metadata
+func SpanContextFromIncoming(ctx context.Context) (SpanContext, bool) {
+	md, ok := metadata.FromIncomingContext(ctx)
+	if !ok {
+		return SpanContext{}, false
+	}
+
+	values := md.Get(TraceparentHeader)
+	if len(values) == 0 {
+		return SpanContext{}, false
+	}
+
+	return ParseTraceparent(values[0])
+}
+
+// UnaryServerInterceptor records a server span per unary call, continuing the caller's trace if it sent one
+func UnaryServerInterceptor(tracer *Tracer) grpc.UnaryServerInterceptor {
+	return func(ctx context.Context, req any, info *grpc.UnaryServerInfo, handler grpc.UnaryHandler) (any, error) {
+		if tracer == nil {
+			return handler(ctx, req)
+		}
+
+		parent, _ := SpanContextFromIncoming(ctx)
+
+		ctx, span := tracer.StartRemote(ctx, path.Base(info.FullMethod), SpanKindServer, parent,
+			Attribute{Key: "rpc.system", Value: "grpc"},
+			Attribute{Key: "rpc.method", Value: info.FullMethod},
+		)
+		defer span.End()
+
+		resp, err := handler(ctx, req)
+
+		span.SetAttribute("rpc.grpc.status_code", int(status.Code(err)))
+		span.RecordError(err)
+
+		return resp, err
+	}
+}
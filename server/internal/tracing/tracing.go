@@ -0,0 +1,202 @@
+package tracing
+
+import (
+	"context"
+	"crypto/rand"
+	"encoding/hex"
+	"sync"
+	"time"
+)
+
+type SpanKind int
+
+// Values follow OTLP SpanKind
+const (
+	SpanKindInternal SpanKind = 1
+	SpanKindServer   SpanKind = 2
+	SpanKindClient   SpanKind = 3
+	SpanKindProducer SpanKind = 4
+	SpanKindConsumer SpanKind = 5
+)
+
+type TraceID [16]byte
+
+type SpanID [8]byte
+
+func (id TraceID) String() string { return hex.EncodeToString(id[:]) }
+
+func (id SpanID) String() string { return hex.EncodeToString(id[:]) }
+
+type SpanContext struct {
+	TraceID TraceID
+	SpanID  SpanID
+}
+
+func (sc SpanContext) IsValid() bool {
+	return sc.TraceID != TraceID{} && sc.SpanID != SpanID{}
+}
+
+// ParseSpanContext builds a span context from the hex ids carried in ChatMessage
+func ParseSpanContext(traceID, spanID string) (SpanContext, bool) {
+	var sc SpanContext
+
+	if len(traceID) != 2*len(sc.TraceID) || len(spanID) != 2*len(sc.SpanID) {
+		return SpanContext{}, false
+	}
+
+	if _, err := hex.Decode(sc.TraceID[:], []byte(traceID)); err != nil {
+		return SpanContext{}, false
+	}
+
+	if _, err := hex.Decode(sc.SpanID[:], []byte(spanID)); err != nil {
+		return SpanContext{}, false
+	}
+
+	return sc, sc.IsValid()
+}
+
+type spanContextKey struct{}
+
+func ContextWithSpanContext(ctx context.Context, sc SpanContext) context.Context {
+	if !sc.IsValid() {
+		return ctx
+	}
+
+	return context.WithValue(ctx, spanContextKey{}, sc)
+}
+
+func SpanContextFromContext(ctx context.Context) SpanContext {
+	sc, _ := ctx.Value(spanContextKey{}).(SpanContext)
+	return sc
+}
+
+type Attribute struct {
+	Key   string
+	Value any
+}
+
+type Span struct {
+	tracer     *Tracer
+	name       string
+	kind       SpanKind
+	context    SpanContext
+	parentID   SpanID
+	start      time.Time
+	end        time.Time
+	attributes []Attribute
+	failed     bool
+	once       sync.Once
+}
+
+// Context returns the span context, zero for a nil span
+func (s *Span) Context() SpanContext {
+	if s == nil {
+		return SpanContext{}
+	}
+
+	return s.context
+}
+
+func (s *Span) SetAttribute(key string, value any) {
+	if s == nil {
+		return
+	}
+
+	s.attributes = append(s.attributes, Attribute{Key: key, Value: value})
+}
+
+func (s *Span) RecordError(err error) {
+	if s == nil || err == nil {
+		return
+	}
+
+	s.failed = true
+	s.attributes = append(s.attributes, Attribute{Key: "error", Value: err.Error()})
+}
+
+func (s *Span) End() {
+	if s == nil {
+		return
+	}
+
+	s.once.Do(func() {
+		s.end = time.Now()
+		s.tracer.export(s)
+	})
+}
+
+// Tracer records spans and hands them to the exporter. A nil *Tracer is valid and records nothing.
+type Tracer struct {
+	exporter *fileExporter
+}
+
+// Start opens a child of the span in ctx. Without a parent nothing is recorded and the span is nil,
+// so frames that came without trace context do not start traces of their own.
+func (t *Tracer) Start(ctx context.Context, name string, attributes ...Attribute) (context.Context, *Span) {
+	parent := SpanContextFromContext(ctx)
+	if t == nil || !parent.IsValid() {
+		return ctx, nil
+	}
+
+	return t.start(ctx, name, SpanKindInternal, parent, attributes)
+}
+
+// StartRemote opens a span under a parent received from another process, or a new trace if the parent is invalid
+func (t *Tracer) StartRemote(
+	ctx context.Context,
+	name string,
+	kind SpanKind,
+	parent SpanContext,
+	attributes ...Attribute,
+) (context.Context, *Span) {
+	if t == nil {
+		return ctx, nil
+	}
+
+	return t.start(ctx, name, kind, parent, attributes)
+}
+
+func (t *Tracer) start(
+	ctx context.Context,
+	name string,
+	kind SpanKind,
+	parent SpanContext,
+	attributes []Attribute,
+) (context.Context, *Span) {
+	span := &Span{
+		tracer:     t,
+		name:       name,
+		kind:       kind,
+		start:      time.Now(),
+		attributes: attributes,
+	}
+
+	if parent.IsValid() {
+		span.context.TraceID = parent.TraceID
+		span.parentID = parent.SpanID
+	} else {
+		_, _ = rand.Read(span.context.TraceID[:])
+	}
+
+	_, _ = rand.Read(span.context.SpanID[:])
+
+	return ContextWithSpanContext(ctx, span.context), span
+}
+
+func (t *Tracer) export(span *Span) {
+	t.exporter.enqueue(span)
+}
+
+// Close flushes the spans that are still buffered
+func (t *Tracer) Close() error {
+	if t == nil {
+		return nil
+	}
+
+	return t.exporter.close()
+}
+
+// Detached keeps only the span of ctx, for work that outlives the request such as broadcasts
+func Detached(ctx context.Context) context.Context {
+	return ContextWithSpanContext(context.Background(), SpanContextFromContext(ctx))
+}
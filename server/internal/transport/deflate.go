@@ -0,0 +1,29 @@
+package transport
+
+import (
+	"compress/zlib"
+	"io"
+
+	"google.golang.org/grpc/encoding"
+)
+
+// grpc-go ships only gzip, Python and C++ clients also speak "deflate" (zlib framing)
+const deflateName = "deflate"
+
+func init() {
+	encoding.RegisterCompressor(deflateCompressor{})
+}
+
+type deflateCompressor struct{}
+
+func (deflateCompressor) Compress(w io.Writer) (io.WriteCloser, error) {
+	return zlib.NewWriter(w), nil
+}
+
+func (deflateCompressor) Decompress(r io.Reader) (io.Reader, error) {
+	return zlib.NewReader(r)
+}
+
+func (deflateCompressor) Name() string {
+	return deflateName
+}
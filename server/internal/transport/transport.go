@@ -0,0 +1,100 @@
+package transport
+
+import (
+	"context"
+	"fmt"
+	"path"
+	"slices"
+
+	"github.com/kuzin57/grpc-chat/server/internal/config"
+	"google.golang.org/grpc"
+	"google.golang.org/grpc/encoding"
+	_ "google.golang.org/grpc/encoding/gzip"
+	"google.golang.org/grpc/keepalive"
+)
+
+// ServerOptions builds grpc.Server options from the grpc section of the config
+func ServerOptions(cfg config.GRPCConfig) ([]grpc.ServerOption, error) {
+	if cfg.Compression != "" && encoding.GetCompressor(cfg.Compression) == nil {
+		return nil, fmt.Errorf("unknown compression %q", cfg.Compression)
+	}
+
+	var options []grpc.ServerOption
+
+	if cfg.MaxRecvMsgSize > 0 {
+		options = append(options, grpc.MaxRecvMsgSize(cfg.MaxRecvMsgSize))
+	}
+
+	if cfg.MaxSendMsgSize > 0 {
+		options = append(options, grpc.MaxSendMsgSize(cfg.MaxSendMsgSize))
+	}
+
+	// A fixed window turns off BDP-based window estimation
+	if cfg.WindowSize > 0 {
+		options = append(options, grpc.InitialWindowSize(cfg.WindowSize))
+	}
+
+	if cfg.ConnWindowSize > 0 {
+		options = append(options, grpc.InitialConnWindowSize(cfg.ConnWindowSize))
+	}
+
+	options = append(options,
+		grpc.KeepaliveParams(keepalive.ServerParameters{
+			Time:    cfg.Keepalive.Time,
+			Timeout: cfg.Keepalive.Timeout,
+		}),
+		grpc.KeepaliveEnforcementPolicy(keepalive.EnforcementPolicy{
+			MinTime:             cfg.Keepalive.MinTime,
+			PermitWithoutStream: cfg.Keepalive.PermitWithoutStream,
+		}),
+	)
+
+	return options, nil
+}
+
+// Compressor picks the response compressor per method
+type Compressor struct {
+	name    string
+	methods []string
+}
+
+func NewCompressor(cfg config.GRPCConfig) *Compressor {
+	return &Compressor{
+		name:    cfg.Compression,
+		methods: cfg.CompressedMethods,
+	}
+}
+
+// apply sets the send compressor if the method is configured for it and the client can decode it
+func (c *Compressor) apply(ctx context.Context, fullMethod string) error {
+	if c.name == "" || !slices.Contains(c.methods, path.Base(fullMethod)) {
+		return nil
+	}
+
+	supported, err := grpc.ClientSupportedCompressors(ctx)
+	if err != nil || !slices.Contains(supported, c.name) {
+		return nil
+	}
+
+	return grpc.SetSendCompressor(ctx, c.name)
+}
+
+func (c *Compressor) UnaryServerInterceptor() grpc.UnaryServerInterceptor {
+	return func(ctx context.Context, req any, info *grpc.UnaryServerInfo, handler grpc.UnaryHandler) (any, error) {
+		if err := c.apply(ctx, info.FullMethod); err != nil {
+			return nil, err
+		}
+
+		return handler(ctx, req)
+	}
+}
+
+func (c *Compressor) StreamServerInterceptor() grpc.StreamServerInterceptor {
+	return func(srv any, ss grpc.ServerStream, info *grpc.StreamServerInfo, handler grpc.StreamHandler) error {
+		if err := c.apply(ss.Context(), info.FullMethod); err != nil {
+			return err
+		}
+
+		return handler(srv, ss)
+	}
+}
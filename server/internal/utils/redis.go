@@ -10,6 +10,11 @@ const (
 	userNicknameKeyPosition = 2
 )
 
+// BuildChatKey is the chat registry hash with name and metadata
+func BuildChatKey(chatID string) string {
+	return fmt.Sprintf("chat:%s", chatID)
+}
+
 func BuildChatUserKey(chatID, nickname string) string {
 	return fmt.Sprintf("chat_user:%s:%s", chatID, nickname)
 }
@@ -22,6 +27,20 @@ func BuildChatUserPatternByUser(nickname string) string {
 	return fmt.Sprintf("chat_user:*:%s", nickname)
 }
 
+// BuildUserChatsKey is the set of chat IDs the user is a member of
+func BuildUserChatsKey(nickname string) string {
+	return fmt.Sprintf("user_chats:%s", nickname)
+}
+
+// BuildChatMembersKey is the set of nicknames of the chat members
+func BuildChatMembersKey(chatID string) string {
+	return fmt.Sprintf("chat_members:%s", chatID)
+}
+
+func ExtractChatIDFromChatMembersKey(key string) string {
+	return strings.TrimPrefix(key, BuildChatMembersKey(""))
+}
+
 func ExtractChatIDFromChatUserKey(key string) string {
 	return strings.Split(key, ":")[chatIDKeyPosition]
 }
@@ -34,6 +53,10 @@ func BuildChatMessageKey(chatID, messageID string) string {
 	return fmt.Sprintf("chat_message:%s:%s", chatID, messageID)
 }
 
-func BuildChatMessagePatternByChat(chatID string) string {
-	return fmt.Sprintf("chat_message:%s:*", chatID)
+func BuildChatMessagesIndexKey(chatID string) string {
+	return fmt.Sprintf("chat_messages:%s", chatID)
+}
+
+func BuildChatMessageSeqKey(chatID string) string {
+	return fmt.Sprintf("chat_message_seq:%s", chatID)
 }